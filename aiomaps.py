@@ -0,0 +1,299 @@
+"""
+asyncio versions of the pymaps wrappers.
+
+The coroutines start the MAPS programs as child processes, wait for them and
+stream their output into the log files on the event loop, and kill the
+child process when they are cancelled or time out. A `Runner` bounds the
+number of jobs in flight, so one controller process can drive many external
+MAPS jobs without spending an OS process per job just to wait on a child.
+
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import asyncio
+from subprocess import Popen, PIPE, STDOUT
+
+from . import driftscan, pymaps
+
+
+_CHUNK = 2 ** 16
+_TAIL = 2 ** 16
+
+
+class _Stream(object):
+    """
+    Copy a child's output stream to a file and/or the terminal as it
+    arrives, keeping the last few bytes in memory.
+
+    """
+    def __init__(self, filename=None, echo=False, always=False):
+        self.filename = filename
+        self.echo = echo
+        self.tail = b''
+        self._file = None
+        if always and filename is not None:
+            self._file = open(filename, 'wb')
+
+    def write(self, chunk):
+        if self.echo:
+            sys.stdout.write(chunk.decode('utf-8', 'replace'))
+            sys.stdout.flush()
+        if self.filename is not None:
+            if self._file is None:
+                self._file = open(self.filename, 'wb')
+            self._file.write(chunk)
+        self.tail = (self.tail + chunk)[-_TAIL:]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    async def pump(self, reader):
+        try:
+            while True:
+                chunk = await reader.read(_CHUNK)
+                if not chunk:
+                    break
+                self.write(chunk)
+        finally:
+            self.close()
+
+
+async def _wait(proc, usage=None):
+    """
+    Coroutine version of `pymaps._wait`: wait for a child without blocking
+    the event loop (on its pidfd where there is one, in the default
+    executor otherwise) and reap it with `os.wait4`.
+
+    """
+    loop = asyncio.get_running_loop()
+    if hasattr(os, 'pidfd_open'):
+        fd = os.pidfd_open(proc.pid)
+        try:
+            exited = loop.create_future()
+            loop.add_reader(fd, lambda: exited.done() or
+                            exited.set_result(None))
+            try:
+                await exited
+            finally:
+                loop.remove_reader(fd)
+        finally:
+            os.close(fd)
+        return pymaps._wait(proc, usage)
+    return await loop.run_in_executor(None, pymaps._wait, proc, usage)
+
+
+async def _reader(loop, pipe):
+    reader = asyncio.StreamReader(limit=_CHUNK)
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    return reader, transport
+
+
+async def _run(cmd, out, err=None, timeout=None, usage=None):
+    """
+    Run a command, stream its stdout to `out` and its stderr to `err`
+    (merged into stdout if `err` is None), and return its exit code.
+
+    The child is started with `subprocess.Popen` rather than
+    `asyncio.create_subprocess_exec`, whose child watcher would reap it
+    before its resource usage can be read (see `pymaps._wait`).
+
+    """
+    loop = asyncio.get_running_loop()
+    proc = Popen(cmd, stdout=PIPE, stderr=STDOUT if err is None else PIPE)
+    transports = []
+    try:
+        pumps = []
+        for stream, pipe in ((out, proc.stdout), (err, proc.stderr)):
+            if stream is not None:
+                reader, transport = await _reader(loop, pipe)
+                transports.append(transport)
+                pumps.append(stream.pump(reader))
+        await asyncio.wait_for(asyncio.gather(_wait(proc, usage), *pumps),
+                               timeout)
+    except BaseException:
+        if proc.returncode is None:
+            proc.kill()
+            try:
+                await _wait(proc)
+            except ChildProcessError:
+                pass
+        raise
+    finally:
+        for transport in transports:
+            transport.close()
+    return proc.returncode
+
+
+async def im2uv(fitsfile, vis=None, normalizer=None, padzeropixels=None,
+                verbose=True, timeout=None, usage=None):
+    """
+    Coroutine version of `pymaps.im2uv` (maps_im2uv backend).
+
+    Parameters are the same as `pymaps.im2uv`. With `timeout` [second],
+    the child is killed and `asyncio.TimeoutError` is raised when it runs
+    longer than that.
+
+    """
+    if vis is None:
+        vis = fitsfile.rsplit('/', 1)[-1][0:-5] + '.dat'
+    cmd = pymaps._im2uv_cmd(fitsfile, vis, normalizer, padzeropixels)
+    if verbose:
+        out = _Stream(echo=True)
+    else:
+        out = _Stream(vis.rsplit('/', 1)[-1][0:-4] + '.im2uvlog')
+    await _run(cmd, out, timeout=timeout, usage=usage)
+    return vis
+
+
+async def maps2uvfits(vis, uvfits=None, site='MWA_128', arrayloc=None,
+                      arrayconf=None, verbose=True, timeout=None, usage=None):
+    """
+    Coroutine version of `pymaps.maps2uvfits`.
+
+    """
+    cmd = pymaps._maps2uvfits_cmd(vis, uvfits, site, arrayloc, arrayconf)
+    if verbose:
+        out = _Stream(echo=True)
+    else:
+        out = _Stream(vis.rsplit('/', 1)[-1][0:-4] + '.maps2uvfitslog')
+    await _run(cmd, out, timeout=timeout, usage=usage)
+    return cmd[2]
+
+
+async def visgen(prefix, spec, oobs=None, uvgrid=None, site='MWA_128', mpi=1,
+                 timeout=None, log_prefix=None, usage=None):
+    """
+    Coroutine version of `pymaps.visgen`.
+
+    stdout is streamed to (log_prefix + '.vislog') and stderr, if any, to
+    (log_prefix + '.viserr'), in which case `pymaps._VisgenError` is raised
+    with the tail of stderr. log_prefix defaults to prefix.
+
+    """
+    if log_prefix is None:
+        log_prefix = prefix
+    cmd = pymaps._visgen_cmd(prefix, spec, oobs, uvgrid, site, mpi)
+    out = _Stream(log_prefix + '.vislog', always=True)
+    err = _Stream(log_prefix + '.viserr')
+    await _run(cmd, out, err, timeout=timeout, usage=usage)
+    if err.tail:
+        raise pymaps._VisgenError(err.tail.decode('utf-8', 'replace'),
+                                  log_prefix + '.viserr')
+    return prefix + '.vis'
+
+
+_LAUNCH = {'im2uv': im2uv, 'visgen': visgen, 'maps2uvfits': maps2uvfits}
+
+
+async def _step(steps, value=None, exc=None):
+    """
+    `driftscan._step` in the default executor. A step is not interrupted
+    when the coroutine is cancelled: it is waited for, and the stage is
+    then closed so that it releases its locks and temporary files.
+
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(None, driftscan._step, steps, value, exc)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        try:
+            done, _ = await future
+        except Exception:
+            done = True
+        if not done:
+            await loop.run_in_executor(None, steps.close)
+        raise
+
+
+async def _drive(steps, timeout=None):
+    """
+    Coroutine version of `driftscan._drive`. The steps between launches run
+    in the default executor, so that preparing and finishing a stage (cache
+    locks and digests, oobs culls, size estimates) does not block the event
+    loop, and each launch runs as an async subprocess.
+
+    """
+    done, out = await _step(steps)
+    while not done:
+        try:
+            result = await _LAUNCH[out.program](*out.args, timeout=timeout,
+                                                **out.kwargs)
+        except BaseException as e:
+            done, out = await _step(steps, exc=e)
+        else:
+            done, out = await _step(steps, result)
+    return out
+
+
+async def run_drift(drift, mpi=1, timeout=None):
+    """
+    Coroutine version of `driftscan.Drift.run`.
+
+    The drift runs the same stages as `Drift.run`, with the MAPS programs
+    started as async subprocesses and everything else in a worker thread.
+    Stages that are up to date in the drift's manifest are skipped.
+
+    """
+    await _drive(drift._run_steps(mpi), timeout)
+    return drift
+
+
+class Runner(object):
+    """
+    Bounded-concurrency runner of MAPS coroutines.
+
+    Parameters
+    ----------
+    limit: int, optional
+        Maximum number of jobs in flight at any time.
+
+    """
+    def __init__(self, limit=64):
+        self.limit = limit
+        self._sem = None
+
+    async def submit(self, coro):
+        """
+        Await a coroutine once a slot is free.
+
+        """
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.limit)
+        async with self._sem:
+            return await coro
+
+    async def gather(self, coros):
+        """
+        Run coroutines with at most `limit` in flight. Exceptions are
+        returned in place of the results of the jobs that failed.
+
+        """
+        return await asyncio.gather(*[self.submit(c) for c in coros],
+                                    return_exceptions=True)
+
+    def run(self, coros):
+        """
+        Blocking entry point; run coroutines in a new event loop.
+
+        """
+        return asyncio.run(self.gather(coros))
+
+
+def batch_drift(instance, limit=64, mpi=1, timeout=None):
+    """
+    Run drifts from one process with at most `limit` in flight.
+
+    Return
+    ------
+    out: list
+        The drift, or the exception that stopped it, for each input drift.
+
+    """
+    runner = Runner(limit)
+    return runner.run([run_drift(d, mpi=mpi, timeout=timeout)
+                       for d in instance])
@@ -4,12 +4,8 @@ Routines for astronomical related calculation.
 """
 from __future__ import print_function, division
 
-import datetime
-
 import numpy as np
 
-import astropy.units as u
-
 
 def beam_area(*args):
     """
@@ -44,41 +40,109 @@ def beam_area(*args):
     return np.pi * bmaj * bmin / (4 * np.log(2))
 
 
+def _sexagesimal(value, unit):
+    """
+    Split (arrays of) decimal values into whole units, minutes and seconds.
+
+    """
+    minutes, seconds = np.divmod(np.abs(value) * unit, 60)
+    units, minutes = np.divmod(minutes, 60)
+    return units, minutes, seconds
+
+
+def _join(*parts):
+    out = parts[0]
+    for p in parts[1:]:
+        out = np.char.add(out, p)
+    return out
+
+
+def _scalar_or_array(out, like):
+    if np.ndim(like) == 0:
+        return str(np.asarray(out)[()])
+    return out
+
+
 def h2hms24(h):
     """
     Convert decimal hours to hh:mm:ss, rounding value to +0h to +24h.
 
+    `h` may be an array, in which case an array of strings is returned.
+
     """
-    hm, seconds = divmod((h % 24) * 3600, 60)
-    hours, minutes = divmod(hm, 60)
-    return '{:02.0f}:{:02.0f}:{:02.3f}'.format(hours, minutes, seconds)
+    h = np.asarray(h, dtype=float)
+    hours, minutes, seconds = _sexagesimal(h % 24, 3600)
+    out = _join(np.char.mod('%02.0f:', hours), np.char.mod('%02.0f:', minutes),
+                np.char.mod('%02.3f', seconds))
+    return _scalar_or_array(out, h)
 
 
 def h2hms_signed(h):
     """
     Convert decimal hours to hh:mm:ss, rounding value to -24h to +24h.
 
+    The format is that of `datetime.timedelta`, i.e. h:mm:ss with a
+    .ffffff fraction only when there are microseconds. `h` may be an array.
+
     """
-    inverse = ''
-    if h < 0:
-        inverse = '-'
-    hms = str(datetime.timedelta(hours=abs(h))).rsplit(', ')[-1]
-    return inverse + hms
+    h = np.asarray(h, dtype=float)
+    usec = np.round(np.abs(h) * 3600 * 1e6).astype(np.int64) % 86400000000
+    sec, usec = np.divmod(usec, 1000000)
+    hours, sec = np.divmod(sec, 3600)
+    minutes, sec = np.divmod(sec, 60)
+    frac = np.where(usec > 0, np.char.mod('.%06d', usec), '')
+    out = _join(np.where(h < 0, '-', ''), np.char.mod('%d:', hours),
+                np.char.mod('%02d:', minutes), np.char.mod('%02d', sec), frac)
+    return _scalar_or_array(out, h)
 
 
 def d2dms(d, delimiter=':', precision=6):
     """
     Convert decimal degrees to dd:mm:ss
 
+    `d` may be an array, in which case an array of strings is returned.
+
+    """
+    d = np.asarray(d, dtype=float)
+    degrees, minutes, seconds = _sexagesimal(d, 3600)
+    delimiter = delimiter.replace('%', '%%')
+    out = _join(np.where(d < 0, '-', ''),
+                np.char.mod('%.0f' + delimiter, degrees),
+                np.char.mod('%02.0f' + delimiter, minutes),
+                np.char.mod('%0{0:d}.{1:d}f'.format(3 + precision, precision),
+                            seconds))
+    return _scalar_or_array(out, d)
+
+
+def _parse_sexagesimal(s):
+    s = np.asarray(s, dtype=str)
+    out = np.empty(s.shape)
+    for i, v in np.ndenumerate(s):
+        v = v.strip()
+        parts = [abs(float(p)) for p in v.replace(' ', ':').split(':') if p]
+        value = sum(p / 60. ** k for k, p in enumerate(parts))
+        out[i] = -value if v.startswith('-') else value
+    if out.ndim == 0:
+        return float(out)
+    return out
+
+
+def hms2h(hms):
+    """
+    Convert hh:mm:ss (as written by `h2hms24` and `h2hms_signed`) to
+    decimal hours. `hms` may be an array of strings.
+
     """
-    inverse = ''
-    if d < 0:
-        inverse = '-'
-    minutes, seconds = divmod(abs(d) * 3600, 60)
-    degrees, minutes = divmod(minutes, 60)
-    return '{0:s}{1:.0f}{4}{2:02.0f}{4}{3:0{5:d}.{6:d}f}'\
-        .format(inverse, degrees, minutes, seconds, delimiter, 3 + precision,
-                precision)
+    return _parse_sexagesimal(hms)
+
+
+def dms2d(dms):
+    """
+    Convert [-]dd:mm:ss (as written by `d2dms`) to decimal degrees. `dms`
+    may be an array of strings.
+
+    """
+    return _parse_sexagesimal(dms)
 
 
 def lst2gha(lst, site_long=116.670456):
@@ -87,18 +151,131 @@ def lst2gha(lst, site_long=116.670456):
 
     Longitude of the observer can be specify with site_long = +/- decimal
     degree, where + is east and - is west of the prime meridian. Else assume
-    MWA 128T location, site_long = 116.670456.
+    MWA 128T location, site_long = 116.670456. `lst` may be an array.
 
     """
-    gha = lst/15. - site_long/15.
-    if gha > 24.0:
-        gha -= 24.0
-    elif gha < 0.0:
-        gha += 24.0
+    gha = np.asarray(lst, dtype=float) / 15. - site_long / 15.
+    gha = np.where(gha > 24.0, gha - 24.0, np.where(gha < 0.0, gha + 24.0,
+                                                     gha))
+    if gha.ndim == 0:
+        return float(gha)
     return gha
 
 
-def jysr2k(intensity, freq):
+def scan_start_jd(scan_start):
+    """
+    Julian date of an absolute visgen scan start,
+    'year:day-of-year:hour:minute:second' [UTC].
+
+    """
+    year, doy, hour, minute, second = [float(p) for p in
+                                       scan_start.split(':')]
+    # Julian date of 0h UTC on January 1 of the year.
+    y = int(year) - 1
+    jan1 = 1721425.5 + 365 * y + y // 4 - y // 100 + y // 400
+    return jan1 + doy - 1 + (hour + (minute + second / 60.) / 60.) / 24.
+
+
+def gmst(jd):
+    """
+    Greenwich mean sidereal time [decimal hours] at Julian date `jd`
+    (UT1, taken as UTC). `jd` may be an array.
+
+    """
+    return np.mod(18.697374558 + 24.06570982441908 *
+                  (np.asarray(jd, dtype=float) - 2451545.0), 24.)
+
+
+def scan_start_lst(scan_start, site_long):
+    """
+    Local sidereal time [decimal hours] at the start of a visgen scan.
+
+    Parameters
+    ----------
+    scan_start: str
+        Scan_start of a visgen spec: 'GHA gha', where gha is the Greenwich
+        sidereal time at the start [decimal hours] (see `lst2gha`), or an
+        absolute 'year:day-of-year:hour:minute:second' [UTC].
+    site_long: float
+        Longitude of the site [decimal degree], + east.
+
+    """
+    if scan_start.upper().startswith('GHA'):
+        gst = float(scan_start.split()[1])
+    else:
+        gst = float(gmst(scan_start_jd(scan_start)))
+    return (gst + site_long / 15.) % 24.
+
+
+_JY_PER_K = {}
+_CONSTANTS = []
+
+
+def _constants():
+    """
+    Boltzmann constant and speed of light in SI units. astropy is only
+    imported on the first unit conversion.
+
+    """
+    if not _CONSTANTS:
+        import astropy.constants as const
+        _CONSTANTS.extend([const.k_B.si.value, const.c.si.value])
+    return _CONSTANTS
+
+
+def jy_per_k(freq, beam_area=1.0):
+    """
+    Rayleigh-Jeans conversion factor from K to Jy, the same as
+    `astropy.units.brightness_temperature`.
+
+    Factors are memoized per (frequency, beam area), so converting many
+    maps or a whole cube at the same channels only computes them once.
+
+    Parameters
+    ----------
+    freq: float or array-like
+        Frequency in MHz
+    beam_area: float, optional
+        Beam solid angle in steradian. The default gives Jy/sr per K.
+
+    Return
+    ------
+    out: float or ndarray
+        Jy (per beam) per K at each frequency
+
+    """
+    freq = np.asarray(freq, dtype=float)
+    key = (freq.shape, freq.tobytes(), float(beam_area))
+    try:
+        return _JY_PER_K[key]
+    except KeyError:
+        pass
+    k_b, c = _constants()
+    factor = 2 * k_b * (freq * 1e6) ** 2 / c ** 2 * beam_area * 1e26
+    if factor.ndim == 0:
+        factor = float(factor)
+    _JY_PER_K[key] = factor
+    return factor
+
+
+def _along(factor, data, freq_axis):
+    """
+    Reshape per-frequency factors to broadcast along `freq_axis` of data.
+
+    """
+    factor = np.asarray(factor)
+    if factor.ndim == 0:
+        return factor
+    shape = [1] * np.ndim(data)
+    shape[freq_axis] = factor.size
+    return factor.reshape(shape)
+
+
+def _beam_sr(beam_width):
+    return beam_area(beam_width) * (np.pi / 180.) ** 2
+
+
+def jysr2k(intensity, freq, freq_axis=0):
     """
     Convert Jy/sr to K.
 
@@ -106,8 +283,11 @@ def jysr2k(intensity, freq):
     ----------
     intensity: array-like
         Intensity (brightness) in Jy/sr
-    freq: float
-        Frequency of the map in MHz
+    freq: float or array-like
+        Frequency of the map in MHz. If an array, one frequency per plane
+        along `freq_axis` of `intensity`, e.g. a whole cube in one pass.
+    freq_axis: int, optional
+        Frequency axis of `intensity` when `freq` is an array.
 
     Return
     ------
@@ -116,12 +296,10 @@ def jysr2k(intensity, freq):
 
 
     """
-    ba = 1 * u.sr
-    equiv = u.brightness_temperature(ba, freq * u.MHz)
-    return (intensity * u.Jy).to(u.K, equivalencies=equiv).value
+    return intensity / _along(jy_per_k(freq), intensity, freq_axis)
 
 
-def k2jysr(temp, freq):
+def k2jysr(temp, freq, freq_axis=0):
     """
     Convert K to Jy/sr.
 
@@ -129,8 +307,11 @@ def k2jysr(temp, freq):
     ----------
     temp: array-like
         Brightness temperature in Kelvin
-    freq: float
-        Frequency of the map in MHz
+    freq: float or array-like
+        Frequency of the map in MHz. If an array, one frequency per plane
+        along `freq_axis` of `temp`.
+    freq_axis: int, optional
+        Frequency axis of `temp` when `freq` is an array.
 
     Return
     ------
@@ -138,13 +319,10 @@ def k2jysr(temp, freq):
         Intensity (brightness) in Jy/sr
 
     """
-    ba = 1 * u.sr
-    equiv = u.brightness_temperature(ba, freq * u.MHz)
-    return (temp * u.K).to(u.Jy, equivalencies=equiv).value
-
+    return temp * _along(jy_per_k(freq), temp, freq_axis)
 
 
-def jybeam2k(intensity, freq, beam_width):
+def jybeam2k(intensity, freq, beam_width, freq_axis=0):
     """
     Convert Jy/beam to K.
 
@@ -152,10 +330,13 @@ def jybeam2k(intensity, freq, beam_width):
     ----------
     intensity: array-like
         Intensity (brightness) in Jy/beam
-    freq: float
-        Frequency of the map in MHz
+    freq: float or array-like
+        Frequency of the map in MHz. If an array, one frequency per plane
+        along `freq_axis` of `intensity`.
     beam_width: float
         The Gaussian FWHM width in degree
+    freq_axis: int, optional
+        Frequency axis of `intensity` when `freq` is an array.
 
     Return
     ------
@@ -163,12 +344,11 @@ def jybeam2k(intensity, freq, beam_width):
         Brightness temperature in Kelvin
 
     """
-    ba = beam_area(beam_width) * u.Unit('deg2')
-    equiv = u.brightness_temperature(ba, freq * u.MHz)
-    return (intensity * u.Jy).to(u.K, equivalencies=equiv).value
+    factor = jy_per_k(freq, _beam_sr(beam_width))
+    return intensity / _along(factor, intensity, freq_axis)
 
 
-def k2jybeam(temp, freq, beam_width):
+def k2jybeam(temp, freq, beam_width, freq_axis=0):
     """
     Convert K to Jy/beam.
 
@@ -176,10 +356,13 @@ def k2jybeam(temp, freq, beam_width):
     ----------
     temp: array-like
         Brightness temperature in Kelvin
-    freq: float
-        Frequency of the map in MHz
+    freq: float or array-like
+        Frequency of the map in MHz. If an array, one frequency per plane
+        along `freq_axis` of `temp`.
     beam_width: float
         The Gaussian FWHM width in degree
+    freq_axis: int, optional
+        Frequency axis of `temp` when `freq` is an array.
 
     Return
     ------
@@ -187,6 +370,5 @@ def k2jybeam(temp, freq, beam_width):
         Intensity (brightness) in Jy/beam
 
     """
-    ba = beam_area(beam_width) * u.Unit('deg2')
-    equiv = u.brightness_temperature(ba, freq * u.MHz)
-    return (temp * u.K).to(u.Jy, equivalencies=equiv).value
+    factor = jy_per_k(freq, _beam_sr(beam_width))
+    return temp * _along(factor, temp, freq_axis)
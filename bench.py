@@ -0,0 +1,273 @@
+"""
+Benchmark harness with stub MAPS binaries.
+
+Fake `visgen`, `maps_im2uv`, `maps2uvfits` and `mpirun` executables are put
+on PATH, with configurable sleep, CPU burn and output size, so wrapper
+overhead, spec generation and batch throughput can be measured without a
+MAPS install. Results are appended to a JSON-lines history file and
+compared with the previous run to show regressions.
+
+Run as::
+
+    python -m pwmaps.bench --ndrift 64 --nprocs 1 4 8 --sleep 0.2
+
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from contextlib import contextmanager
+
+from . import visfile
+
+
+_STUB = '''#!{python}
+import os, sys, time
+argv = sys.argv[1:]
+sleep = float(os.environ.get('PWMAPS_STUB_SLEEP', '0'))
+cpu = float(os.environ.get('PWMAPS_STUB_CPU', '0'))
+size = int(os.environ.get('PWMAPS_STUB_SIZE', '0'))
+time.sleep(sleep)
+end = time.time() + cpu
+while time.time() < end:
+    pass
+{body}
+'''
+
+_STUBS = {
+    'maps_im2uv': '''
+out = argv[argv.index('-o') + 1]
+with open(out, 'wb') as f:
+    f.write(b'\\0' * size)
+print('maps_im2uv stub: ' + out)
+''',
+    'maps2uvfits': '''
+with open(argv[1], 'wb') as f:
+    f.write(b'\\0' * size)
+print('maps2uvfits stub: ' + argv[1])
+''',
+    'visgen': '''
+import struct
+prefix = argv[argv.index('-n') + 1]
+spec = argv[argv.index('-V') + 1]
+with open(spec) as f:
+    nscan = max(f.read().count('Endscan'), 1)
+nrec = max(size // {record_size:d}, 1)
+with open(prefix + '.vis', 'wb') as f:
+    for i in range(nscan):
+        f.write(struct.pack('<4i5d', nrec, 1, 1, 4, 1.5e8, 4e4, 1.0, 0., 0.))
+        f.write(b'\\0' * (nrec * {record_size:d}))
+print('visgen stub: ' + prefix)
+''',
+    'mpirun': '''
+os.execvp(argv[2], argv[2:])
+''',
+}
+
+
+def install_stubs(bindir):
+    """
+    Write the stub executables into `bindir`.
+
+    """
+    record_size = visfile.record_dtype(1, 4).itemsize
+    for name, body in _STUBS.items():
+        path = os.path.join(bindir, name)
+        with open(path, 'w') as f:
+            f.write(_STUB.format(python=sys.executable,
+                                 body=body.format(record_size=record_size)))
+        os.chmod(path, 0o755)
+
+
+@contextmanager
+def stub_env(sleep=0.0, cpu=0.0, size=0):
+    """
+    Temporary environment with the stubs on PATH, a $SIM tree with empty
+    array files, and a scratch working directory.
+
+    Yield
+    -----
+    out: str
+        The working directory.
+
+    """
+    from . import settings as s
+    root = tempfile.mkdtemp(prefix='pwmaps-bench-')
+    bindir = os.path.join(root, 'bin')
+    arraydir = os.path.join(root, 'array')
+    workdir = os.path.join(root, 'work')
+    for d in (bindir, arraydir, workdir):
+        os.mkdir(d)
+    install_stubs(bindir)
+    for name in s.MAPS.ARRAY_FILES.values():
+        open(os.path.join(arraydir, name), 'w').close()
+    env = dict(os.environ)
+    cwd = os.getcwd()
+    saved = (s.MAPS._root_dir, s.MAPS._array_dir, s.MAPS._array_config)
+    os.environ['PATH'] = bindir + os.pathsep + os.environ.get('PATH', '')
+    os.environ['PWMAPS_STUB_SLEEP'] = str(sleep)
+    os.environ['PWMAPS_STUB_CPU'] = str(cpu)
+    os.environ['PWMAPS_STUB_SIZE'] = str(size)
+    os.environ['SIM'] = root
+    s.MAPS.configure(root_dir=root)
+    os.chdir(workdir)
+    try:
+        yield workdir
+    finally:
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(env)
+        s.MAPS._root_dir, s.MAPS._array_dir, s.MAPS._array_config = saved
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def _timeit(func, n):
+    start = time.time()
+    for i in range(n):
+        func(i)
+    return (time.time() - start) / n
+
+
+def bench_import(modules=('pymaps', 'astro', 'driftscan')):
+    """
+    Import time of package modules in a fresh interpreter [second].
+
+    """
+    package = __name__.rsplit('.', 1)[0]
+    parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = {}
+    for m in modules:
+        code = ('import sys, time; sys.path.insert(0, {0!r}); '
+                't = time.time(); import {1}.{2}; '
+                'print(time.time() - t)'.format(parent, package, m))
+        res = subprocess.check_output([sys.executable, '-c', code],
+                                      universal_newlines=True)
+        out[m] = float(res.split()[-1])
+    return out
+
+
+def bench_wrappers(n=20):
+    """
+    Per-call time of the pymaps wrappers against zero-cost stubs, i.e.
+    the wrapper and process start-up overhead [second].
+
+    """
+    from . import pymaps
+    with stub_env():
+        open('sky.fits', 'w').close()
+        open('sky.ospec', 'w').close()
+        out = {
+            'im2uv': _timeit(lambda i: pymaps.im2uv('sky.fits',
+                                                    verbose=False), n),
+            'visgen': _timeit(lambda i: pymaps.visgen('sky', 'sky.ospec',
+                                                      uvgrid='sky.dat'), n),
+            'maps2uvfits': _timeit(lambda i: pymaps.maps2uvfits(
+                'sky.vis', verbose=False), n)}
+    return out
+
+
+def bench_update_spec(n=2000):
+    """
+    Per-call time of `Drift.update_spec` [second].
+
+    """
+    from .driftscan import Drift
+    d = Drift(0.0, 0.0, sky_img='sky.fits')
+    return {'update_spec': _timeit(lambda i: d.update_spec(), n)}
+
+
+def bench_batch(ndrift=32, nprocs=(1, 4), sleep=0.1, cpu=0.0, size=0):
+    """
+    End-to-end `batch_drift` throughput [drift/second] per nprocs.
+
+    """
+    from .driftscan import Drift, batch_drift
+    out = {}
+    for n in nprocs:
+        with stub_env(sleep=sleep, cpu=cpu, size=size):
+            drifts = []
+            for i in range(ndrift):
+                sky = 'sky{0:05d}.fits'.format(i)
+                open(sky, 'w').close()
+                drifts.append(Drift(0.0, 0.01 * i, sky_img=sky))
+            start = time.time()
+            batch_drift(drifts, nprocs=n)
+            out['nprocs={0:d}'.format(n)] = ndrift / (time.time() - start)
+    return out
+
+
+def _revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.STDOUT, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def record(results, history):
+    """
+    Append a result set to the history file and return the previous one.
+
+    """
+    previous = None
+    if os.path.exists(history):
+        with open(history) as f:
+            lines = [l for l in f if l.strip()]
+        if lines:
+            previous = json.loads(lines[-1])
+    entry = {'time': time.time(), 'revision': _revision(),
+             'python': platform.python_version(), 'host': platform.node(),
+             'results': results}
+    with open(history, 'a') as f:
+        f.write(json.dumps(entry, sort_keys=True) + '\n')
+    return previous
+
+
+def report(results, previous=None):
+    """
+    Print results, with the change relative to a previous run.
+
+    """
+    old = previous['results'] if previous else {}
+    for group in sorted(results):
+        for name, value in sorted(results[group].items()):
+            line = '{0:>12s} {1:<16s} {2:12.6g}'.format(group, name, value)
+            prev = old.get(group, {}).get(name)
+            if prev:
+                line += '  ({0:+.1%} vs {1})'.format(
+                    value / prev - 1, previous.get('revision'))
+            print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--ndrift', type=int, default=32)
+    parser.add_argument('--nprocs', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--sleep', type=float, default=0.1,
+                        help='stub sleep per call [second]')
+    parser.add_argument('--cpu', type=float, default=0.0,
+                        help='stub CPU burn per call [second]')
+    parser.add_argument('--size', type=int, default=0,
+                        help='stub output size [byte]')
+    parser.add_argument('--history', default='pwmaps_bench.jsonl',
+                        help='JSON-lines file the results are appended to')
+    args = parser.parse_args(argv)
+    results = {'import': bench_import(),
+               'wrappers': bench_wrappers(),
+               'spec': bench_update_spec(),
+               'batch': bench_batch(args.ndrift, args.nprocs, args.sleep,
+                                    args.cpu, args.size)}
+    report(results, record(results, args.history))
+
+
+if __name__ == '__main__':
+    main()
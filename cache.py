@@ -0,0 +1,334 @@
+"""
+Persistent, content-addressed file cache shared between drifts and workers.
+
+Entries are keyed by a hash of their inputs (e.g. the content of a sky image
+together with the im2uv normalizer and padding) and handed out either as a
+hardlink or as a reference to the cached file. The cache directory can be
+shared by several `batch_drift` workers; entries are created under an
+exclusive per-key lock and published with an atomic rename.
+
+Recency of use is kept in a hidden stamp file per entry, not in the entry
+itself: handed-out hardlinks share the inode of the entry, and touching it
+would change the mtime of outputs that other drifts have already recorded
+(see `manifest`).
+
+"""
+from __future__ import print_function, division
+
+import os
+import errno
+import fcntl
+import shutil
+import hashlib
+from contextlib import contextmanager
+
+
+_DIGEST_MEMO = {}
+
+
+def file_digest(filename, blocksize=2 ** 22, memo=True):
+    """
+    Return the SHA-1 hex digest of the content of a file.
+
+    Digests are memoized per process by (path, size, mtime), so repeated
+    calls on the same unchanged file do not re-read it. With memo=False
+    the file is always re-read, e.g. to catch changes that keep its size
+    and mtime.
+
+    """
+    st = os.stat(filename)
+    memo_key = (os.path.realpath(filename), st.st_size, st.st_mtime)
+    if memo and memo_key in _DIGEST_MEMO:
+        return _DIGEST_MEMO[memo_key]
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            sha.update(block)
+    digest = sha.hexdigest()
+    _DIGEST_MEMO[memo_key] = digest
+    return digest
+
+
+def make_key(*parts):
+    """
+    Combine hashable key parts (strings, numbers, None) into a cache key.
+
+    """
+    sha = hashlib.sha1()
+    for p in parts:
+        sha.update(repr(p).encode('utf-8'))
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+
+class Reservation(object):
+    """
+    Entry of a `FileCache` being fetched with `FileCache.reserve`.
+
+    Attributes
+    ----------
+    path: str
+        The cache entry, and the handed-out path once the fetch is done.
+    tmp: str
+        Where to write the entry on a miss.
+    hit: boolean
+        Whether the entry was already cached.
+
+    """
+    def __init__(self, path, tmp, hit):
+        self.path = path
+        self.tmp = tmp
+        self.hit = hit
+
+
+class FileCache(object):
+    """
+    Content-addressed on-disk cache with an LRU size budget.
+
+    Parameters
+    ----------
+    root: str
+        Cache directory. Created if it does not exist.
+    max_bytes: int, optional
+        Disk-size budget of the cache. Least recently used entries are
+        evicted when the total size exceeds this value. If None, the cache
+        grows without bound.
+
+    """
+    def __init__(self, root, max_bytes=None):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        if not os.path.isdir(self.root):
+            try:
+                os.makedirs(self.root)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def __repr__(self):
+        return 'FileCache({0!r}, max_bytes={1!r})'.format(self.root,
+                                                         self.max_bytes)
+
+    def entry(self, key, suffix=''):
+        """
+        Path of the cache entry of a key.
+
+        """
+        return os.path.join(self.root, key + suffix)
+
+    @contextmanager
+    def _lock(self, name, blocking=True):
+        with open(os.path.join(self.root, '.' + name + '.lock'), 'a') as f:
+            flags = fcntl.LOCK_EX
+            if not blocking:
+                flags |= fcntl.LOCK_NB
+            try:
+                fcntl.flock(f, flags)
+            except (IOError, OSError) as e:
+                if blocking or e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _stamp(path):
+        head, name = os.path.split(path)
+        return os.path.join(head, '.' + name + '.used')
+
+    def _touch(self, path):
+        """
+        Mark an entry as used now, through its stamp file.
+
+        """
+        stamp = self._stamp(path)
+        try:
+            with open(stamp, 'a'):
+                pass
+            os.utime(stamp, None)
+        except OSError:
+            pass
+
+    def _remove(self, path):
+        os.remove(path)
+        try:
+            os.remove(self._stamp(path))
+        except OSError:
+            pass
+
+    def lookup(self, key, suffix=''):
+        """
+        Return the path of a cached entry, or None on a miss.
+
+        A hit marks the entry as most recently used.
+
+        """
+        path = self.entry(key, suffix)
+        if os.path.exists(path):
+            self._touch(path)
+            return path
+        return None
+
+    def fetch(self, key, suffix, outfile, produce, link=True):
+        """
+        Return a cached file, producing it on a miss.
+
+        Parameters
+        ----------
+        key: str
+            Cache key, e.g. from `make_key`.
+        suffix: str
+            File extension of the entry, e.g. '.dat'.
+        outfile: str
+            Where to hand the entry out. Ignored if link is False.
+        produce: callable
+            ``produce(path)`` must write the entry to `path`. Only called
+            on a miss, by exactly one process at a time for a given key.
+        link: boolean, optional
+            If True, hardlink the entry to `outfile` (copying it when the
+            cache is on another filesystem) and return `outfile`.
+            If False, return the path of the cache entry itself. Such a
+            reference stays valid only while the entry is not evicted.
+
+        Return
+        ------
+        out: (str, boolean)
+            The handed-out path and whether the entry was a cache hit.
+
+        """
+        with self.reserve(key, suffix, outfile, link) as entry:
+            if not entry.hit:
+                produce(entry.tmp)
+        return entry.path, entry.hit
+
+    @contextmanager
+    def reserve(self, key, suffix, outfile=None, link=True):
+        """
+        `fetch` for producers that cannot be passed as a function, e.g.
+        stages that yield to a coroutine while their entry is produced.
+
+        The key lock is held for the body of the with statement. On a miss
+        the body must write the entry to `tmp` of the yielded `Reservation`,
+        which is published when the body returns and removed if it raises.
+        Parameters are the same as `fetch`; afterwards `path` of the
+        reservation is the handed-out path.
+
+        """
+        path = self.entry(key, suffix)
+        with self._lock(key):
+            entry = Reservation(path,
+                                os.path.join(self.root,
+                                             '.tmp-' + key + suffix),
+                                os.path.exists(path))
+            try:
+                yield entry
+                if not entry.hit:
+                    os.rename(entry.tmp, path)
+            finally:
+                if os.path.exists(entry.tmp):
+                    os.remove(entry.tmp)
+            self._touch(path)
+            if link:
+                self.link(path, outfile)
+                entry.path = outfile
+        if not entry.hit:
+            self.evict(keep=path)
+
+    def store(self, key, suffix, filename):
+        """
+        Add an existing file to the cache by hardlink (or copy).
+
+        """
+        path = self.entry(key, suffix)
+        with self._lock(key):
+            if not os.path.exists(path):
+                tmp = os.path.join(self.root, '.tmp-' + key + suffix)
+                try:
+                    self.link(filename, tmp)
+                    os.rename(tmp, path)
+                finally:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+        self.evict(keep=path)
+        return path
+
+    @staticmethod
+    def link(src, dst):
+        """
+        Hardlink `src` to `dst`, replacing `dst`. Fall back to copying if
+        they are on different filesystems.
+
+        """
+        if os.path.exists(dst):
+            if os.path.samefile(src, dst):
+                return
+            os.remove(dst)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copyfile(src, dst)
+
+    def entries(self):
+        """
+        List cache entries as (last use, size, path), least recently used
+        first. The last use is the mtime of the stamp file of an entry, or
+        of the entry if it has never been used since it was created.
+
+        """
+        out = []
+        for name in os.listdir(self.root):
+            if name.startswith('.'):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            try:
+                used = os.stat(self._stamp(path)).st_mtime
+            except OSError:
+                used = st.st_mtime
+            out.append((used, st.st_size, path))
+        out.sort()
+        return out
+
+    def size(self):
+        """
+        Total size of the cache entries in bytes.
+
+        """
+        return sum(e[1] for e in self.entries())
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used entries until the cache fits in
+        `max_bytes`. The entry `keep` is never removed.
+
+        """
+        if self.max_bytes is None:
+            return
+        with self._lock('evict'):
+            entries = self.entries()
+            total = sum(e[1] for e in entries)
+            for used, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                key = os.path.basename(path).split('.', 1)[0]
+                # Entries being produced or handed out are skipped.
+                with self._lock(key, blocking=False) as locked:
+                    if not locked:
+                        continue
+                    try:
+                        self._remove(path)
+                    except OSError:
+                        continue
+                total -= size
+
+    def clear(self):
+        for used, size, path in self.entries():
+            self._remove(path)
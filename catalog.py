@@ -0,0 +1,124 @@
+"""
+Compiled out-of-bound (OOB) source catalogs with per-drift culling.
+
+visgen evaluates every source of its oobs list in every drift, including
+sources below the horizon or far outside the field of interest. A compiled
+catalog is a NumPy structured array (`CATALOG_DTYPE`) saved as .npy and
+sorted by declination, so the declination column is its own band index: a
+cone search reads only the declination band of the cone from the memory
+map and tests the exact angular distance there. For each drift the sources
+within a cutoff radius of its pointing centre are written to a temporary
+plain-text oobs list for visgen.
+
+"""
+from __future__ import print_function, division
+
+import os
+
+import numpy as np
+
+
+CATALOG_DTYPE = np.dtype([('ra', '<f8'), ('dec', '<f8'), ('I', '<f8'),
+                          ('Q', '<f8'), ('U', '<f8'), ('V', '<f8')])
+
+_TEXT_CATALOGS = {}
+
+
+def read_text(filename):
+    """
+    Read a plain-text oobs list (RA [decimal hour], Dec [decimal degree],
+    I, Q, U, V per line; '#' comments) into a dec-sorted catalog array.
+
+    """
+    data = np.loadtxt(filename, comments='#', ndmin=2)
+    cat = np.zeros(len(data), dtype=CATALOG_DTYPE)
+    for k, name in enumerate(CATALOG_DTYPE.names):
+        if k < data.shape[1]:
+            cat[name] = data[:, k]
+    return cat[np.argsort(cat['dec'], kind='mergesort')]
+
+
+def compile_catalog(textfile, npyfile):
+    """
+    Compile a plain-text oobs list into a .npy catalog.
+
+    """
+    np.save(npyfile, read_text(textfile))
+    return npyfile
+
+
+def write_text(filename, sources):
+    """
+    Write catalog rows as a plain-text oobs list for visgen.
+
+    """
+    np.savetxt(filename, np.column_stack([sources[n] for n in
+                                          CATALOG_DTYPE.names]),
+               fmt='%.10g',
+               header='RA(decimal hour) Dec(decimal degree) I Q U V')
+    return filename
+
+
+class Catalog(object):
+    """
+    Source catalog from a compiled .npy file (memory-mapped) or a
+    plain-text oobs list (parsed once per process and file version).
+
+    Parameters
+    ----------
+    filename: str
+        .npy catalog or plain-text oobs list.
+
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        if filename.endswith('.npy'):
+            self.sources = np.load(filename, mmap_mode='r')
+            if self.sources.dtype != CATALOG_DTYPE:
+                raise ValueError('{0} is not a compiled catalog'
+                                 .format(filename))
+        else:
+            key = (os.path.realpath(filename), os.path.getmtime(filename))
+            if key not in _TEXT_CATALOGS:
+                _TEXT_CATALOGS[key] = read_text(filename)
+            self.sources = _TEXT_CATALOGS[key]
+
+    def __len__(self):
+        return len(self.sources)
+
+    def __repr__(self):
+        return 'Catalog({0!r}, sources={1:d})'.format(self.filename,
+                                                      len(self))
+
+    def cone(self, ra, dec, radius):
+        """
+        Indices of the sources within `radius` of a position.
+
+        Parameters
+        ----------
+        ra: float
+            Right ascension of the centre [decimal hour].
+        dec: float
+            Declination of the centre [decimal degree].
+        radius: float
+            Cone radius [degree]. 180 or more keeps every source.
+
+        """
+        if radius >= 180.:
+            return np.arange(len(self))
+        dec_col = self.sources['dec']
+        start = np.searchsorted(dec_col, dec - radius, side='left')
+        stop = np.searchsorted(dec_col, dec + radius, side='right')
+        band = self.sources[start:stop]
+        d0, d1 = np.radians(dec), np.radians(band['dec'])
+        dra = np.radians((band['ra'] - ra) * 15.)
+        cosdist = np.sin(d0) * np.sin(d1) + \
+            np.cos(d0) * np.cos(d1) * np.cos(dra)
+        return start + np.flatnonzero(cosdist >= np.cos(np.radians(radius)))
+
+    def write_oobs(self, filename, rows):
+        """
+        Write the given rows as a plain-text oobs list.
+
+        """
+        return write_text(filename, self.sources[np.sort(rows)])
@@ -0,0 +1,228 @@
+"""
+Cost model of drift simulations.
+
+Drift runtime, memory and output size grow with the number of visibilities
+(baselines of the array times time steps), the number of out-of-bound
+sources and the size of the sky image. `CostModel` predicts them from these
+features with a linear model per quantity, whose coefficients are fitted to
+the stage events of past sweeps (see `telemetry`), and `simulate` projects
+the wall time of a sweep on a number of workers. Memory is fitted to the
+peak RSS of the MAPS processes of each drift (child_rss of its events),
+not to child_peak_rss, which is the peak over all children of a worker so
+far. `batch_drift` uses the model to start the longest drifts first and to
+admit drifts only while their predicted memory fits.
+
+"""
+from __future__ import print_function, division
+
+import os
+import json
+import heapq
+import warnings
+
+import numpy as np
+
+from . import layout
+from . import settings as s
+
+
+QUANTITIES = ('wall', 'cpu', 'memory', 'bytes')
+
+# Quantities fitted by `CostModel.calibrate`.
+CALIBRATED = ('wall', 'cpu', 'memory', 'bytes')
+
+# Terms of the linear model: constant, visibilities, visibilities times
+# sources (visgen's direct sum) and sky pixels (im2uv FFT and grid).
+TERMS = ('const', 'nvis', 'nvis_nsrc', 'npix')
+
+# Rough figures for an uncalibrated model.
+DEFAULT_COEF = {'wall': [2.0, 2e-6, 2e-8, 5e-8],
+                'cpu': [2.0, 2e-6, 2e-8, 5e-8],
+                'memory': [5e7, 200.0, 0.0, 16.0],
+                'bytes': [1e4, 160.0, 0.0, 8.0]}
+
+_SOURCES = {}
+
+
+def _count_sources(oobs):
+    if oobs is None or not os.path.exists(oobs):
+        return 0
+    key = (os.path.realpath(oobs), os.path.getmtime(oobs))
+    if key not in _SOURCES:
+        if oobs.endswith('.npy'):
+            n = len(np.load(oobs, mmap_mode='r'))
+        else:
+            with open(oobs) as f:
+                n = sum(1 for line in f
+                        if line.strip() and not line.lstrip().startswith('#'))
+        _SOURCES[key] = n
+    return _SOURCES[key]
+
+
+def features(drift):
+    """
+    Cost features of a drift.
+
+    Return
+    ------
+    out: dict
+        nbaseline, ntime, nsrc (sources in the oobs list, before culling)
+        and npix (pixels of the gridded image).
+
+    """
+    arrayconf = s.MAPS.ARRAY_CONFIG[drift.site.lower()]
+    nant = 0
+    if os.path.exists(arrayconf):
+        try:
+            nant = len(layout.read_array_config(arrayconf)[0])
+        except ValueError as e:
+            # Estimates must not stop a drift whose array file visgen reads.
+            warnings.warn('no baselines in the cost features: {0}'
+                          .format(e))
+    ntime = max(1, int(round(float(drift.scan_duration) /
+                             float(drift.corr_int_time))))
+    if getattr(drift, 'cutout_fov', None) is not None:
+        npix = drift._cutout_npix ** 2
+    elif drift.sky_img is not None and os.path.exists(drift.sky_img):
+        # float32 pixels
+        npix = os.path.getsize(drift.sky_img) // 4
+    else:
+        npix = 0
+    return {'nbaseline': nant * (nant - 1) // 2, 'ntime': ntime,
+            'nsrc': _count_sources(drift.oobs), 'npix': npix}
+
+
+def _terms(f):
+    nvis = f['nbaseline'] * f['ntime']
+    return np.array([1.0, nvis, nvis * f['nsrc'], f['npix']], dtype=float)
+
+
+class CostModel(object):
+    """
+    Linear cost model of drifts.
+
+    Parameters
+    ----------
+    coef: dict, optional
+        Coefficients of `TERMS` per quantity ('wall' and 'cpu' [second],
+        'memory' and 'bytes' [byte]). Missing quantities use
+        `DEFAULT_COEF`.
+
+    """
+    def __init__(self, coef=None):
+        self.coef = dict((q, list(c)) for q, c in DEFAULT_COEF.items())
+        if coef is not None:
+            self.coef.update(coef)
+        self.calibrated = []
+
+    def __repr__(self):
+        return 'CostModel(calibrated={0!r})'.format(self.calibrated)
+
+    def predict(self, drift):
+        """
+        Predicted wall time, CPU time, peak memory and output bytes of a
+        drift (or of a features dict).
+
+        """
+        f = drift if isinstance(drift, dict) else features(drift)
+        x = _terms(f)
+        return dict((q, float(np.dot(self.coef[q], x))) for q in QUANTITIES)
+
+    @classmethod
+    def calibrate(cls, events):
+        """
+        Fit a model to stage events recorded with features (events of
+        drifts with telemetry, see `telemetry.summarize` for the inputs).
+
+        Per drift, wall and CPU times and bytes written are summed over its
+        stages, and memory is the largest child_rss of its stages. Memory
+        is only fitted to drifts whose stages all ran a MAPS program (a
+        stage served from a cache has no child_rss). Coefficients are
+        fitted by least squares, negative ones are clipped to zero, and no
+        quantity is fitted with fewer drifts than terms.
+
+        """
+        from .telemetry import JSONLinesSink
+        if isinstance(events, str):
+            events = JSONLinesSink(events)
+        if isinstance(events, JSONLinesSink):
+            events = events.events()
+        drifts = {}
+        for e in events:
+            if e.get('status') != 'ok' or 'features' not in e:
+                continue
+            d = drifts.setdefault(e['name'], {'features': e['features'],
+                                              'wall': 0.0, 'cpu': 0.0,
+                                              'memory': 0, 'bytes': 0})
+            d['wall'] += e['wall']
+            d['cpu'] += e['cpu'] + e['child_cpu']
+            d['bytes'] += e['bytes_written']
+            if d['memory'] is not None and 'child_rss' in e:
+                d['memory'] = max(d['memory'], e['child_rss'])
+            else:
+                d['memory'] = None
+        model = cls()
+        for q in CALIBRATED:
+            fit = [d for d in drifts.values() if d[q] is not None]
+            if len(fit) < len(TERMS):
+                continue
+            x = np.array([_terms(d['features']) for d in fit])
+            y = np.array([d[q] for d in fit], dtype=float)
+            c = np.linalg.lstsq(x, y, rcond=None)[0]
+            model.coef[q] = np.clip(c, 0, None).tolist()
+            model.calibrated.append(q)
+        return model
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump({'terms': TERMS, 'coef': self.coef}, f, indent=1)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as f:
+            return cls(json.load(f)['coef'])
+
+
+def lpt_order(drifts, model):
+    """
+    Drifts sorted by predicted wall time, longest first.
+
+    """
+    costs = [model.predict(d)['wall'] for d in drifts]
+    order = sorted(range(len(drifts)), key=lambda i: -costs[i])
+    return [drifts[i] for i in order]
+
+
+def simulate(drifts, model, nprocs=4, memory=None):
+    """
+    Project the run of drifts started in order on `nprocs` workers, each
+    drift waiting until a worker is free and, with a `memory` budget
+    [byte], until its predicted memory fits beside the running ones.
+
+    Return
+    ------
+    out: dict
+        Projected makespan (wall time of the sweep), total CPU time and
+        output bytes, and the peak of the predicted memory in use.
+
+    """
+    t = 0.0
+    used = peak = 0.0
+    running = []
+    cpu = nbytes = 0.0
+    for d in drifts:
+        p = model.predict(d)
+        while running and (len(running) >= nprocs or
+                           (memory is not None and
+                            used + p['memory'] > memory)):
+            end, mem = heapq.heappop(running)
+            t = max(t, end)
+            used -= mem
+        heapq.heappush(running, (t + p['wall'], p['memory']))
+        used += p['memory']
+        peak = max(peak, used)
+        cpu += p['cpu']
+        nbytes += p['bytes']
+    makespan = max([end for end, _ in running] + [t])
+    return {'drifts': len(drifts), 'nprocs': nprocs, 'makespan': makespan,
+            'cpu': cpu, 'bytes': nbytes, 'peak_memory': peak}
@@ -0,0 +1,155 @@
+"""
+Field-of-view-limited sky cutouts per pointing.
+
+A whole-sky SIN image makes im2uv grid (and visgen read) far more sky than
+a narrow-field drift needs. `cutout` reprojects the sky image onto a SIN
+grid of the same pixel scale centred on the pointing and covering only the
+requested field of view, optionally zero-padded to an FFT-friendly size, so
+the uv-grid and the FFT shrink with the field. Cutouts are cached in a
+`cache.FileCache` keyed by the image content, pointing and field of view.
+
+"""
+from __future__ import print_function, division
+
+import numpy as np
+
+from .cache import file_digest, make_key
+
+
+def fft_size(n):
+    """
+    Smallest integer >= n with no prime factors other than 2, 3 and 5.
+
+    """
+    m = max(int(n), 1)
+    while True:
+        k = m
+        for p in (2, 3, 5):
+            while k % p == 0:
+                k //= p
+        if k == 1:
+            return m
+        m += 1
+
+
+def geometry(image, fov, pad=True):
+    """
+    Pixel scale and size of the cutout of an image.
+
+    Parameters
+    ----------
+    image: str
+        SIN-projected FITS image.
+    fov: float
+        Field of view of the cutout [degree].
+    pad: boolean, optional
+        Zero-pad the cutout to an FFT-friendly size (see `fft_size`).
+
+    Return
+    ------
+    out: (float, int, int)
+        Pixel scale [degree], number of sky pixels and total number of
+        pixels (with padding) per side.
+
+    """
+    from astropy.io import fits
+    header = fits.getheader(image)
+    cdelt = abs(float(header['CDELT1']))
+    npix = int(np.ceil(fov / cdelt))
+    return cdelt, npix, fft_size(npix) if pad else npix
+
+
+def key(image, ra, dec, fov, pad=True):
+    """
+    Cache key of a cutout.
+
+    """
+    return make_key('cutout', file_digest(image), ra, dec, fov, pad)
+
+
+def _bilinear(data, x, y):
+    """
+    Bilinear interpolation of a 2D array at (fractional, 0-based) pixel
+    coordinates, zero outside the array and where x or y is NaN.
+
+    """
+    ny, nx = data.shape
+    valid = np.isfinite(x) & np.isfinite(y) & (x >= 0) & (x <= nx - 1) & \
+        (y >= 0) & (y <= ny - 1)
+    x = np.where(valid, x, 0)
+    y = np.where(valid, y, 0)
+    x0 = np.minimum(np.floor(x).astype(np.intp), nx - 2)
+    y0 = np.minimum(np.floor(y).astype(np.intp), ny - 2)
+    fx, fy = x - x0, y - y0
+    out = (data[y0, x0] * (1 - fx) * (1 - fy) +
+           data[y0, x0 + 1] * fx * (1 - fy) +
+           data[y0 + 1, x0] * (1 - fx) * fy +
+           data[y0 + 1, x0 + 1] * fx * fy)
+    out = np.nan_to_num(out)
+    out[~valid] = 0
+    return out
+
+
+def cutout(image, outfile, ra, dec, fov, pad=True):
+    """
+    Reproject a SIN sky image onto a field-of-view-limited SIN image
+    centred on a pointing.
+
+    Parameters
+    ----------
+    image: str
+        SIN-projected FITS image. Axes beyond the first two must have
+        length 1.
+    outfile: str
+        Output FITS image. It keeps the header of the input, with the
+        celestial axes replaced.
+    ra: float
+        Right ascension of the pointing [decimal hour].
+    dec: float
+        Declination of the pointing [decimal degree].
+    fov: float
+        Field of view [degree].
+    pad: boolean, optional
+        Zero-pad to an FFT-friendly size (see `fft_size`).
+
+    Return
+    ------
+    out: str
+        outfile.
+
+    """
+    from astropy.io import fits
+    from astropy.wcs import WCS
+    cdelt, npix, ntot = geometry(image, fov, pad)
+    with fits.open(image, memmap=True) as hdul:
+        header = hdul[0].header.copy()
+        data = hdul[0].data
+        if data.size != data.shape[-1] * data.shape[-2]:
+            raise ValueError('{0} has more than one plane'.format(image))
+        plane = np.asarray(data.reshape(data.shape[-2:]), dtype=np.float64)
+        wcs_in = WCS(header).celestial
+        wcs_out = WCS(naxis=2)
+        wcs_out.wcs.ctype = ['RA---SIN', 'DEC--SIN']
+        wcs_out.wcs.crval = [ra * 15., dec]
+        wcs_out.wcs.cdelt = [-cdelt, cdelt]
+        wcs_out.wcs.crpix = [ntot // 2 + 1, ntot // 2 + 1]
+        offset = (ntot - npix) // 2
+        yy, xx = np.mgrid[offset:offset + npix, offset:offset + npix]
+        lon, lat = wcs_out.wcs_pix2world(xx, yy, 0)
+        x, y = wcs_in.wcs_world2pix(lon, lat, 0)
+        dtype = np.result_type(data.dtype, np.float32).newbyteorder('=')
+        out = np.zeros((ntot, ntot), dtype=dtype)
+        out[offset:offset + npix, offset:offset + npix] = \
+            _bilinear(plane, x, y)
+    for k, v in (('NAXIS1', ntot), ('NAXIS2', ntot),
+                 ('CTYPE1', 'RA---SIN'), ('CTYPE2', 'DEC--SIN'),
+                 ('CRVAL1', ra * 15.), ('CRVAL2', dec),
+                 ('CDELT1', -cdelt), ('CDELT2', cdelt),
+                 ('CRPIX1', ntot // 2 + 1.), ('CRPIX2', ntot // 2 + 1.)):
+        header[k] = v
+    for k in ('PC1_1', 'PC1_2', 'PC2_1', 'PC2_2', 'CD1_1', 'CD1_2',
+              'CD2_1', 'CD2_2', 'BSCALE', 'BZERO', 'BLANK'):
+        header.remove(k, ignore_missing=True)
+    fits.writeto(outfile, out.reshape(data.shape[:-2] + out.shape), header,
+                 overwrite=True)
+    return outfile
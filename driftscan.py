@@ -6,13 +6,20 @@ of the MWA using MAPS. It requires a python wrapper for MAPS (pymaps.py).
 from __future__ import division, print_function
 
 import os
+import copy
+import time
 import multiprocessing
 from datetime import datetime
+from contextlib import contextmanager
 
 import numpy as np
-import astropy.constants as const
 
-from . import astro, pymaps
+from . import astro, cost, cutout, pymaps, scheduler
+from .cache import FileCache, file_digest, make_key
+from .catalog import Catalog
+from .manifest import Manifest
+from .scratch import Scratch
+from .telemetry import JSONLinesSink, StageTimer, summarize, print_summary
 from . import settings as s
 
 
@@ -32,6 +39,75 @@ class _InputError(Exception):
                        self.err)
 
 
+def _coerce(value, cls):
+    """
+    `value`, or cls(value) if it is neither None nor an instance of `cls`
+    (e.g. a directory or file name given for a cache or sink).
+
+    """
+    if value is None or isinstance(value, cls):
+        return value
+    return cls(value)
+
+
+class _Launch(object):
+    """
+    A run of a MAPS program by a drift stage: the name of its `pymaps`
+    (or `aiomaps`) wrapper and the arguments to call it with.
+
+    """
+    def __init__(self, program, *args, **kwargs):
+        self.program = program
+        self.args = args
+        self.kwargs = kwargs
+
+    def __call__(self):
+        return getattr(pymaps, self.program)(*self.args, **self.kwargs)
+
+
+def _step(steps, value=None, exc=None):
+    """
+    Advance the steps of a stage to its next launch, sending it the result
+    of the last one or throwing the exception that stopped it.
+
+    Return
+    ------
+    out: (boolean, object)
+        (False, the next `_Launch`), or (True, the return value of the
+        stage) once it is finished.
+
+    """
+    try:
+        if exc is not None:
+            return False, steps.throw(exc)
+        return False, steps.send(value)
+    except StopIteration as stop:
+        return True, stop.value
+
+
+def _drive(steps):
+    """
+    Run the steps of a drift stage, launching each MAPS program with
+    `pymaps`.
+
+    The steps of a stage (`Drift._im2uv_steps` etc.) are a generator: it
+    prepares a launch, yields it, and finishes the launch when its result
+    is sent back. Cache locks and temporary files are held across the
+    yield. `aiomaps.run_drift` drives the same steps with async
+    subprocesses.
+
+    """
+    done, out = _step(steps)
+    while not done:
+        try:
+            result = out()
+        except BaseException as e:
+            done, out = _step(steps, exc=e)
+        else:
+            done, out = _step(steps, result)
+    return out
+
+
 class Drift:
     """
     This class provides an easy setup object for a drift scan simulation
@@ -43,7 +119,10 @@ class Drift:
                  pointing_center='zenith', fov_size=(412530.0, 412530.0),
                  duration=2.0, frequency=140.0, corr_int_time=1.0,
                  corr_chan_bw=0.04, scan_start='gha', site='MWA_128',
-                 name=None, convert_k2jysr=False):
+                 name=None, convert_k2jysr=False, uvgrid_cache=None,
+                 manifest=None, uvgrid=None, telemetry=None, scratch=None,
+                 oobs_cutoff=None, cutout_fov=None, cutout_cache=None,
+                 result_cache=None):
         """
         Initialize a drift scan.
 
@@ -65,6 +144,8 @@ class Drift:
                 0.0 -26.0 20.0 0.0 0.0 0.0
             will add an unpolarized source of 20.0 Jy at (0.0h -26.0d) to the
             visibility.
+            Or a compiled catalog (.npy, see `catalog.compile_catalog`),
+            which is culled to the sources above the horizon of the drift.
         pointing_center: 'zenith' or ('hh:mm:ss', 'dd:mm:ss')
             Pointing center of the drift scan. Default mode 'zenith' uses
             the zenith calculated from target_ra and target_ha as a pointing.
@@ -97,6 +178,48 @@ class Drift:
             will be use if None
         convert_k2jysr: {True, False}
             Perform conversion on sky_img from Kelvin to Jy/sr.
+        uvgrid_cache: string or `cache.FileCache`, optional
+            Directory (or cache object) of a persistent uv-grid cache.
+            If given, im2uv reuses the uv-grid of an identical sky image,
+            normalizer and padding instead of running maps_im2uv again.
+        manifest: string or `manifest.Manifest`, optional
+            Output manifest file. If given, each stage records its input
+            hashes and outputs there, and skips itself when a previous run
+            left valid outputs for the same inputs.
+        uvgrid: string, optional
+            An existing uv-grid (.dat) written by maps_im2uv, to use instead
+            of gridding sky_img. It is not removed after visgen.
+        telemetry: string or `telemetry.JSONLinesSink`, optional
+            JSON-lines file receiving one structured event (wall time, CPU
+            time, peak RSS, bytes read and written) per stage run.
+        scratch: string or `scratch.Scratch`, optional
+            Fast local directory (or scratch object with a byte budget) for
+            the intermediate uv-grid and visgen output, e.g. '/dev/shm'.
+            Only the .uvfits file, logs and spec are then written to the
+            working directory, and the intermediates are removed when the
+            drift finishes or fails. Given a directory, the drift uses a
+            subdirectory of its own and removes it then; a shared scratch
+            object is removed by `scratch.Scratch.close`.
+        oobs_cutoff: float, optional
+            Radius around the pointing center [degree] beyond which oobs
+            sources are dropped before visgen. If given, or if oobs is a
+            compiled catalog, visgen gets a temporary list of the sources
+            above the horizon (and within the cutoff) at some time during
+            the drift.
+        cutout_fov: float, optional
+            Field of view [degree]. If given, im2uv grids a cutout of
+            sky_img of this size centred on the pointing center, zero-padded
+            to an FFT-friendly size, instead of the whole image, and
+            fov_size is set to the size of the cutout.
+        cutout_cache: string or `cache.FileCache`, optional
+            Cache of cutouts, keyed by image content, pointing and field of
+            view. Defaults to uvgrid_cache.
+        result_cache: string or `cache.FileCache`, optional
+            Cache of visgen and maps2uvfits outputs, keyed by the stage keys
+            (see `stage_keys`), which do not depend on the drift name. A
+            drift identical to one run before, in this or an earlier sweep,
+            gets its .vis and .uvfits files hardlinked from the cache
+            instead of running visgen, and skips im2uv.
 
         """
         # TODO: assert that eitehr sky_img or oobs exist
@@ -110,6 +233,11 @@ class Drift:
         else:
             self.fov_center_ra = pointing_center[0]
             self.fov_center_dec = pointing_center[1]
+        self.cutout_fov = cutout_fov
+        if cutout_fov is not None:
+            cdelt, npix, self._cutout_npix = cutout.geometry(sky_img,
+                                                             cutout_fov)
+            fov_size = (self._cutout_npix * cdelt * 3600.,) * 2
         self.fov_size_ra = str(fov_size[0])
         self.fov_size_dec = str(fov_size[1])
         self._center_frequency = frequency
@@ -136,23 +264,44 @@ class Drift:
             self.name = name
         self.sky_img = sky_img
         self.oobs = oobs
+        self.oobs_cutoff = oobs_cutoff
         self.spec_file = None
-        self.vis_in = None
+        self.uvgrid = uvgrid
+        self.vis_in = uvgrid
         self.vis_out = None
         self.vislog = None
         self.uvfits = None
         self.convert_k2jysr = convert_k2jysr
+        self._im2uv_deferred = False
+        self._timers = []
+        self.uvgrid_cache = _coerce(uvgrid_cache, FileCache)
+        if cutout_cache is None:
+            self.cutout_cache = self.uvgrid_cache
+        else:
+            self.cutout_cache = _coerce(cutout_cache, FileCache)
+        self.result_cache = _coerce(result_cache, FileCache)
+        self.manifest = _coerce(manifest, Manifest)
+        self.telemetry = _coerce(telemetry, JSONLinesSink)
+        # A scratch object made from a directory belongs to this drift and
+        # is closed by clean_scratch; a shared one is closed by its owner.
+        self.scratch = _coerce(scratch, Scratch)
+        self._owns_scratch = self.scratch is not scratch
         self.__spec = ''
         self.update_spec()
-        self.__log = ''
+        self.__log = []
 
     def __str__(self):
-        return self.__spec + self.__log
+        return self.__spec + ''.join(self.__log)
+
+    def spec_body(self):
+        """
+        The scan block of the spec, without the timestamped header.
+
+        """
+        return ''.join('{0} = {1}\n'.format(k, self.__dict__.get(k.lower()))
+                       for k in SPEC_KEYS) + 'Endscan\n\n'
 
     def update_spec(self):
-        speckeys = np.array(['FOV_center_RA', 'FOV_center_Dec', 'FOV_size_RA',
-                             'FOV_size_Dec', 'Corr_int_time', 'Corr_chan_bw',
-                             'Scan_start', 'Scan_duration', 'Channel'])
         header = ('# {0}\n'
                   '# MAPS drift scan simulation\n'
                   '# name: {1}\n'
@@ -166,10 +315,7 @@ class Drift:
                   .format(str(datetime.now()), self.name, self.sky_img,
                           self.oobs, self.vis_in, self.vis_out, self.uvfits,
                           self.vislog, self.spec_file))
-        spec = ''
-        for k in speckeys:
-            spec += '{0} = {1}\n'.format(k, self.__dict__.get(k.lower()))
-        self.__spec = header + spec + 'Endscan\n\n'
+        self.__spec = header + self.spec_body()
 
     def print_spec(self):
         print(self.__spec)
@@ -196,7 +342,7 @@ class Drift:
             f.write(self.__spec)
 
     def append_log(self, string):
-        self.__log += '# {0}\n{1}\n'.format(str(datetime.now()), string)
+        self.__log.append('# {0}\n{1}\n'.format(str(datetime.now()), string))
 
     def print_log(self):
         print(self.__str__())
@@ -209,79 +355,1013 @@ class Drift:
         with open(self.name + '.log', 'w') as f:
             f.write(self.__str__())
 
+    def _im2uv_key(self):
+        if self.cutout_fov is not None:
+            return make_key('im2uv', self._cutout_key(), self._normalizer(),
+                            None)
+        return make_key('im2uv', file_digest(self.sky_img), self._normalizer(),
+                        None)
+
+    def _cutout_key(self):
+        return cutout.key(self.sky_img, astro.hms2h(self.fov_center_ra),
+                          astro.dms2d(self.fov_center_dec), self.cutout_fov)
+
+    def _cutout(self):
+        """
+        Make (or fetch from the cutout cache) the cutout of sky_img at the
+        pointing center.
+
+        """
+        ra = astro.hms2h(self.fov_center_ra)
+        dec = astro.dms2d(self.fov_center_dec)
+        outfile = self._scratch_path(self.name + '_cutout.fits',
+                                     4 * self._cutout_npix ** 2)
+        if self.cutout_cache is None:
+            cutout.cutout(self.sky_img, outfile, ra, dec, self.cutout_fov)
+            note = ''
+        else:
+            key = self._cutout_key()
+            outfile, hit = self.cutout_cache.fetch(
+                key, '.fits', outfile,
+                lambda f: cutout.cutout(self.sky_img, f, ra, dec,
+                                        self.cutout_fov))
+            note = '# >>> cutout cache {0}: {1}\n'\
+                .format('hit' if hit else 'miss', key)
+        self.append_log('# $> cutout({0}, {1} {2}, {3} deg)\n'
+                        .format(self.sky_img, self.fov_center_ra,
+                                self.fov_center_dec, self.cutout_fov) + note)
+        return outfile
+
+    def _grid(self, vis, normalizer):
+        """
+        Steps of im2uv of sky_img, or of its cutout if cutout_fov is set.
+
+        """
+        image = self.sky_img if self.cutout_fov is None else self._cutout()
+        try:
+            yield self._launch('im2uv', image, vis=vis, verbose=False,
+                               normalizer=normalizer)
+        finally:
+            if image != self.sky_img:
+                os.remove(image)
+
+    def stage_keys(self):
+        """
+        Hash the inputs of each stage.
+
+        The key of a stage covers its own inputs and the key of the stage
+        before it: the sky image content and normalizer for im2uv;
+        the spec body, oobs list, array config and site for visgen; and the
+        array location and config for maps2uvfits.
+
+        Return
+        ------
+        out: dict
+            Input key per stage name.
+
+        """
+        arrayconf = s.MAPS.ARRAY_CONFIG[self.site.lower()]
+        im2uv = self._im2uv_key() if self.sky_img is not None else None
+        grid = im2uv if self.uvgrid is None else _digest(self.uvgrid)
+        oobs = _digest(self.oobs)
+        if self._culls_oobs():
+            # The cull also depends on the scan start, pointing and duration
+            # in the spec body.
+            oobs = (oobs, self.oobs_cutoff,
+                    s.MAPS.ARRAY_LOC[self.site.lower()])
+        visgen = make_key('visgen', self.spec_body(), grid, oobs,
+                          _digest(arrayconf), self.site.lower())
+        maps2uvfits = make_key('maps2uvfits', visgen,
+                               s.MAPS.ARRAY_LOC[self.site.lower()],
+                               _digest(arrayconf))
+        return {'im2uv': im2uv, 'visgen': visgen, 'maps2uvfits': maps2uvfits}
+
+    def _up_to_date(self, stage, log=True):
+        """
+        True if the manifest holds valid outputs of this stage or of a
+        later one, in which case the stage does not need to run.
+
+        """
+        if self.manifest is None:
+            return False
+        keys = self.stage_keys()
+        for st in STAGES[STAGES.index(stage):]:
+            if self.manifest.valid(self.name, st, keys[st]):
+                if log:
+                    self.append_log('# $> {0}() skipped, outputs are up to '
+                                    'date\n'.format(stage))
+                return True
+        return False
+
+    def _deduped(self):
+        """
+        True if the result cache holds the visgen output of this drift.
+
+        """
+        return self.result_cache is not None and \
+            self.result_cache.lookup(self.stage_keys()['visgen'],
+                                     '.vis') is not None
+
+    def _result(self, stage, suffix, outfile, produce):
+        """
+        Steps of ``produce(outfile)``, or with a result cache hardlink the
+        output of an identical earlier run of the stage to outfile.
+        Return the log note.
+
+        """
+        if self.result_cache is None:
+            yield from produce(outfile)
+            return ''
+        key = self.stage_keys()[stage]
+        with self.result_cache.reserve(key, suffix, outfile) as entry:
+            if not entry.hit:
+                yield from produce(entry.tmp)
+        return '# >>>> result cache {0}: {1}\n'\
+            .format('hit' if entry.hit else 'miss', key)
+
+    def _record(self, stage, *outputs):
+        if self.manifest is not None:
+            self.manifest.record(self.name, stage, self.stage_keys()[stage],
+                                 outputs)
+
+    @contextmanager
+    def _timer(self, stage, inputs=(), outputs=lambda: ()):
+        extra = None
+        if self.telemetry is not None:
+            # Recorded so that `cost.CostModel.calibrate` can fit the events.
+            extra = {'features': cost.features(self)}
+        with StageTimer(self.telemetry, self.name, stage, inputs, outputs,
+                        extra) as timer:
+            # Innermost first; `_launch` reports child usage to it.
+            self._timers.append(timer)
+            try:
+                yield timer
+            finally:
+                self._timers.pop()
+
+    def _launch(self, program, *args, **kwargs):
+        """
+        A `_Launch` of a MAPS program, whose resource usage goes to the
+        stage timer in effect.
+
+        """
+        if self._timers:
+            kwargs['usage'] = self._timers[-1].children
+        return _Launch(program, *args, **kwargs)
+
+    def _normalizer(self):
+        if self.convert_k2jysr:
+            k_b, c = astro._constants()
+            return 2 * (self._center_frequency * 1e6) ** 2 * k_b / (c ** 2)
+        return None
+
     def im2uv(self):
+        _drive(self._im2uv_steps())
+
+    def _im2uv_steps(self):
         if self.sky_img is None:
             raise _InputError('No imagae file', self.im2uv.__name__,
                               self.__name__)
+        elif self._up_to_date('im2uv'):
+            # Only needed (and present) if visgen has not run yet.
+            vis_in = self._vis_in_path()
+            self.vis_in = vis_in if os.path.exists(vis_in) else None
+        elif self._deduped():
+            # Run later by visgen if the cache entry is gone by then.
+            self._im2uv_deferred = True
+            self.append_log('# $> im2uv() skipped, visgen output is in the '
+                            'result cache\n')
         else:
-            print('# im2uv: ' + self.name)
-            if self.convert_k2jysr:
-                normalizer = 2 * (self._center_frequency * 1e6) ** 2 \
-                    * const.k_B.si.value / (const.c.si.value ** 2)
+            yield from self._make_uvgrid()
+
+    def _make_uvgrid(self):
+        print('# im2uv: ' + self.name)
+        normalizer = self._normalizer()
+        vis_in = self._vis_in_path()
+        with self._timer('im2uv', [self.sky_img], lambda: [vis_in]):
+            if self.uvgrid_cache is None:
+                yield from self._grid(vis_in, normalizer)
+                cached = ''
             else:
-                normalizer = None
-            pymaps.im2uv(self.sky_img, verbose=False, normalizer=normalizer)
-            self.vis_in = self.sky_img.rsplit('/', 1)[-1][0:-5] + '.dat'
-            self.update_spec()
-            self.append_log('# $> im2uv({0})\n'
-                            '# >>> sky uvgrid: {1}\n'
-                            .format(self.sky_img, self.vis_in))
+                key = self._im2uv_key()
+                with self.uvgrid_cache.reserve(key, '.dat', vis_in) as entry:
+                    if not entry.hit:
+                        yield from self._grid(entry.tmp, normalizer)
+                vis_in = entry.path
+                cached = '# >>> uvgrid cache {0}: {1}\n'\
+                    .format('hit' if entry.hit else 'miss', key)
+        self._im2uv_done(vis_in, cached)
+        self._record('im2uv', self.vis_in)
+
+    def _vis_in_name(self):
+        if self.uvgrid_cache is None:
+            return self.sky_img.rsplit('/', 1)[-1][0:-5] + '.dat'
+        return self.name + '.dat'
+
+    def _vis_in_nbytes(self):
+        # A uv-grid is about twice the size of its image (complex64).
+        if self.cutout_fov is not None:
+            return 8 * self._cutout_npix ** 2
+        return 2 * os.path.getsize(self.sky_img)
+
+    def _vis_in_path(self):
+        return self._scratch_path(self._vis_in_name(), self._vis_in_nbytes)
+
+    def _vis_nbytes(self):
+        # The output bytes of the whole drift predicted by the default cost
+        # model, which bound those of visgen.
+        return cost.CostModel().predict(self)['bytes']
+
+    def _vis_out_path(self):
+        return self._scratch_path(self.name + '.vis', self._vis_nbytes)
+
+    def _scratch_path(self, filename, nbytes=0):
+        """
+        Where an intermediate file goes: scratch space if configured, the
+        working directory otherwise. `nbytes` is the estimated size of the
+        file, or a function returning it, only called with scratch space.
+
+        """
+        if self.scratch is None:
+            return filename
+        if callable(nbytes):
+            nbytes = nbytes()
+        return self.scratch.path(filename, nbytes)
+
+    def _im2uv_done(self, vis_in, note=''):
+        self.vis_in = vis_in
+        self.update_spec()
+        self.append_log('# $> im2uv({0})\n'
+                        '# >>> sky uvgrid: {1}\n'
+                        .format(self.sky_img, self.vis_in) + note)
 
     def visgen(self, mpi=1):
+        _drive(self._visgen_steps(mpi))
+
+    def _visgen_steps(self, mpi=1):
         if self.spec_file is None:
             raise _InputError('No oobs file')
-        if self.vis_in is None and self.oobs is None:
+        if self._up_to_date('visgen'):
+            self.vis_out = self._vis_out_path()
+            self.vislog = self.name + '.vislog'
+        elif self.vis_in is None and self.oobs is None and \
+                not self._im2uv_deferred:
             raise _InputError('Neither uvgrid file nor oob source list exist.',
                               self.visgen.__name__, self.name)
         else:
             print('# visgen: ' + self.name)
-            pymaps.visgen(self.name, self.spec_file, oobs=self.oobs,
-                        uvgrid=self.vis_in, mpi=mpi, site=self.site)
-            self.vis_out = self.name + '.vis'
-            self.vislog = self.name + '.vislog'
-            self.update_spec()
-            self.append_log('# $> visgen()\n'
-                            '# >>>> visgen visibility: {0}\n'
-                            '# >>>> visgen log file: {1}\n'
-                            .format(self.vis_out, self.vislog))
+            vis_out = self._vis_out_path()
+
+            def produce(vis):
+                if self._im2uv_deferred and self.vis_in is None:
+                    # The result cache entry im2uv was skipped for has been
+                    # evicted since; the key lock is held until it is back.
+                    yield from self._make_uvgrid()
+                oobs = self._visgen_oobs()
+                try:
+                    yield self._launch('visgen', vis[:-4], self.spec_file,
+                                       oobs=oobs, uvgrid=self.vis_in,
+                                       mpi=mpi, site=self.site,
+                                       log_prefix=self.name)
+                finally:
+                    self._remove_oobs(oobs)
+
+            with self._timer('visgen', [self.spec_file, self.vis_in,
+                                        self.oobs],
+                             lambda: [vis_out]):
+                note = yield from self._result('visgen', '.vis', vis_out,
+                                               produce)
+            self._visgen_done(vis_out, note)
+            self._record('visgen', self.vis_out)
+
+    def _start_lst(self):
+        """
+        Local sidereal time at the start of the drift [decimal hours], as
+        visgen takes it from Scan_start and the site.
+
+        """
+        return astro.scan_start_lst(
+            self.scan_start, float(s.MAPS.ARRAY_LOC[self.site.lower()][1]))
+
+    def _culls_oobs(self):
+        return self.oobs is not None and (self.oobs_cutoff is not None or
+                                          self.oobs.endswith('.npy'))
+
+    def _oobs_rows(self, catalog):
+        """
+        Catalog rows above the horizon, and within oobs_cutoff of the
+        pointing center if given, at some time during the drift.
+
+        """
+        # The sky turns by this much during the drift.
+        margin = 15. * float(self.scan_duration) / 3600.
+        lat = float(s.MAPS.ARRAY_LOC[self.site.lower()][0])
+        rows = catalog.cone(self._start_lst(), lat, 90. + margin)
+        if self.oobs_cutoff is not None:
+            beam = catalog.cone(astro.hms2h(self.fov_center_ra),
+                                astro.dms2d(self.fov_center_dec),
+                                self.oobs_cutoff + margin)
+            rows = np.intersect1d(rows, beam)
+        return rows
+
+    def _visgen_oobs(self, rows=None, name=None):
+        """
+        The oobs list for visgen: the original one, or a temporary list of
+        the catalog rows culled to this drift (or the given rows). None if
+        culling leaves no source and there is a uv-grid.
+
+        """
+        if not self._culls_oobs():
+            return self.oobs
+        catalog = Catalog(self.oobs)
+        if rows is None:
+            rows = self._oobs_rows(catalog)
+        if len(rows) == 0 and self.vis_in is not None:
+            return None
+        filename = self._scratch_path((name or self.name) + '.oobs')
+        catalog.write_oobs(filename, rows)
+        self.append_log('# >>>> oobs: {0:d} of {1:d} sources of {2}\n'
+                        .format(len(rows), len(catalog), self.oobs))
+        return filename
+
+    def _remove_oobs(self, oobs):
+        if oobs is not None and oobs != self.oobs and os.path.exists(oobs):
+            os.remove(oobs)
+
+    def _visgen_done(self, vis_out=None, note=''):
+        self.vis_out = vis_out or self.name + '.vis'
+        self.vislog = self.name + '.vislog'
+        self.update_spec()
+        self.append_log('# $> visgen()\n'
+                        '# >>>> visgen visibility: {0}\n'
+                        '# >>>> visgen log file: {1}\n'
+                        .format(self.vis_out, self.vislog) + note)
 
     def maps2uvfits(self):
+        _drive(self._maps2uvfits_steps())
+
+    def _maps2uvfits_steps(self):
         if self.vis_out is None:
             raise _InputError('visibility from visgen is not present',
                               self.maps2uvfits.__name__, self.name)
+        elif self._up_to_date('maps2uvfits'):
+            self.uvfits = self.name + '.uvfits'
         else:
             print('# maps2uvfits: ' + self.name)
-            pymaps.maps2uvfits(self.vis_out, site=self.site, verbose=False)
-            self.uvfits = self.name + '.uvfits'
-            self.update_spec()
-            self.append_log('# $> maps2uvfits({0})\n'
-                            '# >>>> uvfits: {1}\n'
-                            .format(self.vis_out, self.uvfits))
+            with self._timer('maps2uvfits', [self.vis_out],
+                             lambda: [self.name + '.uvfits']):
+                note = yield from self._result('maps2uvfits', '.uvfits',
+                                               self.name + '.uvfits',
+                                               self._convert)
+            self._maps2uvfits_done(note)
+            self._record('maps2uvfits', self.uvfits)
 
-    def run(self):
-        # TODO: Need to check if input exist
-        if self.sky_img is not None:
-            self.im2uv()
-        self.write_spec()
-        self.visgen()
-        if self.vis_in is not None:
+    def _convert(self, uvfits):
+        yield self._launch('maps2uvfits', self.vis_out, uvfits,
+                           site=self.site, verbose=False)
+
+    def _maps2uvfits_done(self, note=''):
+        self.uvfits = self.name + '.uvfits'
+        self.update_spec()
+        self.append_log('# $> maps2uvfits({0})\n'
+                        '# >>>> uvfits: {1}\n'
+                        .format(self.vis_out, self.uvfits) + note)
+
+    def remove_vis_in(self):
+        """
+        Remove the intermediate uv-grid once visgen has used it.
+
+        """
+        if self.vis_in is not None and self.vis_in != self.uvgrid:
             os.remove(self.vis_in)
             self.append_log('# remove ' + self.vis_in)
-        self.maps2uvfits()
-        self.write_spec()
-        self.write_log()
 
+    def clean_scratch(self):
+        """
+        Remove the intermediates this drift left in scratch space (or
+        spilled), including partial ones of a failed stage.
+
+        """
+        if self.scratch is None:
+            return
+        names = [self.name + '.vis']
+        if self.sky_img is not None and self.uvgrid is None:
+            names.append(self._vis_in_name())
+        for name in names:
+            for f in self.scratch.remove(name):
+                self.append_log('# remove ' + f)
+        if self._owns_scratch:
+            self.scratch.close()
+
+    def run(self, mpi=1):
+        _drive(self._run_steps(mpi))
 
-def __call_go(instance):
+    def _run_steps(self, mpi=1):
+        # TODO: Need to check if input exist
+        try:
+            if self.sky_img is not None:
+                yield from self._im2uv_steps()
+            self.write_spec()
+            yield from self._visgen_steps(mpi)
+            self.remove_vis_in()
+            yield from self._maps2uvfits_steps()
+            self.write_spec()
+            self.write_log()
+        finally:
+            self.clean_scratch()
+
+
+class DriftSweep:
+    """
+    Run many drifts (channels and/or HAs) in a single visgen invocation.
+
+    The sweep writes one spec file with one scan block per drift, runs
+    visgen once, and converts its multi-scan output with maps2uvfits into
+    one .uvfits file for the whole sweep (name + '.uvfits'). The array
+    config, the uv-grid and the source list are therefore loaded once per
+    sweep instead of once per drift.
+
+    The visgen output is not split into a file per drift, as that would
+    rely on the .vis layout of `visfile`, which has not been verified
+    against visgen. The `uvfits` of every drift is the sweep file; their
+    spec and log files are written as usual.
+
+    All drifts must share the sky image (and its normalizer), the oobs list
+    and the site, and have distinct names.
+
+    """
+    def __init__(self, drifts, name=None):
+        """
+        Parameters
+        ----------
+        drifts: list of `Drift`
+            Drifts to run, in scan order.
+        name: string, optional
+            Name of the sweep, used for the spec file, the visgen output
+            and log. The name of the first drift + '_sweep' if None.
+
+        """
+        self.drifts = list(drifts)
+        if name is None:
+            name = self.drifts[0].name + '_sweep'
+        self.name = name
+        first = self.drifts[0]
+        for d in self.drifts[1:]:
+            if (d.sky_img, d.oobs, d.site) != \
+                    (first.sky_img, first.oobs, first.site):
+                raise _InputError('Drifts of a sweep must share sky_img, '
+                                  'oobs and site', '__init__', self.name)
+            if d.cutout_fov is not None and \
+                    (d.cutout_fov, d.fov_center_ra, d.fov_center_dec) != \
+                    (first.cutout_fov, first.fov_center_ra,
+                     first.fov_center_dec):
+                raise _InputError('Drifts of a sweep must share the cutout '
+                                  'and pointing center', '__init__',
+                                  self.name)
+            if d.sky_img is not None and \
+                    d._normalizer() != first._normalizer():
+                raise _InputError('Drifts of a sweep must share the im2uv '
+                                  'normalizer; convert_k2jysr depends on '
+                                  'frequency', '__init__', self.name)
+        if len(set(d.name for d in self.drifts)) != len(self.drifts):
+            raise _InputError('Drift names must be unique', '__init__',
+                              self.name)
+        self.spec_file = None
+        self.vis_out = None
+        self.uvfits = None
+
+    @classmethod
+    def from_frequencies(cls, target_ra, target_ha, frequencies, name=None,
+                         **kwargs):
+        """
+        Sweep of one drift per frequency, e.g.
+        `settings.MWA.FREQ_EOR_ALL_40KHZ`.
+
+        Other keyword arguments are passed to `Drift`. Drift names are
+        (name + '_{frequency:.3f}MHz').
+
+        """
+        drifts = [Drift(target_ra, target_ha, frequency=f, **kwargs)
+                  for f in frequencies]
+        if name is None:
+            name = drifts[0].name
+        for d, f in zip(drifts, frequencies):
+            d.name = '{0}_{1:.3f}MHz'.format(name, f)
+            d.update_spec()
+        return cls(drifts, name=name + '_sweep')
+
+    def spec(self):
+        header = ('# {0}\n'
+                  '# MAPS drift scan sweep\n'
+                  '# name: {1}\n'
+                  '# scans: {2:d}\n'
+                  .format(str(datetime.now()), self.name, len(self.drifts)))
+        return header + ''.join(d.spec_body() for d in self.drifts)
+
+    def write_spec(self):
+        """
+        Write the multi-scan spec file (name + '.ospec').
+
+        """
+        self.spec_file = self.name + '.ospec'
+        with open(self.spec_file, 'w') as f:
+            f.write(self.spec())
+
+    def visgen(self, mpi=1):
+        first = self.drifts[0]
+        vis_in = first.vis_in
+        if vis_in is None and first.oobs is None:
+            raise _InputError('Neither uvgrid file nor oob source list exist.',
+                              'visgen', self.name)
+        print('# visgen: ' + self.name)
+        self.vis_out = first._scratch_path(
+            self.name + '.vis',
+            lambda: sum(d._vis_nbytes() for d in self.drifts))
+        rows = None
+        if first._culls_oobs():
+            catalog = Catalog(first.oobs)
+            rows = np.unique(np.concatenate([d._oobs_rows(catalog)
+                                             for d in self.drifts]))
+        oobs = first._visgen_oobs(rows, self.name)
+        try:
+            with StageTimer(first.telemetry, self.name, 'visgen',
+                            [self.spec_file, vis_in, oobs],
+                            lambda: [self.vis_out]) as timer:
+                pymaps.visgen(self.vis_out[:-4], self.spec_file, oobs=oobs,
+                              uvgrid=vis_in, mpi=mpi, site=first.site,
+                              log_prefix=self.name, usage=timer.children)
+        finally:
+            first._remove_oobs(oobs)
+        for d in self.drifts:
+            d._visgen_done(self.vis_out)
+            d.vislog = self.name + '.vislog'
+            d.append_log('# >>>> scan of sweep {0}, spec {1}\n'
+                         .format(self.name, self.spec_file))
+
+    def maps2uvfits(self):
+        first = self.drifts[0]
+        print('# maps2uvfits: ' + self.name)
+        uvfits = self.name + '.uvfits'
+        with StageTimer(first.telemetry, self.name, 'maps2uvfits',
+                        [self.vis_out], lambda: [uvfits]) as timer:
+            pymaps.maps2uvfits(self.vis_out, uvfits, site=first.site,
+                               verbose=False, usage=timer.children)
+        self.uvfits = uvfits
+        for d in self.drifts:
+            d.uvfits = uvfits
+            d.update_spec()
+            d.append_log('# $> maps2uvfits({0})\n'
+                         '# >>>> uvfits: {1}\n'
+                         .format(self.vis_out, uvfits))
+
+    def run(self, mpi=1):
+        first = self.drifts[0]
+        try:
+            if first.sky_img is not None:
+                first.im2uv()
+                for d in self.drifts[1:]:
+                    d._im2uv_done(first.vis_in)
+            self.write_spec()
+            self.visgen(mpi=mpi)
+            first.remove_vis_in()
+            self.maps2uvfits()
+            for d in self.drifts:
+                d.write_spec()
+                d.write_log()
+        finally:
+            if first.scratch is not None:
+                first.scratch.remove(self.name + '.vis')
+            for d in self.drifts:
+                d.clean_scratch()
+
+
+class DriftGrid:
+    """
+    Compact, array-backed set of drifts for large parameter sweeps.
+
+    Target RA, HA, frequency and optionally the sky image are NumPy
+    columns with one row per drift; every other `Drift` parameter is shared
+    by all rows. Spec text is generated for all rows at once, and
+    `batch_drift` sends the grid to each worker once and then only row
+    indices, so memory and dispatch cost stay flat for 10^5 drifts. A full
+    `Drift` is only built by the worker running it (see `drift`).
+
+    Rows sharing a sky image should also share a `uvgrid_cache`, otherwise
+    concurrent rows write and remove the same uv-grid file.
+
+    """
+    def __init__(self, target_ra, target_ha, frequency=140.0, sky_img=None,
+                 name='drift', **kwargs):
+        """
+        Parameters
+        ----------
+        target_ra, target_ha, frequency: float or array-like
+            Columns of the grid, broadcast against each other (and sky_img)
+            and flattened. See `Drift`.
+        sky_img: string or array-like of string, optional
+            Sky image, shared or per row.
+        name: string, optional
+            Prefix of the drift names, which are name + '_{row:06d}'.
+
+        Other keyword arguments are passed to every `Drift`.
+
+        """
+        columns = [np.asarray(target_ra, dtype=float),
+                   np.asarray(target_ha, dtype=float),
+                   np.asarray(frequency, dtype=float)]
+        if sky_img is not None:
+            columns.append(np.asarray(sky_img, dtype=str))
+        columns = [c.ravel() for c in np.broadcast_arrays(*columns)]
+        self.ra, self.ha, self.frequency = columns[:3]
+        self.sky_img = columns[3] if sky_img is not None else None
+        if len(self.ra) == 0:
+            raise _InputError('Empty grid', '__init__', name)
+        self.name = name
+        self.kwargs = kwargs
+        # Parameters shared by all rows, as formatted by Drift.
+        template = Drift(self.ra[0], self.ha[0], frequency=self.frequency[0],
+                         sky_img=self._row_sky_img(0), name=name, **kwargs)
+        if kwargs.get('cutout_fov') is not None and self.sky_img is not None:
+            # fov_size follows from the cutout geometry of the image.
+            geometries = set(cutout.geometry(img, kwargs['cutout_fov'])
+                             for img in np.unique(self.sky_img))
+            if len(geometries) > 1:
+                raise _InputError('Sky images with different cutout '
+                                  'geometries', '__init__', name)
+        self._shared = dict((k.lower(), getattr(template, k.lower()))
+                            for k in SPEC_KEYS)
+        self._zenith = kwargs.get('pointing_center', 'zenith') == 'zenith'
+
+    @classmethod
+    def product(cls, target_ra, target_ha, frequency, **kwargs):
+        """
+        Grid of every combination of target_ra, target_ha and frequency,
+        with frequency varying fastest.
+
+        """
+        ra, ha, freq = np.meshgrid(np.atleast_1d(target_ra),
+                                   np.atleast_1d(target_ha),
+                                   np.atleast_1d(frequency), indexing='ij')
+        return cls(ra, ha, freq, **kwargs)
+
+    def __len__(self):
+        return len(self.ra)
+
+    def __repr__(self):
+        return 'DriftGrid({0!r}, rows={1:d})'.format(self.name, len(self))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.drift(i)
+
+    def row_name(self, i):
+        return '{0}_{1:06d}'.format(self.name, i)
+
+    def names(self):
+        return [self.row_name(i) for i in range(len(self))]
+
+    def _row_sky_img(self, i):
+        return str(self.sky_img[i]) if self.sky_img is not None else None
+
+    def drift(self, i):
+        """
+        The `Drift` of row i.
+
+        """
+        return Drift(float(self.ra[i]), float(self.ha[i]),
+                     frequency=float(self.frequency[i]),
+                     sky_img=self._row_sky_img(i),
+                     name=self.row_name(i), **self.kwargs)
+
+    def spec_bodies(self, rows=None):
+        """
+        Scan blocks of the given rows (all if None), built column-wise.
+
+        Return
+        ------
+        out: list of str
+            Same as `Drift.spec_body` of each row.
+
+        """
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows)
+        n = len(rows)
+        columns = dict((k, np.full(n, v, dtype=object))
+                       for k, v in self._shared.items())
+        ra, ha = self.ra[rows], self.ha[rows]
+        if self._zenith:
+            columns['fov_center_ra'] = np.atleast_1d(astro.h2hms24(ra + ha))
+        bw = float(self._shared['corr_chan_bw'])
+        columns['channel'] = np.array(
+            [str(f - bw / 2.) + ':' + self._shared['corr_chan_bw']
+             for f in self.frequency[rows].tolist()], dtype=object)
+        out = np.full(n, '', dtype=object)
+        for k in SPEC_KEYS:
+            out = out + (k + ' = ') + columns[k.lower()].astype(object) + '\n'
+        return (out + 'Endscan\n\n').tolist()
+
+    def spec(self, rows=None):
+        """
+        Multi-scan spec text of the given rows, as for `DriftSweep`.
+
+        """
+        header = ('# {0}\n'
+                  '# MAPS drift scan grid\n'
+                  '# name: {1}\n'
+                  '# scans: {2:d}\n'
+                  .format(str(datetime.now()), self.name,
+                          len(self) if rows is None else len(rows)))
+        return header + ''.join(self.spec_bodies(rows))
+
+
+SPEC_KEYS = ('FOV_center_RA', 'FOV_center_Dec', 'FOV_size_RA', 'FOV_size_Dec',
+             'Corr_int_time', 'Corr_chan_bw', 'Scan_start', 'Scan_duration',
+             'Channel')
+
+STAGES = ('im2uv', 'visgen', 'maps2uvfits')
+
+# Failures worth retrying: visgen errors and I/O errors (e.g. a full disk
+# or a flaky network filesystem), except those that a retry cannot fix.
+TRANSIENT = (pymaps._VisgenError, OSError)
+PERMANENT = (FileNotFoundError, PermissionError, IsADirectoryError,
+             NotADirectoryError)
+
+
+def _digest(filename):
     """
-    Wrapper to make Drift.run() pickle-able.
+    Content digest of an input file, or its name if it does not exist.
 
     """
-    return instance.run()
+    if filename is not None and os.path.exists(filename):
+        return file_digest(filename)
+    return filename
 
 
-def batch_drift(instance, nprocs=4):
-    pool = multiprocessing.Pool(nprocs)
-    pool.map(__call_go, instance)
-    pool.close()
-    pool.join()
+_WORKER = {}
+
+
+def _init_worker(grid, retries, backoff, transient, permanent):
+    _WORKER.update(grid=grid, retries=retries, backoff=backoff,
+                   transient=transient, permanent=permanent)
+
+
+def _attempt(task):
+    """
+    Run one drift in a worker, retrying transient failures with
+    exponential backoff. Never raises; failures are returned as results.
+
+    """
+    i, drift = task
+    grid = _WORKER['grid']
+    name = grid.row_name(i) if drift is None else drift.name
+    start = time.time()
+    attempt = 0
+    while True:
+        attempt += 1
+        # A fresh copy per attempt, so a retry does not inherit the state
+        # of the failed run.
+        d = grid.drift(i) if drift is None else copy.deepcopy(drift)
+        try:
+            d.run()
+        except _WORKER['permanent'] as err:
+            error = err
+            break
+        except _WORKER['transient'] as err:
+            if attempt > _WORKER['retries']:
+                error = err
+                break
+            time.sleep(_WORKER['backoff'] * 2 ** (attempt - 1))
+            continue
+        except Exception as err:
+            error = err
+            break
+        return {'index': i, 'name': name, 'status': 'ok',
+                'attempts': attempt, 'elapsed': time.time() - start,
+                'uvfits': d.uvfits, 'error': None}
+    return {'index': i, 'name': name, 'status': 'failed', 'attempts': attempt,
+            'elapsed': time.time() - start, 'uvfits': None,
+            'error': '{0}: {1}'.format(type(error).__name__, error)}
+
+
+def ibatch_drift(instance, nprocs=4, chunksize=None, retries=2, backoff=1.0,
+                 transient=TRANSIENT, permanent=PERMANENT, progress=10.0):
+    """
+    Run drifts in parallel, yielding a result per drift as it completes.
+
+    A failing drift does not abort the batch. Exceptions of the
+    `transient` types are retried up to `retries` times, waiting
+    backoff * 2**k seconds before retry k; any other exception, one of the
+    `permanent` types, or a transient one that persists, marks the drift
+    as failed.
+
+    Parameters
+    ----------
+    instance: list of `Drift` or `DriftGrid`
+        Drifts to run. A grid is sent once to each worker process, which
+        then receives row indices only.
+    nprocs: int, optional
+        Number of worker processes.
+    chunksize: int, optional
+        Drifts handed to a worker at a time. Defaults to a quarter of an
+        even share per worker, which keeps dispatch cheap while leaving
+        room to balance drifts of uneven duration.
+    retries: int, optional
+        Maximum number of retries of a transient failure.
+    backoff: float, optional
+        Initial retry delay [second].
+    transient: tuple of exception classes, optional
+        Failures worth retrying, by default visgen and OS errors
+        (`TRANSIENT`).
+    permanent: tuple of exception classes, optional
+        Subclasses of the transient types that are never retried, by
+        default missing files and permission errors (`PERMANENT`).
+    progress: float or None, optional
+        Print completed drifts, throughput and ETA at most every `progress`
+        seconds, and once at the end. No readout if None.
+
+    Yield
+    -----
+    out: dict
+        index, name, status ('ok' or 'failed'), attempts, elapsed [second],
+        uvfits, and error ('Type: message' of the last failure or None).
+
+    Examples
+    --------
+    >>> for res in ibatch_drift(drifts, nprocs=8):
+    ...     if res['status'] == 'failed':
+    ...         print(res['name'], res['error'])
+
+    """
+    if isinstance(instance, DriftGrid):
+        grid = instance
+        tasks = ((i, None) for i in range(len(grid)))
+    else:
+        grid = None
+        instance = list(instance)
+        tasks = enumerate(instance)
+    n = len(instance)
+    if chunksize is None:
+        chunksize = max(1, n // (4 * nprocs))
+    pool = multiprocessing.Pool(nprocs, _init_worker,
+                                (grid, retries, backoff, tuple(transient),
+                                 tuple(permanent)))
+    start = last = time.time()
+    done = failed = 0
+    try:
+        for res in pool.imap_unordered(_attempt, tasks, chunksize):
+            done += 1
+            failed += res['status'] != 'ok'
+            now = time.time()
+            if progress is not None and (now - last >= progress or
+                                         done == n):
+                rate = done / (now - start)
+                print('# ibatch_drift: {0:d}/{1:d} done, {2:d} failed, '
+                      '{3:.2f} drift/s, ETA {4:.0f} s'
+                      .format(done, n, failed, rate, (n - done) / rate))
+                last = now
+            yield res
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _set_default(instance, attr, value):
+    """
+    Set a Drift attribute of every drift (or grid row) that has none.
+
+    """
+    if isinstance(instance, DriftGrid):
+        if instance.kwargs.get(attr) is None:
+            instance.kwargs[attr] = value
+        return
+    for d in instance:
+        if getattr(d, attr) is None:
+            setattr(d, attr, value)
+
+
+def batch_drift(instance, nprocs=4, stage_nprocs=None, cores=None,
+                max_mpi=None, telemetry=None, cost_model=None,
+                memory=None, dry_run=False, result_cache=None, **kwargs):
+    """
+    Run a list of drifts in parallel.
+
+    Parameters
+    ----------
+    instance: list of `Drift` or `DriftGrid`
+        Drifts to run. A grid is sent once to each worker process, which
+        then receives row indices only.
+    nprocs: int, optional
+        Number of worker processes, each running whole drifts (see
+        `ibatch_drift`, which also takes the retry options `retries`,
+        `backoff`, `transient` and `permanent` as keyword arguments).
+    stage_nprocs: dict, optional
+        If given, run the drifts stage-pipelined instead, with this number
+        of workers per stage (see `scheduler.Pipeline`), e.g.
+        {'im2uv': 2, 'write_spec': 1, 'visgen': 8, 'maps2uvfits': 4}.
+        `nprocs` is then ignored.
+    cores: int, optional
+        If given, run the drifts under this total core budget, choosing the
+        number of visgen MPI ranks per drift so that concurrent drifts times
+        ranks never exceeds it (see `scheduler.CoreScheduler`). `nprocs` is
+        then ignored.
+    max_mpi: int, optional
+        Maximum number of MPI ranks per visgen when `cores` is given.
+    telemetry: string, optional
+        JSON-lines file receiving the stage events of drifts that have no
+        telemetry sink of their own. The events of this batch are then
+        aggregated into a sweep summary (see `telemetry.summarize`).
+    result_cache: string, optional
+        Result cache directory of drifts that have none of their own, so
+        drifts identical to each other or to those of an earlier sweep run
+        visgen only once (see `Drift`).
+    cost_model: `cost.CostModel` or string, optional
+        Cost model, or a telemetry JSON-lines file to calibrate one from
+        (see `cost.CostModel.calibrate`). Drifts are then started longest
+        first, one at a time per worker. Rows of a `DriftGrid` share their
+        settings and keep their order.
+    memory: float, optional
+        Memory budget of the concurrent drifts [byte]. With `cores`, drifts
+        wait until their predicted memory fits; otherwise the number of
+        worker processes is limited so that the largest drifts fit.
+    dry_run: boolean, optional
+        Run nothing; return the sweep projected by the cost model (see
+        `cost.simulate`), with the default model if none is given.
+
+    Return
+    ------
+    out: dict or None
+        With `cores`, the sweep report of `scheduler.CoreScheduler.run`,
+        including the achieved core utilisation. Without `cores` or
+        `stage_nprocs`, the number of drifts, the wall time and the results
+        of the failed drifts (see `ibatch_drift`). With `telemetry`, the
+        sweep summary is added as 'stages'. With `dry_run`, the projected
+        sweep.
+
+    """
+    grid = instance if isinstance(instance, DriftGrid) else None
+    if isinstance(cost_model, str):
+        cost_model = cost.CostModel.calibrate(cost_model)
+    if memory is not None and cost_model is None:
+        cost_model = cost.CostModel()
+    if dry_run:
+        model = cost_model if cost_model is not None else cost.CostModel()
+        drifts = list(instance)
+        if grid is None:
+            drifts = cost.lpt_order(drifts, model)
+        workers = cores if cores is not None else nprocs
+        projected = cost.simulate(drifts, model, workers, memory)
+        print('# batch_drift: {0:d} drifts on {1:d} workers, projected '
+              'wall {2:.1f} s, cpu {3:.1f} s, {4:.1f} MB written'
+              .format(projected['drifts'], workers, projected['makespan'],
+                      projected['cpu'], projected['bytes'] / 2. ** 20))
+        return projected
+    if grid is not None and (stage_nprocs is not None or cores is not None):
+        instance = list(grid)
+        grid = None
+    if cost_model is not None and grid is None and cores is None:
+        instance = cost.lpt_order(list(instance), cost_model)
+        kwargs.setdefault('chunksize', 1)
+    if result_cache is not None:
+        _set_default(instance, 'result_cache',
+                     _coerce(result_cache, FileCache))
+    if telemetry is not None:
+        sink = _coerce(telemetry, JSONLinesSink)
+        _set_default(instance, 'telemetry', sink)
+        start = time.time()
+    report = None
+    if stage_nprocs is not None:
+        scheduler.pipeline_drift(instance, nprocs=stage_nprocs)
+    elif cores is not None:
+        report = scheduler.CoreScheduler(cores, max_mpi=max_mpi,
+                                         memory=memory,
+                                         model=cost_model).run(instance)
+        print('# batch_drift: {0:d} drifts on {1:d} cores in {2:.1f} s, '
+              'core utilisation {3:.1%}'
+              .format(len(report['jobs']), cores, report['wall'],
+                      report['utilisation']))
+    else:
+        if memory is not None:
+            sample = instance if grid is None else [grid.drift(0)]
+            largest = max([cost_model.predict(d)['memory']
+                           for d in sample] + [1])
+            nprocs = max(1, min(nprocs, int(memory // largest)))
+        begin = time.time()
+        failed = [res for res in ibatch_drift(instance, nprocs=nprocs,
+                                              **kwargs)
+                  if res['status'] != 'ok']
+        report = {'drifts': len(instance), 'wall': time.time() - begin,
+                  'failed': failed}
+        for res in failed:
+            print('# batch_drift: {0} failed after {1:d} attempt(s): {2}'
+                  .format(res['name'], res['attempts'], res['error']))
+    if telemetry is None:
+        return report
+    names = set(grid.names() if grid is not None
+                else [d.name for d in instance])
+    summary = summarize([e for e in sink.events()
+                         if e['name'] in names and e['start'] >= start])
+    print_summary(summary)
+    if report is None:
+        report = {}
+    report['stages'] = summary
+    return report
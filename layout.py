@@ -0,0 +1,100 @@
+"""
+Array layouts from the MAPS array configuration files
+(`settings.MAPS.ARRAY_CONFIG`).
+
+"""
+from __future__ import print_function, division
+
+import os
+
+import numpy as np
+
+
+_LAYOUTS = {}
+
+
+def _station(tokens):
+    """
+    (name, [east, north, up]) of a station line, None if it is not one.
+
+    """
+    if len(tokens) not in (3, 4):
+        return None
+    try:
+        enu = [float(x) for x in tokens[-3:]]
+    except ValueError:
+        return None
+    if len(tokens) == 4:
+        try:
+            float(tokens[0])
+        except ValueError:
+            return tokens[0], enu
+        return None
+    return None, enu
+
+
+def read_array_config(filename):
+    """
+    Read station names and positions from an array configuration file.
+
+    Blank lines and lines starting with '#' are skipped. Every other line
+    must be a station, either 'name east north up' or 'east north up',
+    with the local east, north and up offsets from the array centre in
+    metres; stations without a name are named ANT001, ANT002, ... in file
+    order. Any other line raises ValueError rather than being guessed at.
+    Parsed layouts are memoized per (path, mtime).
+
+    This is the format assumed for the MAPS array files; it has not been
+    checked against the files of a MAPS installation.
+
+    Return
+    ------
+    out: (list of str, ndarray)
+        Station names and (nstation, 3) ENU positions [m].
+
+    """
+    key = (os.path.realpath(filename), os.path.getmtime(filename))
+    try:
+        return _LAYOUTS[key]
+    except KeyError:
+        pass
+    names = []
+    enu = []
+    with open(filename) as f:
+        for lineno, line in enumerate(f, 1):
+            tokens = line.split()
+            if not tokens or tokens[0].startswith('#'):
+                continue
+            station = _station(tokens)
+            if station is None:
+                raise ValueError('{0}:{1:d}: not a station line '
+                                 "('[name] east north up'): {2!r}"
+                                 .format(filename, lineno, line.strip()))
+            name, position = station
+            names.append(name or 'ANT{0:03d}'.format(len(names) + 1))
+            enu.append(position)
+    layout = (names, np.array(enu, dtype=float).reshape(-1, 3))
+    _LAYOUTS[key] = layout
+    return layout
+
+
+def enu2xyz(enu, latitude):
+    """
+    Rotate local ENU offsets [m] into the equatorial XYZ frame of the array
+    (X towards the local meridian at the equator, Z towards the pole).
+
+    Parameters
+    ----------
+    enu: (..., 3) array-like
+        East, north, up offsets.
+    latitude: float
+        Latitude of the array [degree].
+
+    """
+    enu = np.asarray(enu, dtype=float)
+    lat = np.radians(latitude)
+    e, n, u = enu[..., 0], enu[..., 1], enu[..., 2]
+    x = -np.sin(lat) * n + np.cos(lat) * u
+    y = e
+    z = np.cos(lat) * n + np.sin(lat) * u
+    return np.stack([x, y, z], axis=-1)
@@ -0,0 +1,119 @@
+"""
+Output manifest for incremental, resumable drift sweeps.
+
+The manifest records, for each drift and stage, a key hashing the inputs of
+the stage (see `driftscan.Drift.stage_keys`) and the size, mtime and digest
+of the files the stage wrote. A stage whose key is unchanged and whose
+outputs are still on disk does not need to run again, so a resumed sweep
+only pays for what is missing or stale.
+
+Records are appended as JSON lines with a single write each, so several
+`batch_drift` workers can share one manifest file; the last record of a
+(drift, stage) pair wins.
+
+"""
+from __future__ import print_function, division
+
+import os
+import json
+import time
+
+from .cache import file_digest
+
+
+def _file_record(filename, digest=True):
+    st = os.stat(filename)
+    rec = {'size': st.st_size, 'mtime': st.st_mtime}
+    if digest:
+        rec['sha1'] = file_digest(filename)
+    return rec
+
+
+class Manifest(object):
+    """
+    Append-only manifest of drift stage inputs and outputs.
+
+    Parameters
+    ----------
+    filename: str
+        Manifest file (JSON lines). Created on the first record.
+    verify: {'stat', 'hash'}, optional
+        How outputs are checked. 'stat' compares size and mtime; 'hash'
+        also re-hashes the file content.
+    digest: boolean, optional
+        Store the SHA-1 digest of outputs. Implied by verify='hash'.
+
+    """
+    def __init__(self, filename, verify='stat', digest=False):
+        self.filename = os.path.abspath(filename)
+        self.verify = verify
+        self.digest = digest or verify == 'hash'
+        self._records = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_records'] = None
+        return state
+
+    def load(self):
+        """
+        (Re)read the manifest file.
+
+        """
+        records = {}
+        if os.path.exists(self.filename):
+            with open(self.filename) as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        # Partial line of an interrupted write.
+                        continue
+                    records[(rec['name'], rec['stage'])] = rec
+        self._records = records
+        return records
+
+    @property
+    def records(self):
+        if self._records is None:
+            self.load()
+        return self._records
+
+    def record(self, name, stage, key, outputs):
+        """
+        Record that a stage of a drift wrote `outputs` from inputs `key`.
+
+        """
+        rec = {'name': name, 'stage': stage, 'key': key,
+               'time': time.time(),
+               'outputs': dict((f, _file_record(f, self.digest))
+                               for f in outputs if f is not None)}
+        line = (json.dumps(rec, sort_keys=True) + '\n').encode('utf-8')
+        fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                     0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+        self.records[(name, stage)] = rec
+
+    def valid(self, name, stage, key):
+        """
+        True if the stage of a drift was recorded with the same input key
+        and all of its outputs are unchanged on disk.
+
+        """
+        rec = self.records.get((name, stage))
+        if rec is None or rec['key'] != key:
+            return False
+        for filename, out in rec['outputs'].items():
+            try:
+                now = _file_record(filename, digest=False)
+            except OSError:
+                return False
+            if self.verify == 'hash':
+                if file_digest(filename, memo=False) != out.get('sha1'):
+                    return False
+            elif now['size'] != out['size'] or now['mtime'] != out['mtime']:
+                return False
+        return True
@@ -3,11 +3,16 @@ Python wrapper for the MIT Array Performance Simulator (MAPS)
 
 """
 from __future__ import print_function, division
-from subprocess import Popen, PIPE, call, STDOUT
+import os
+from subprocess import Popen, PIPE, STDOUT
 
 from . import settings as s
 
 
+_CHUNK = 2 ** 16
+_TAIL = 2 ** 16
+
+
 # TODO: Get rid off all exception classes.
 class _Error(Exception):
     """
@@ -39,13 +44,98 @@ class _VisgenError(_Error):
             .format(self.errfile, self.err)
 
 
-def _save_string(filename, string):
-    with open(filename, 'w') as f:
-        f.write(string)
+def _wait(run, usage=None):
+    """
+    Wait for a child with `os.wait4` and return its exit code. The resource
+    usage of the child is appended to the list `usage` if given; its
+    ru_maxrss is the peak RSS of the child (or of the largest of the
+    processes it waited for, e.g. the ranks of mpirun).
+
+    """
+    _, status, rusage = os.wait4(run.pid, 0)
+    run.returncode = os.waitstatus_to_exitcode(status)
+    if usage is not None:
+        usage.append(rusage)
+    return run.returncode
+
+
+def _call(cmd, usage=None, **kwargs):
+    """
+    `subprocess.call` that records the resource usage of the child, see
+    `_wait`.
+
+    """
+    run = Popen(cmd, **kwargs)
+    try:
+        return _wait(run, usage)
+    except BaseException:
+        run.kill()
+        run.wait()
+        raise
+
+
+def _run_logged(cmd, logfile, usage=None):
+    """
+    Run a command with its stdout and stderr written straight to logfile
+    while it runs. The log is removed if the command printed nothing.
+
+    """
+    with open(logfile, 'wb') as f:
+        returncode = _call(cmd, usage, stdout=f, stderr=STDOUT)
+    if os.path.getsize(logfile) == 0:
+        os.remove(logfile)
+    return returncode
+
+
+def _run_stderr_tail(cmd, logfile, errfile, usage=None):
+    """
+    Run a command with its stdout written straight to logfile and its
+    stderr copied to errfile as it arrives. errfile is only created if
+    there is any stderr. See `_wait` for `usage`.
+
+    Return
+    ------
+    out: str
+        The last `_TAIL` bytes of stderr, decoded.
+
+    """
+    tail = b''
+    err = None
+    with open(logfile, 'wb') as out:
+        run = Popen(cmd, stdout=out, stderr=PIPE)
+        try:
+            fd = run.stderr.fileno()
+            while True:
+                chunk = os.read(fd, _CHUNK)
+                if not chunk:
+                    break
+                if err is None:
+                    err = open(errfile, 'wb')
+                err.write(chunk)
+                tail = (tail + chunk)[-_TAIL:]
+            _wait(run, usage)
+        except BaseException:
+            run.kill()
+            run.wait()
+            raise
+        finally:
+            run.stderr.close()
+            if err is not None:
+                err.close()
+    return tail.decode('utf-8', 'replace')
+
+
+def _im2uv_cmd(fitsfile, vis, normalizer=None, padzeropixels=None):
+    cmd = ['maps_im2uv', '-i', fitsfile, '-o', vis]
+    if normalizer is not None:
+        cmd += ['-n', str(normalizer)]
+    if padzeropixels is not None:
+        cmd += ['-p', str(padzeropixels)]
+    return cmd
 
 
 def im2uv(fitsfile, vis=None, normalizer=None, padzeropixels=None,
-          verbose=True):
+          verbose=True, usage=None):
     """
     Convert a FITS image into a visibility grid format appropriated for
     visgen input via MAPS_im2uv.
@@ -68,50 +158,51 @@ def im2uv(fitsfile, vis=None, normalizer=None, padzeropixels=None,
         No log file will be save.
         If False, no terminal dump. All stdout and stderr is save to a file
         named (vis - '.dat') + .im2uvlog
+    usage: list, optional
+        The resource usage of maps_im2uv (from `os.wait4`) is appended to
+        this list.
 
     """
     if vis is None:
         vis = fitsfile.rsplit('/', 1)[-1][0:-5] + '.dat'
-    cmd = ['maps_im2uv', '-i', fitsfile, '-o', vis]
-    if normalizer is not None:
-        cmd += ['-n', str(normalizer)]
-    if padzeropixels is not None:
-        cmd += ['-p', str(padzeropixels)]
+    cmd = _im2uv_cmd(fitsfile, vis, normalizer, padzeropixels)
     if verbose:
-        call(cmd)
+        _call(cmd, usage)
     else:
-        run = Popen(cmd, stdout=PIPE, stderr=STDOUT)
-        stdout = run.communicate()[0]
-        if stdout != '':
-            logfile = vis.rsplit('/', 1)[-1][0:-4] + '.im2uvlog'
-            _save_string(logfile, stdout)
-
+        _run_logged(cmd, vis.rsplit('/', 1)[-1][0:-4] + '.im2uvlog', usage)
 
-def maps2uvfits(vis, uvfits=None, site='MWA_128', arrayloc=None, arrayconf=None,
-                verbose=True):
-    """
-    Convert visgen visibility grid to AIPS uvfits via maps2uvfits
 
-    """
+def _maps2uvfits_cmd(vis, uvfits=None, site='MWA_128', arrayloc=None,
+                     arrayconf=None):
     if arrayconf is None:
         arrayconf = s.MAPS.ARRAY_CONFIG[site.lower()]
     if arrayloc is None:
         arrayloc = s.MAPS.ARRAY_LOC[site.lower()]
     if uvfits is None:
         uvfits = vis.rsplit('/', 1)[-1][0:-4] + '.uvfits'
-    cmd = ['maps2uvfits', vis, uvfits, arrayloc[0], arrayloc[1], arrayloc[2],
-           arrayconf]
+    return ['maps2uvfits', vis, uvfits, arrayloc[0], arrayloc[1], arrayloc[2],
+            arrayconf]
+
+
+def maps2uvfits(vis, uvfits=None, site='MWA_128', arrayloc=None, arrayconf=None,
+                verbose=True, usage=None):
+    """
+    Convert visgen visibility grid to AIPS uvfits via maps2uvfits
+
+    The resource usage of maps2uvfits is appended to the list `usage` if
+    given.
+
+    """
+    cmd = _maps2uvfits_cmd(vis, uvfits, site, arrayloc, arrayconf)
     if verbose:
-        call(cmd)
+        _call(cmd, usage)
     else:
-        run = Popen(cmd, stdout=PIPE, stderr=STDOUT)
-        stdout, stderr = run.communicate()
-        if stdout != '':
-            logfile = vis.rsplit('/', 1)[-1][0:-4] + '.maps2uvfitslog'
-            _save_string(logfile, stdout)
+        _run_logged(cmd, vis.rsplit('/', 1)[-1][0:-4] + '.maps2uvfitslog',
+                    usage)
 
 
-def visgen(prefix, spec, oobs=None, uvgrid=None, site='MWA_128', mpi=1):
+def visgen(prefix, spec, oobs=None, uvgrid=None, site='MWA_128', mpi=1,
+           log_prefix=None, usage=None):
     """
     Wrapper of visgen.
 
@@ -127,8 +218,26 @@ def visgen(prefix, spec, oobs=None, uvgrid=None, site='MWA_128', mpi=1):
         name and path of the input uvgrid (dat file) produced by im2uv.
     mpi: integer, optional
         if > 1, will execute visgen with mpirun with number of processes = mpi.
+    log_prefix: string, optional
+        prefix of the .vislog and .viserr files, if they should not go next
+        to the output, e.g. when prefix is in scratch space. prefix if None.
+    usage: list, optional
+        The resource usage of visgen (of mpirun if mpi > 1, from
+        `os.wait4`) is appended to this list.
 
     """
+    if log_prefix is None:
+        log_prefix = prefix
+    cmd = _visgen_cmd(prefix, spec, oobs, uvgrid, site, mpi)
+    # Output is streamed to the log files while visgen runs; only the tail
+    # of stderr is kept in memory for the error message.
+    stderr = _run_stderr_tail(cmd, log_prefix + '.vislog',
+                              log_prefix + '.viserr', usage)
+    if stderr != '':
+        raise _VisgenError(stderr, log_prefix + '.viserr')
+
+
+def _visgen_cmd(prefix, spec, oobs=None, uvgrid=None, site='MWA_128', mpi=1):
     arrayconf = s.MAPS.ARRAY_CONFIG[site.lower()]
     case = {'oobs_only': oobs is not None and uvgrid is None,
             'uvgrid_only': oobs is None and uvgrid is not None,
@@ -147,9 +256,4 @@ def visgen(prefix, spec, oobs=None, uvgrid=None, site='MWA_128', mpi=1):
                           foreground input')
     if mpi > 1:
         cmd = ['mpirun', '-n', str(mpi)] + cmd
-    run = Popen(cmd, stdout=PIPE, stderr=PIPE)
-    stdout, stderr = run.communicate()
-    _save_string(prefix + '.vislog', stdout)
-    if stderr != '':
-        _save_string(prefix + '.viserr', stderr)
-        raise _VisgenError(stderr, prefix + '.viserr')
+    return cmd
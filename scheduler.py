@@ -0,0 +1,265 @@
+"""
+Schedulers for batches of drift scan simulations.
+
+`Pipeline` runs drifts stage-pipelined; `CoreScheduler` shares a core budget
+between concurrent drifts and the MPI ranks of their visgen runs.
+
+"""
+from __future__ import print_function, division
+
+import time
+import threading
+import multiprocessing
+from functools import partial
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+def _im2uv(drift):
+    if drift.sky_img is not None:
+        drift.im2uv()
+    return drift
+
+
+def _write_spec(drift):
+    drift.write_spec()
+    return drift
+
+
+def _visgen(drift):
+    drift.visgen()
+    drift.remove_vis_in()
+    return drift
+
+
+def _maps2uvfits(drift):
+    drift.maps2uvfits()
+    drift.write_spec()
+    drift.write_log()
+    drift.clean_scratch()
+    return drift
+
+
+STAGES = (('im2uv', _im2uv),
+          ('write_spec', _write_spec),
+          ('visgen', _visgen),
+          ('maps2uvfits', _maps2uvfits))
+
+DEFAULT_NPROCS = {'im2uv': 2, 'write_spec': 1, 'visgen': 4, 'maps2uvfits': 2}
+
+
+class Pipeline(object):
+    """
+    Run drifts through per-stage worker pools.
+
+    `Drift.run` is split into its stages (im2uv, write_spec, visgen and
+    maps2uvfits). Each stage has its own worker pool and queue, and a drift
+    is handed to the next stage as soon as it leaves the previous one, so a
+    CPU-heavy visgen of one drift overlaps with the I/O-bound maps2uvfits of
+    another and a slow drift only holds a worker of the stage it is in.
+
+    Parameters
+    ----------
+    nprocs: dict, optional
+        Number of workers per stage, keyed by stage name. Missing stages
+        use `DEFAULT_NPROCS`.
+    processes: boolean, optional
+        If False (default), stage workers are threads. The stages spend
+        their time waiting on the MAPS programs, so threads are enough and
+        drifts need not be pickled between stages. If True, use process
+        pools, e.g. for stages that compute in-process.
+
+    """
+    def __init__(self, nprocs=None, processes=False):
+        self.nprocs = dict(DEFAULT_NPROCS)
+        if nprocs is not None:
+            self.nprocs.update(nprocs)
+        self.processes = processes
+        self.stages = STAGES
+
+    def _pool(self, n):
+        if self.processes:
+            return multiprocessing.Pool(n)
+        return ThreadPool(n)
+
+    def run(self, instance):
+        """
+        Run all drifts through the pipeline.
+
+        Return
+        ------
+        out: list
+            The finished drifts, in input order. With process pools these
+            are the copies returned by the workers.
+
+        Raises the first error of any drift after all other drifts have
+        finished.
+
+        """
+        instance = list(instance)
+        pools = [self._pool(self.nprocs[name]) for name, _ in self.stages]
+        done = queue.Queue()
+
+        def submit(i, k, drift):
+            if k == len(self.stages):
+                done.put((i, drift, None))
+                return
+            pools[k].apply_async(self.stages[k][1], (drift,),
+                                 callback=partial(submit, i, k + 1),
+                                 error_callback=partial(fail, i))
+
+        def fail(i, err):
+            instance[i].clean_scratch()
+            done.put((i, None, err))
+
+        try:
+            for i, drift in enumerate(instance):
+                submit(i, 0, drift)
+            results = [None] * len(instance)
+            errors = []
+            for _ in range(len(instance)):
+                i, drift, err = done.get()
+                if err is not None:
+                    errors.append(err)
+                else:
+                    results[i] = drift
+        finally:
+            for pool in pools:
+                pool.close()
+            for pool in pools:
+                pool.join()
+        if errors:
+            raise errors[0]
+        return results
+
+
+def pipeline_drift(instance, nprocs=None, processes=False):
+    """
+    Run drifts stage-pipelined. See `Pipeline`.
+
+    """
+    return Pipeline(nprocs, processes=processes).run(instance)
+
+
+class CoreScheduler(object):
+    """
+    Run drifts under a total core budget, choosing MPI ranks per job.
+
+    Whenever cores are free, the next drift is started with
+    ``ranks = free // pending`` MPI ranks for visgen, clipped to
+    [min_mpi, max_mpi]. While many drifts are pending this runs as many
+    single-rank drifts as there are cores; towards the end of a batch the
+    remaining drifts get the idle cores as extra ranks. Cores are backfilled
+    as soon as a drift finishes. A drift holds its cores for its whole run.
+
+    With a cost model, drifts are started longest first and, with a memory
+    budget, a drift also waits until its predicted memory fits beside the
+    running drifts (it is started anyway when nothing else runs).
+
+    Parameters
+    ----------
+    cores: int
+        Total number of cores to use.
+    max_mpi: int, optional
+        Maximum number of MPI ranks per visgen. Default is `cores`.
+    min_mpi: int, optional
+        Minimum number of MPI ranks per visgen.
+    memory: float, optional
+        Memory budget of the concurrent drifts [byte]. Requires `model`.
+    model: `cost.CostModel`, optional
+        Cost model ordering the drifts and predicting their memory.
+
+    """
+    def __init__(self, cores, max_mpi=None, min_mpi=1, memory=None,
+                 model=None):
+        if memory is not None and model is None:
+            raise ValueError('a memory budget requires a cost model')
+        self.cores = cores
+        self.max_mpi = cores if max_mpi is None else min(max_mpi, cores)
+        self.min_mpi = min(min_mpi, self.max_mpi)
+        self.memory = memory
+        self.model = model
+
+    def ranks(self, free, pending):
+        """
+        Number of MPI ranks for the next drift, or 0 if it has to wait.
+
+        """
+        ranks = max(self.min_mpi, min(self.max_mpi, free // max(pending, 1)))
+        return ranks if ranks <= free else 0
+
+    def run(self, instance):
+        """
+        Run all drifts.
+
+        Return
+        ------
+        out: dict
+            Sweep report with the wall time, the core-seconds used, the
+            achieved core utilisation and (name, ranks, seconds) per drift.
+
+        Raises the first error of any drift after all other drifts have
+        finished.
+
+        """
+        if self.model is not None:
+            from .cost import lpt_order
+            instance = lpt_order(list(instance), self.model)
+            need = dict((id(d), self.model.predict(d)['memory'])
+                        for d in instance)
+        pending = deque(instance)
+        cond = threading.Condition()
+        state = {'free': self.cores, 'running': 0, 'memory': 0.0}
+        jobs = []
+        errors = []
+
+        def work(drift, ranks):
+            start = time.time()
+            try:
+                drift.run(mpi=ranks)
+            except Exception as e:
+                errors.append(e)
+            elapsed = time.time() - start
+            with cond:
+                jobs.append((drift.name, ranks, elapsed))
+                state['free'] += ranks
+                state['running'] -= 1
+                if self.model is not None:
+                    state['memory'] -= need[id(drift)]
+                cond.notify()
+
+        start = time.time()
+        with cond:
+            while pending or state['running']:
+                ranks = self.ranks(state['free'], len(pending)) \
+                    if pending else 0
+                if ranks and self.memory is not None and state['running'] \
+                        and state['memory'] + need[id(pending[0])] > \
+                        self.memory:
+                    ranks = 0
+                if ranks == 0:
+                    cond.wait()
+                    continue
+                drift = pending.popleft()
+                state['free'] -= ranks
+                state['running'] += 1
+                if self.model is not None:
+                    state['memory'] += need[id(drift)]
+                t = threading.Thread(target=work, args=(drift, ranks))
+                t.daemon = True
+                t.start()
+        wall = time.time() - start
+        core_seconds = sum(ranks * elapsed for _, ranks, elapsed in jobs)
+        report = {'cores': self.cores, 'wall': wall,
+                  'core_seconds': core_seconds,
+                  'utilisation': core_seconds / (self.cores * wall)
+                  if wall > 0 else 0.0,
+                  'jobs': jobs}
+        if errors:
+            raise errors[0]
+        return report
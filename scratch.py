@@ -0,0 +1,218 @@
+"""
+Scratch space for the intermediate files of a drift.
+
+The uv-grid written by im2uv and the visibilities written by visgen are
+only needed until maps2uvfits has run. `Scratch` places them on a fast
+local filesystem (/dev/shm by default) instead of the output directory,
+and spills them to a disk directory once the scratch space holds more than
+a byte budget, so a sweep cannot fill up the RAM disk. Only the final
+products (.uvfits, logs and spec files) go to the output directory.
+
+"""
+from __future__ import print_function, division
+
+import os
+import uuid
+import errno
+import shutil
+import tempfile
+import threading
+
+
+_PREFIX = 'pwmaps-scratch-'
+
+# Directory name per (scratch token, process id), shared by every copy of a
+# scratch object in a process.
+_NAMES = {}
+_NAMES_LOCK = threading.Lock()
+
+
+def _makedirs(d):
+    try:
+        os.makedirs(d)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def default_root():
+    """
+    /dev/shm if it is writable, otherwise the system temporary directory.
+
+    """
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+class Scratch(object):
+    """
+    Placement of intermediate files on scratch space with a byte budget.
+
+    Each instance keeps its files in its own subdirectories of the scratch
+    root (and of the spill directory), so concurrent sweeps never see each
+    other's files even if their drifts have the same names. There is one
+    subdirectory per process using the instance, created on first use and
+    shared by all copies of the instance in that process (e.g. the drift
+    copies of each retry in a `batch_drift` worker). `close` removes the
+    subdirectories of all processes.
+
+    The budget is shared by every instance using the same scratch root, as
+    usage is measured from the files present in all their subdirectories
+    when a path is allocated. It is a soft limit: drifts allocating at the
+    same time may overshoot it by their estimated sizes.
+
+    Parameters
+    ----------
+    root: str, optional
+        Fast local directory, e.g. '/dev/shm' or a local SSD mount.
+        `default_root()` if None.
+    budget: int, optional
+        Maximum number of bytes kept in scratch space. Without a budget,
+        files only spill when the filesystem has no room for them.
+    spill: str, optional
+        Directory receiving intermediates that do not fit. The current
+        working directory at allocation time if None.
+
+    """
+    def __init__(self, root=None, budget=None, spill=None):
+        if root is None:
+            root = default_root()
+        self.base = os.path.abspath(root)
+        self.budget = budget
+        self.spill = spill
+        self._token = uuid.uuid4().hex[:12]
+
+    def __repr__(self):
+        return 'Scratch({0!r}, budget={1!r}, spill={2!r})'\
+            .format(self.base, self.budget, self.spill)
+
+    def _prefix(self):
+        return '{0}{1}-'.format(_PREFIX, self._token)
+
+    def _spill_dir(self):
+        return os.path.abspath(self.spill or os.getcwd())
+
+    @property
+    def root(self):
+        """
+        Directory of this instance in scratch space, for this process.
+
+        """
+        key = (self._token, os.getpid())
+        with _NAMES_LOCK:
+            if key not in _NAMES:
+                _makedirs(self.base)
+                _NAMES[key] = os.path.basename(tempfile.mkdtemp(
+                    prefix='{0}{1:d}-'.format(self._prefix(), key[1]),
+                    dir=self.base))
+            return os.path.join(self.base, _NAMES[key])
+
+    def _dirs(self):
+        root = self.root
+        return (root, os.path.join(self._spill_dir(),
+                                   os.path.basename(root)))
+
+    def usage(self):
+        """
+        Bytes currently held in scratch space by all instances.
+
+        """
+        total = 0
+        for d in os.listdir(self.base):
+            if not d.startswith(_PREFIX):
+                continue
+            try:
+                names = os.listdir(os.path.join(self.base, d))
+            except OSError:
+                continue
+            for name in names:
+                try:
+                    total += os.path.getsize(os.path.join(self.base, d, name))
+                except OSError:
+                    pass
+        return total
+
+    def free(self):
+        """
+        Bytes available on the scratch filesystem.
+
+        """
+        st = os.statvfs(self.base)
+        return st.f_bavail * st.f_frsize
+
+    def path(self, name, nbytes=0):
+        """
+        Path of an intermediate file.
+
+        An existing file of this name of this instance, in scratch space or
+        spilled, is reused. Otherwise the file goes to scratch space if
+        `nbytes` more fit in the budget and on the filesystem, and to the
+        spill directory if not.
+
+        Parameters
+        ----------
+        name: str
+            File name, without directory.
+        nbytes: int, optional
+            Estimated size of the file.
+
+        """
+        root, spill = self._dirs()
+        for d in (root, spill):
+            p = os.path.join(d, name)
+            if os.path.exists(p):
+                return p
+        if nbytes < self.free() and (self.budget is None or
+                                     self.usage() + nbytes <= self.budget):
+            d = root
+        else:
+            d = spill
+        # The directory may have been created on another host (work queue).
+        _makedirs(d)
+        return os.path.join(d, name)
+
+    def remove(self, name):
+        """
+        Remove an intermediate file from scratch space and the spill
+        directory.
+
+        Return
+        ------
+        out: list of str
+            Removed paths.
+
+        """
+        removed = []
+        if (self._token, os.getpid()) not in _NAMES:
+            return removed
+        for d in self._dirs():
+            p = os.path.join(d, name)
+            try:
+                os.remove(p)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            else:
+                removed.append(p)
+        return removed
+
+    def close(self):
+        """
+        Remove the directories of this instance, made by any process, with
+        everything left in them. A later `path` starts new ones.
+
+        """
+        prefix = self._prefix()
+        for parent in (self.base, self._spill_dir()):
+            try:
+                names = os.listdir(parent)
+            except OSError:
+                continue
+            for name in names:
+                if name.startswith(prefix):
+                    shutil.rmtree(os.path.join(parent, name),
+                                  ignore_errors=True)
+        with _NAMES_LOCK:
+            for key in [k for k in _NAMES if k[0] == self._token]:
+                del _NAMES[key]
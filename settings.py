@@ -12,23 +12,18 @@ import numpy as np
 H21CM = 1420.40575177
 
 
-class MAPS(object):
+class _MAPSConfig(object):
     """
     MAPS configurations.
 
+    Paths are resolved lazily on first access: the root directory is taken
+    from the 'SIM' environment variable, or the current directory if it is
+    not set. Use `set_root_dir` or `configure` to override them.
+
     """
-    try:
-        ROOT_DIR = os.environ['SIM']
-    except KeyError:
-        print("'SIM' environment variable is not in your path.\nMAPS_DIR is "
-              "temporary set to {:s}. You can set this path manually by "
-              "calling `set_MPAS_DIR()` (not implemented yet)"
-              .format(os.getcwd()))
-        ROOT_DIR = os.getcwd()
-    ARRAY_DIR = ROOT_DIR + '/array'
-    ARRAY_CONFIG = {
-        'mwa_128': ARRAY_DIR + '/mwa_128_crossdipole_gp_20110225.txt',
-        'vla_d': ARRAY_DIR + '/VLA_D.txt'}
+    ARRAY_FILES = {
+        'mwa_128': 'mwa_128_crossdipole_gp_20110225.txt',
+        'vla_d': 'VLA_D.txt'}
     ARRAY_LOC = {
         'mwa_128': ('-26.7033', '116.671', '377.830'),
         'vla_d': ('34.025778', '252.3210278', '2125.3704')}
@@ -36,6 +31,73 @@ class MAPS(object):
         'mwa_128': -7.778066666666667,
         'vla_d': 16.821401853333334}
 
+    def __init__(self):
+        self._root_dir = None
+        self._array_dir = None
+        self._array_config = None
+
+    @property
+    def ROOT_DIR(self):
+        if self._root_dir is None:
+            try:
+                self._root_dir = os.environ['SIM']
+            except KeyError:
+                print("'SIM' environment variable is not in your path.\n"
+                      "MAPS_DIR is temporary set to {:s}. You can set this "
+                      "path manually by calling "
+                      "`settings.MAPS.set_root_dir()`".format(os.getcwd()))
+                self._root_dir = os.getcwd()
+        return self._root_dir
+
+    @property
+    def ARRAY_DIR(self):
+        if self._array_dir is None:
+            return self.ROOT_DIR + '/array'
+        return self._array_dir
+
+    @property
+    def ARRAY_CONFIG(self):
+        if self._array_config is None:
+            self._array_config = dict(
+                (k, self.ARRAY_DIR + '/' + v)
+                for k, v in self.ARRAY_FILES.items())
+        return self._array_config
+
+    def set_root_dir(self, path):
+        """
+        Set the MAPS root directory; array files are looked up in
+        (path + '/array').
+
+        """
+        self.configure(root_dir=path)
+
+    def configure(self, root_dir=None, array_dir=None, array_config=None):
+        """
+        Override the MAPS paths.
+
+        Parameters
+        ----------
+        root_dir: str, optional
+            MAPS root directory (instead of $SIM).
+        array_dir: str, optional
+            Directory of the array configuration files
+            (instead of root_dir + '/array').
+        array_config: dict, optional
+            Array configuration file per site, e.g.
+            {'mwa_128': '/path/to/layout.txt'}. Updates the defaults.
+
+        """
+        if root_dir is not None:
+            self._root_dir = root_dir
+        if array_dir is not None:
+            self._array_dir = array_dir
+        self._array_config = None
+        if array_config is not None:
+            self.ARRAY_CONFIG.update(array_config)
+
+
+MAPS = _MAPSConfig()
+
 
 class MWA(object):
     EOR0 = (0.0, -30.0)
@@ -0,0 +1,270 @@
+"""
+Chunked columnar visibility store for whole sweeps.
+
+Instead of one .uvfits file per drift, the visibilities of every drift of a
+sweep are appended to a single store directory::
+
+    root/index.jsonl        one JSON line per chunk
+    root/chunks/*.npz       compressed NPY columns of one chunk
+
+A chunk holds a run of time steps of one scan of one drift, baseline-major,
+with the columns u, v, w, baseline, time and vis of `visfile.record_dtype`
+each of shape (nbaseline, ntime[, nchan, npol]). Index lines carry the drift
+parameters (name, RA, HA, frequency) and the scan header, so a query only
+opens the chunks it needs, and only the columns it asks for.
+
+Experimental: chunks are read from .vis files with the unverified layout
+of `visfile`, so the store is not an output sink of `driftscan.Drift` or
+`batch_drift`; drifts always write .uvfits files through maps2uvfits.
+
+Chunks are written under unique names and renamed into place before their
+index lines are appended under an exclusive lock, so several processes
+can append to one store. Appending a drift name again supersedes its
+earlier chunks; `vacuum` removes the superseded files.
+
+"""
+from __future__ import print_function, division
+
+import os
+import json
+import time
+import uuid
+import errno
+import fcntl
+
+import numpy as np
+
+from .visfile import VisFile
+
+
+COLUMNS = ('u', 'v', 'w', 'baseline', 'time', 'vis')
+
+
+class VisStore(object):
+    """
+    Append-only store of drift visibilities.
+
+    Parameters
+    ----------
+    root: str
+        Store directory. Created if it does not exist.
+    compress: boolean, optional
+        Write zip-compressed chunks (`numpy.savez_compressed`).
+    chunk: int, optional
+        Target number of visibility records per chunk.
+
+    Examples
+    --------
+    >>> st = VisStore('sweep.store')
+    >>> st.append('drift.vis', 'drift', ra=0.0, ha=-1.0, freq=150.0)
+    >>> data = st.read(freq=(140., 160.), baseline=[257, 258],
+    ...                columns=('time', 'vis'))
+
+    """
+    def __init__(self, root, compress=True, chunk=2 ** 20):
+        self.root = os.path.abspath(root)
+        self.compress = compress
+        self.chunk = chunk
+        self.index_file = os.path.join(self.root, 'index.jsonl')
+        self.chunk_dir = os.path.join(self.root, 'chunks')
+        try:
+            os.makedirs(self.chunk_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def __repr__(self):
+        return 'VisStore({0!r})'.format(self.root)
+
+    def _write_chunk(self, filename, columns):
+        path = os.path.join(self.chunk_dir, filename)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            if self.compress:
+                np.savez_compressed(f, **columns)
+            else:
+                np.savez(f, **columns)
+        os.rename(tmp, path)
+
+    def _append_index(self, entries):
+        lines = ''.join(json.dumps(e, sort_keys=True) + '\n' for e in entries)
+        with open(self.index_file, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(lines)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def append(self, vis, name, ra, ha, freq):
+        """
+        Append the visibilities of a drift.
+
+        Parameters
+        ----------
+        vis: str
+            visgen .vis file of the drift.
+        name: str
+            Name of the drift. A later append of the same name supersedes
+            this one.
+        ra, ha: float
+            Target RA and HA of the drift [decimal hours].
+        freq: float
+            Centre frequency of the drift [MHz].
+
+        Return
+        ------
+        out: list of dict
+            Index entries of the new chunks.
+
+        """
+        vf = VisFile(vis)
+        append_id = uuid.uuid4().hex
+        entries = []
+        for scan in range(len(vf)):
+            header = vf.header(scan)
+            rec = vf.scan(scan)
+            ntime, nbl = rec.shape
+            step = max(1, self.chunk // max(nbl, 1))
+            for k, t0 in enumerate(range(0, ntime, step)):
+                block = rec[t0:t0 + step].T
+                filename = '{0}.{1}.{2:d}.{3:d}.npz'.format(name, append_id,
+                                                           scan, k)
+                self._write_chunk(filename, dict(
+                    (c, np.ascontiguousarray(block[c])) for c in COLUMNS))
+                entries.append({
+                    'name': name, 'ra': ra, 'ha': ha, 'freq': freq,
+                    'append': append_id, 'scan': scan, 'chunk': filename,
+                    'ntime': block.shape[1], 'nbaseline': nbl,
+                    'nchan': int(header['nchan']),
+                    'npol': int(header['npol']),
+                    'chan_bw': float(header['chan_bw']),
+                    'time': [float(block['time'][0, 0]),
+                             float(block['time'][0, -1])] if block.size
+                    else [None, None],
+                    'written': time.time()})
+        self._append_index(entries)
+        return entries
+
+    def index(self):
+        """
+        Current index entries, i.e. those of the last append of each drift.
+
+        """
+        entries = []
+        if os.path.exists(self.index_file):
+            with open(self.index_file) as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+        latest = {}
+        for e in entries:
+            latest[e['name']] = e['append']
+        return [e for e in entries if latest[e['name']] == e['append']]
+
+    def drifts(self):
+        """
+        Drift parameters of the store, one dict per drift.
+
+        """
+        out = {}
+        for e in self.index():
+            out.setdefault(e['name'], {'name': e['name'], 'ra': e['ra'],
+                                       'ha': e['ha'], 'freq': e['freq']})
+        return list(out.values())
+
+    def select(self, name=None, freq=None, ra=None, ha=None, time=None,
+               baseline=None, columns=COLUMNS):
+        """
+        Iterate over the chunks matching a query.
+
+        Parameters
+        ----------
+        name: str or list of str, optional
+            Drift names.
+        freq, ra, ha: (float, float), optional
+            Keep drifts with lo <= value <= hi.
+        time: (float, float), optional
+            Keep time stamps t with time[0] <= t < time[1].
+        baseline: int or list of int, optional
+            Keep these baseline numbers.
+        columns: tuple of str, optional
+            Columns to read.
+
+        Yield
+        -----
+        out: (dict, dict)
+            Index entry and {column: array} of shape
+            (nbaseline, ntime[, nchan, npol]) of each matching chunk.
+
+        """
+        names = None if name is None else set(np.atleast_1d(name).tolist())
+        ranges = [(k, r) for k, r in (('freq', freq), ('ra', ra), ('ha', ha))
+                  if r is not None]
+        for e in self.index():
+            if names is not None and e['name'] not in names:
+                continue
+            if any(not r[0] <= e[k] <= r[1] for k, r in ranges):
+                continue
+            if time is not None and e['time'][0] is not None and \
+                    (e['time'][1] < time[0] or e['time'][0] >= time[1]):
+                continue
+            with np.load(os.path.join(self.chunk_dir, e['chunk'])) as z:
+                rows = cols = slice(None)
+                if baseline is not None:
+                    bl = z['baseline'][:, 0]
+                    rows = np.flatnonzero(np.isin(bl,
+                                                  np.atleast_1d(baseline)))
+                if time is not None:
+                    t = z['time'][0]
+                    cols = slice(np.searchsorted(t, time[0]),
+                                 np.searchsorted(t, time[1]))
+                data = dict((c, z[c][rows][:, cols]) for c in columns)
+            yield e, data
+
+    def read(self, columns=COLUMNS, **query):
+        """
+        Concatenate the records matching a query (see `select`).
+
+        Return
+        ------
+        out: dict
+            Flat arrays of the requested columns, one element (or
+            (nchan, npol) row for vis) per record, plus the 'freq', 'ra' and
+            'ha' of the drift of each record.
+
+        """
+        parts = dict((c, []) for c in tuple(columns) + ('freq', 'ra', 'ha'))
+        for e, data in self.select(columns=columns, **query):
+            n = None
+            for c in columns:
+                a = data[c]
+                a = a.reshape((-1,) + a.shape[2:])
+                parts[c].append(a)
+                n = len(a)
+            for k in ('freq', 'ra', 'ha'):
+                parts[k].append(np.full(n or 0, e[k]))
+        return dict((c, np.concatenate(p) if p else np.empty(0))
+                    for c, p in parts.items())
+
+    def vacuum(self):
+        """
+        Remove chunk files not referenced by the current index, e.g. those
+        of superseded appends or interrupted writes. Do not run it while
+        drifts are appending.
+
+        Return
+        ------
+        out: list of str
+            Removed files.
+
+        """
+        keep = set(e['chunk'] for e in self.index())
+        removed = []
+        for f in os.listdir(self.chunk_dir):
+            if f not in keep:
+                os.remove(os.path.join(self.chunk_dir, f))
+                removed.append(f)
+        return removed
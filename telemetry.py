@@ -0,0 +1,208 @@
+"""
+Structured per-stage timing and resource telemetry.
+
+Each stage of a drift (im2uv, visgen, maps2uvfits) emits one event with its
+wall time, CPU time of the process and of its child processes, the peak RSS
+of the child processes (`resource.getrusage(RUSAGE_CHILDREN)`) and the
+bytes read from its input files and written to its output files. Events are
+appended to a JSON-lines file and can be aggregated into a sweep summary
+with `summarize`.
+
+Child CPU time and peak RSS are per process. With the thread-based
+schedulers and `aiomaps` several stages of one process run at the same time
+and their children are accounted together; run drifts in separate
+processes (e.g. `batch_drift` with nprocs) for exact per-stage figures.
+ru_maxrss is the peak over all children reaped so far, so it is an upper
+bound per stage. The peak RSS of the stage's own MAPS children, from their
+`os.wait4` resource usage, is recorded as child_rss whenever the stage ran
+one (see `StageTimer.children`); it is exact in every scheduler.
+
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import json
+import time
+import socket
+import resource
+
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+_RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+def _size(filenames):
+    total = 0
+    for f in filenames:
+        if f is not None and os.path.exists(f):
+            total += os.path.getsize(f)
+    return total
+
+
+class JSONLinesSink(object):
+    """
+    Append events to a JSON-lines file, one write per event, so several
+    worker processes can share it.
+
+    """
+    def __init__(self, filename):
+        self.filename = os.path.abspath(filename)
+
+    def __repr__(self):
+        return 'JSONLinesSink({0!r})'.format(self.filename)
+
+    def emit(self, event):
+        line = (json.dumps(event, sort_keys=True) + '\n').encode('utf-8')
+        fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                     0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def events(self):
+        """
+        Read back all events.
+
+        """
+        out = []
+        if os.path.exists(self.filename):
+            with open(self.filename) as f:
+                for line in f:
+                    try:
+                        out.append(json.loads(line))
+                    except ValueError:
+                        continue
+        return out
+
+
+class StageTimer(object):
+    """
+    Context manager measuring one stage and emitting its event.
+
+    Parameters
+    ----------
+    sink: `JSONLinesSink` or None
+        Where the event goes. Nothing is measured if None.
+    name: str
+        Name of the drift.
+    stage: str
+        Name of the stage.
+    inputs: list of str
+        Input files of the stage.
+    outputs: callable
+        Returns the output files of the stage once it has finished.
+    extra: dict, optional
+        Additional fields of the event, e.g. the cost features of the drift
+        (see `cost.features`).
+
+    Attributes
+    ----------
+    children: list
+        Resource usage of the child processes of the stage, appended by the
+        `pymaps` and `aiomaps` wrappers (their `usage` parameter).
+
+    """
+    def __init__(self, sink, name, stage, inputs=(), outputs=lambda: (),
+                 extra=None):
+        self.sink = sink
+        self.event = {'name': name, 'stage': stage}
+        if extra:
+            self.event.update(extra)
+        self.inputs = inputs
+        self.outputs = outputs
+        self.children = []
+
+    def __enter__(self):
+        if self.sink is None:
+            return self
+        self._wall = time.time()
+        self._self = resource.getrusage(resource.RUSAGE_SELF)
+        self._children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.sink is None:
+            return False
+        wall = time.time() - self._wall
+        ru_self = resource.getrusage(resource.RUSAGE_SELF)
+        ru_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self.event.update({
+            'start': self._wall,
+            'wall': wall,
+            'cpu': (ru_self.ru_utime + ru_self.ru_stime
+                    - self._self.ru_utime - self._self.ru_stime),
+            'child_cpu': (ru_children.ru_utime + ru_children.ru_stime
+                          - self._children.ru_utime
+                          - self._children.ru_stime),
+            'child_peak_rss': ru_children.ru_maxrss * _RSS_UNIT,
+            'peak_rss': ru_self.ru_maxrss * _RSS_UNIT,
+            'bytes_read': _size(self.inputs),
+            'bytes_written': _size(self.outputs()) if exc_type is None else 0,
+            'status': 'ok' if exc_type is None else exc_type.__name__,
+            'host': socket.gethostname(),
+            'pid': os.getpid()})
+        if self.children:
+            self.event['child_rss'] = max(
+                ru.ru_maxrss for ru in self.children) * _RSS_UNIT
+        self.sink.emit(self.event)
+        return False
+
+
+def summarize(events):
+    """
+    Aggregate stage events into a sweep summary.
+
+    Parameters
+    ----------
+    events: list of dict, str or `JSONLinesSink`
+        Events, or the JSON-lines file holding them.
+
+    Return
+    ------
+    out: dict
+        Per stage: number of events and failures, total/mean/max wall
+        time, total CPU and child CPU time, max child peak RSS and total
+        bytes read and written. 'limiting_stage' is the stage with the
+        largest total wall time.
+
+    """
+    if isinstance(events, str):
+        events = JSONLinesSink(events)
+    if isinstance(events, JSONLinesSink):
+        events = events.events()
+    stages = {}
+    for e in events:
+        st = stages.setdefault(e['stage'], {
+            'count': 0, 'failed': 0, 'wall': 0.0, 'max_wall': 0.0,
+            'cpu': 0.0, 'child_cpu': 0.0, 'child_peak_rss': 0,
+            'bytes_read': 0, 'bytes_written': 0})
+        st['count'] += 1
+        st['failed'] += e['status'] != 'ok'
+        st['wall'] += e['wall']
+        st['max_wall'] = max(st['max_wall'], e['wall'])
+        st['cpu'] += e['cpu']
+        st['child_cpu'] += e['child_cpu']
+        st['child_peak_rss'] = max(st['child_peak_rss'], e['child_peak_rss'])
+        st['bytes_read'] += e['bytes_read']
+        st['bytes_written'] += e['bytes_written']
+    for st in stages.values():
+        st['mean_wall'] = st['wall'] / st['count']
+    limiting = max(stages, key=lambda k: stages[k]['wall']) if stages \
+        else None
+    return {'stages': stages, 'limiting_stage': limiting}
+
+
+def print_summary(summary):
+    print('# {0:<12s} {1:>6s} {2:>10s} {3:>10s} {4:>10s} {5:>10s} {6:>12s}'
+          .format('stage', 'count', 'wall[s]', 'mean[s]', 'cpu[s]',
+                  'rss[MB]', 'written[MB]'))
+    for name, st in sorted(summary['stages'].items()):
+        print('# {0:<12s} {1:6d} {2:10.2f} {3:10.2f} {4:10.2f} {5:10.1f} '
+              '{6:12.1f}'.format(name, st['count'], st['wall'],
+                                 st['mean_wall'],
+                                 st['cpu'] + st['child_cpu'],
+                                 st['child_peak_rss'] / 2. ** 20,
+                                 st['bytes_written'] / 2. ** 20))
+    print('# limiting stage: {0}'.format(summary['limiting_stage']))
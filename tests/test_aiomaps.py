@@ -0,0 +1,51 @@
+"""
+`aiomaps.run_drift` with the stub MAPS binaries of `bench`.
+
+"""
+from __future__ import print_function, division
+
+import os
+import asyncio
+import threading
+
+from .. import aiomaps, bench
+from ..driftscan import Drift
+
+
+def _drifts(n, **kwargs):
+    open('sky.fits', 'w').close()
+    return [Drift(0.0, 0.01 * (i // 2), sky_img='sky.fits',
+                  name='d{0:d}'.format(i), **kwargs) for i in range(n)]
+
+
+def test_run_drift_with_caches_off_the_event_loop(monkeypatch):
+    threads = set()
+    stage_keys = Drift.stage_keys
+
+    def spy(self):
+        threads.add(threading.get_ident())
+        return stage_keys(self)
+
+    monkeypatch.setattr(Drift, 'stage_keys', spy)
+    with bench.stub_env(size=64):
+        drifts = _drifts(4, uvgrid_cache='uvgrid', result_cache='results',
+                         manifest='manifest.jsonl')
+        out = aiomaps.batch_drift(drifts, limit=4)
+        assert out == drifts
+        assert all(os.path.exists(d.uvfits) for d in drifts)
+        # Pairs of drifts share their stage keys.
+        assert len(drifts[0].result_cache.entries()) == 4
+        assert sorted(f for f in os.listdir('.') if f.endswith('.dat')) == []
+    assert threads and threading.get_ident() not in threads
+
+
+def test_timeout_releases_cache_entry():
+    with bench.stub_env(sleep=2.0):
+        drift = _drifts(1, uvgrid_cache='uvgrid')[0]
+        out = aiomaps.batch_drift([drift], timeout=0.2)
+        assert isinstance(out[0], asyncio.TimeoutError)
+        cache = drift.uvgrid_cache
+        assert [f for f in os.listdir(cache.root)
+                if not f.endswith('.lock')] == []
+        with cache._lock(drift._im2uv_key(), blocking=False) as locked:
+            assert locked
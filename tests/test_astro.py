@@ -0,0 +1,119 @@
+"""
+Parity of the vectorized `astro` conversions with the scalar ones they
+replaced and with astropy.
+
+"""
+from __future__ import print_function, division
+
+import datetime
+
+import numpy as np
+import astropy.units as u
+
+from .. import astro
+
+HOURS = [0.0, 1e-9, 0.5, 1.2345678, 12.0, 23.99999, 23.9999999, 24.0,
+         25.5, 47.25, -0.25, -1.2345678, -12.0, -23.5]
+DEGREES = [0.0, 1e-9, 0.5, 1.2345678, -0.5, -26.7033, 45.999999999,
+           89.9999, -89.9999, 116.671, 359.5, -180.0]
+FREQS = [50.0, 140.0, 181.92, 300.0]
+
+
+# Scalar implementations of the conversions before vectorization.
+
+def _h2hms24(h):
+    hm, seconds = divmod((h % 24) * 3600, 60)
+    hours, minutes = divmod(hm, 60)
+    return '{:02.0f}:{:02.0f}:{:02.3f}'.format(hours, minutes, seconds)
+
+
+def _h2hms_signed(h):
+    inverse = ''
+    if h < 0:
+        inverse = '-'
+    hms = str(datetime.timedelta(hours=abs(h))).rsplit(', ')[-1]
+    return inverse + hms
+
+
+def _d2dms(d, delimiter=':', precision=6):
+    inverse = ''
+    if d < 0:
+        inverse = '-'
+    minutes, seconds = divmod(abs(d) * 3600, 60)
+    degrees, minutes = divmod(minutes, 60)
+    return '{0:s}{1:.0f}{4}{2:02.0f}{4}{3:0{5:d}.{6:d}f}'\
+        .format(inverse, degrees, minutes, seconds, delimiter, 3 + precision,
+                precision)
+
+
+def _lst2gha(lst, site_long=116.670456):
+    gha = lst/15. - site_long/15.
+    if gha > 24.0:
+        gha -= 24.0
+    elif gha < 0.0:
+        gha += 24.0
+    return gha
+
+
+def test_h2hms24():
+    assert [astro.h2hms24(h) for h in HOURS] == [_h2hms24(h) for h in HOURS]
+    assert astro.h2hms24(HOURS).tolist() == [_h2hms24(h) for h in HOURS]
+
+
+def test_h2hms_signed():
+    hours = [h for h in HOURS if abs(h) < 24]
+    assert [astro.h2hms_signed(h) for h in hours] == \
+        [_h2hms_signed(h) for h in hours]
+    assert astro.h2hms_signed(hours).tolist() == \
+        [_h2hms_signed(h) for h in hours]
+
+
+def test_d2dms():
+    for delimiter, precision in ((':', 6), (' ', 2), ('%', 0)):
+        expected = [_d2dms(d, delimiter, precision) for d in DEGREES]
+        assert [astro.d2dms(d, delimiter, precision)
+                for d in DEGREES] == expected
+        assert astro.d2dms(DEGREES, delimiter, precision).tolist() == \
+            expected
+
+
+def test_lst2gha():
+    lsts = [0.0, 15.0, 116.670456, 200.0, 359.9, 400.0, -30.0]
+    for site_long in (116.670456, -107.6184, 0.0):
+        expected = [_lst2gha(lst, site_long) for lst in lsts]
+        assert [astro.lst2gha(lst, site_long) for lst in lsts] == expected
+        assert astro.lst2gha(lsts, site_long).tolist() == expected
+
+
+def test_jy_per_k():
+    for freq in FREQS:
+        equiv = u.brightness_temperature(freq * u.MHz, beam_area=1 * u.sr)
+        expected = (1 * u.K).to(u.Jy, equivalencies=equiv).value
+        assert np.isclose(astro.jy_per_k(freq), expected, rtol=1e-12)
+    assert np.allclose(astro.jy_per_k(FREQS),
+                       [astro.jy_per_k(f) for f in FREQS], rtol=1e-15)
+
+
+def test_brightness_conversions():
+    data = np.linspace(-1., 3., 12).reshape(len(FREQS), 3)
+    beam = 0.5
+    beam_sr = astro.beam_area(beam) * u.deg ** 2
+    for i, freq in enumerate(FREQS):
+        sr = u.brightness_temperature(freq * u.MHz, beam_area=1 * u.sr)
+        bm = u.brightness_temperature(freq * u.MHz, beam_area=beam_sr)
+        assert np.allclose(astro.jysr2k(data[i], freq),
+                           (data[i] * u.Jy).to(u.K, equivalencies=sr).value,
+                           rtol=1e-12)
+        assert np.allclose(astro.k2jysr(data[i], freq),
+                           (data[i] * u.K).to(u.Jy, equivalencies=sr).value,
+                           rtol=1e-12)
+        assert np.allclose(astro.jybeam2k(data[i], freq, beam),
+                           (data[i] * u.Jy).to(u.K, equivalencies=bm).value,
+                           rtol=1e-12)
+        assert np.allclose(astro.k2jybeam(data[i], freq, beam),
+                           (data[i] * u.K).to(u.Jy, equivalencies=bm).value,
+                           rtol=1e-12)
+    # A whole cube in one pass, frequency along axis 0.
+    cube = astro.jysr2k(data, FREQS)
+    assert np.allclose(cube, [astro.jysr2k(data[i], f)
+                              for i, f in enumerate(FREQS)], rtol=1e-15)
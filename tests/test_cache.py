@@ -0,0 +1,162 @@
+"""
+`cache.FileCache`.
+
+"""
+from __future__ import print_function, division
+
+import os
+import time
+import multiprocessing
+
+import pytest
+
+from .. import bench
+from ..cache import FileCache
+from ..driftscan import Drift
+
+
+def _writer(data):
+    def produce(path):
+        with open(path, 'wb') as f:
+            f.write(data)
+    return produce
+
+
+def _slow_writer(log):
+    def produce(path):
+        with open(log, 'a') as f:
+            f.write('x')
+        time.sleep(0.2)
+        with open(path, 'wb') as f:
+            f.write(b'x' * 10)
+    return produce
+
+
+def _fetch(root, log, outfile):
+    FileCache(root).fetch('k', '.dat', outfile, _slow_writer(log))
+
+
+def test_concurrent_fetch_produces_once(tmp_path):
+    ctx = multiprocessing.get_context('fork')
+    root = str(tmp_path / 'cache')
+    log = str(tmp_path / 'produced')
+    procs = [ctx.Process(target=_fetch,
+                         args=(root, log, str(tmp_path / str(i))))
+             for i in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+    with open(log) as f:
+        assert f.read() == 'x'
+    for i in range(4):
+        assert os.path.getsize(str(tmp_path / str(i))) == 10
+
+
+def test_failed_produce_leaves_no_entry(tmp_path):
+    cache = FileCache(str(tmp_path / 'cache'))
+
+    def fail(path):
+        with open(path, 'wb') as f:
+            f.write(b'partial')
+        raise RuntimeError('produce failed')
+
+    with pytest.raises(RuntimeError):
+        cache.fetch('k', '.dat', str(tmp_path / 'out'), fail)
+    assert cache.lookup('k', '.dat') is None
+    assert cache.entries() == []
+    _, hit = cache.fetch('k', '.dat', str(tmp_path / 'out'), _writer(b'x'))
+    assert not hit
+
+
+def test_evict_to_budget_keeping_new_entry(tmp_path):
+    cache = FileCache(str(tmp_path / 'cache'), max_bytes=25)
+    for key in ('a', 'b', 'c'):
+        cache.fetch(key, '.dat', None, _writer(b'x' * 10), link=False)
+        time.sleep(0.01)
+    assert cache.lookup('a', '.dat') is None
+    assert cache.size() == 20
+    # An entry larger than the budget is kept while it is the newest.
+    cache.fetch('d', '.dat', None, _writer(b'x' * 30), link=False)
+    assert [os.path.basename(e[2]) for e in cache.entries()] == ['d.dat']
+
+
+def test_evict_skips_locked_entries(tmp_path):
+    cache = FileCache(str(tmp_path / 'cache'))
+    for key in ('a', 'b'):
+        cache.fetch(key, '.dat', None, _writer(b'x' * 10), link=False)
+        time.sleep(0.01)
+    cache.max_bytes = 0
+    with cache._lock('a'):
+        cache.evict()
+    assert cache.lookup('a', '.dat') is not None
+    assert cache.lookup('b', '.dat') is None
+
+
+def test_hit_keeps_metadata_of_handed_out_files(tmp_path):
+    cache = FileCache(str(tmp_path / 'cache'))
+    first = str(tmp_path / 'first.dat')
+    cache.fetch('k', '.dat', first, _writer(b'x' * 10))
+    os.utime(first, (1e9, 1e9))
+    second = str(tmp_path / 'second.dat')
+    _, hit = cache.fetch('k', '.dat', second, _writer(b'y'))
+    assert hit
+    assert cache.lookup('k', '.dat') is not None
+    assert os.path.samefile(first, second)
+    assert os.stat(first).st_mtime == 1e9
+
+
+def test_lru_follows_use(tmp_path):
+    cache = FileCache(str(tmp_path / 'cache'))
+    for key in ('a', 'b'):
+        cache.fetch(key, '.dat', None, _writer(b'x' * 10), link=False)
+        time.sleep(0.01)
+    cache.lookup('a', '.dat')
+    cache.max_bytes = 15
+    cache.evict()
+    assert cache.lookup('a', '.dat') is not None
+    assert cache.lookup('b', '.dat') is None
+    assert not os.path.exists(cache._stamp(cache.entry('b', '.dat')))
+
+
+def test_result_cache_hit_keeps_manifest_of_other_drift():
+    with bench.stub_env(size=64):
+        open('sky.fits', 'w').close()
+        kwargs = dict(sky_img='sky.fits', manifest='manifest.jsonl',
+                      result_cache='results')
+        Drift(0.0, 0.0, name='a', **kwargs).run()
+        time.sleep(0.01)
+        # Same stage keys as 'a': served from the result cache.
+        Drift(0.0, 0.0, name='b', **kwargs).run()
+        resumed = Drift(0.0, 0.0, name='a', **kwargs)
+        assert all(resumed._up_to_date(stage)
+                   for stage in ('im2uv', 'visgen', 'maps2uvfits'))
+
+
+def test_result_cache_evicted_after_im2uv_skipped(monkeypatch):
+    from .. import pymaps
+    uvgrids = []
+    visgen = pymaps.visgen
+
+    def spy(*args, **kwargs):
+        uvgrids.append(kwargs.get('uvgrid'))
+        return visgen(*args, **kwargs)
+
+    monkeypatch.setattr(pymaps, 'visgen', spy)
+    with bench.stub_env(size=64):
+        open('sky.fits', 'w').close()
+        kwargs = dict(sky_img='sky.fits', result_cache='results')
+        Drift(0.0, 0.0, name='a', **kwargs).run()
+        d = Drift(0.0, 0.0, name='b', **kwargs)
+        d.im2uv()
+        assert d.vis_in is None
+        # Evicted by another worker between im2uv and visgen.
+        d.result_cache.clear()
+        d.write_spec()
+        d.visgen()
+        assert uvgrids == ['sky.dat', 'sky.dat']
+        assert d.result_cache.lookup(d.stage_keys()['visgen'], '.vis')
+        d.remove_vis_in()
+        d.maps2uvfits()
+        assert os.path.exists('b.uvfits')
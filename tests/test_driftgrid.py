@@ -0,0 +1,40 @@
+"""
+Column-wise spec generation of `driftscan.DriftGrid`.
+
+"""
+from __future__ import print_function, division
+
+import numpy as np
+import pytest
+
+from .. import settings as s
+from ..driftscan import Drift, DriftGrid
+
+RA = [0.0, 1.5, 12.25, 23.99]
+HA = [-1.0, 0.0, 0.75]
+FREQ = [140.0, 167.035, 181.92] + list(s.MWA.FREQ_EOR_ALL_40KHZ[[0, 289]])
+
+
+@pytest.mark.parametrize('kwargs', [
+    {},
+    {'pointing_center': ('04:00:00', '-30:00:00')},
+    {'corr_chan_bw': 0.08, 'duration': 112.0, 'corr_int_time': 8.0,
+     'scan_start': '2015:091:15:34:35', 'fov_size': (1e5, 2e5)},
+])
+def test_spec_bodies_match_drift(kwargs):
+    grid = DriftGrid.product(RA, HA, FREQ, **kwargs)
+    assert len(grid) == len(RA) * len(HA) * len(FREQ)
+    bodies = grid.spec_bodies()
+    assert bodies == [grid.drift(i).spec_body() for i in range(len(grid))]
+    ra, ha, freq = np.meshgrid(RA, HA, FREQ, indexing='ij')
+    for i in (0, 7, len(grid) - 1):
+        d = Drift(ra.flat[i], ha.flat[i], frequency=freq.flat[i], **kwargs)
+        assert bodies[i] == d.spec_body()
+
+
+def test_spec_of_rows():
+    grid = DriftGrid([0.0, 1.0, 2.0], 0.0, [140.0, 150.0, 160.0])
+    rows = [2, 0]
+    spec = grid.spec(rows)
+    assert '# scans: 2\n' in spec
+    assert spec.endswith(''.join(grid.drift(i).spec_body() for i in rows))
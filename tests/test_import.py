@@ -0,0 +1,60 @@
+"""
+Import of the package must stay cheap and silent (see `settings`).
+
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import json
+import subprocess
+
+PACKAGE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Bound on the import time of driftscan in a fresh interpreter beyond that
+# of numpy alone, measured alongside it [second]. The package itself takes
+# about 0.05 s on top of numpy; importing astropy would add several times
+# the budget.
+IMPORT_BUDGET = 0.1
+
+# Imports timed per interpreter; the fastest of NRUN runs is compared.
+NRUN = 3
+
+_SCRIPT = '''
+import sys, time, json
+start = time.perf_counter()
+import {0}
+wall = time.perf_counter() - start
+sys.stderr.write(json.dumps({{
+    'wall': wall,
+    'astropy': sorted(m for m in sys.modules if m.split('.')[0] == 'astropy'),
+}}))
+'''
+
+
+def _import(module):
+    env = dict(os.environ)
+    # Without $SIM, settings would print a warning if it were resolved at
+    # import time.
+    env.pop('SIM', None)
+    proc = subprocess.run(
+        [sys.executable, '-c', _SCRIPT.format(module)],
+        cwd=os.path.dirname(PACKAGE), env=env, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    return proc.stdout, json.loads(proc.stderr)
+
+
+def test_import_driftscan():
+    driftscan = os.path.basename(PACKAGE) + '.driftscan'
+    walls = []
+    baseline = []
+    for _ in range(NRUN):
+        stdout, report = _import(driftscan)
+        assert stdout == ''
+        assert report['astropy'] == []
+        walls.append(report['wall'])
+        baseline.append(_import('numpy')[1]['wall'])
+    extra = min(walls) - min(baseline)
+    assert extra < IMPORT_BUDGET, \
+        'import took {0:.3f} s, {1:.3f} s more than numpy'\
+        .format(min(walls), extra)
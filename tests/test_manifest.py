@@ -0,0 +1,114 @@
+"""
+Resuming drifts from their `manifest.Manifest`, with the stub MAPS binaries
+of `bench`.
+
+"""
+from __future__ import print_function, division
+
+import os
+
+import pytest
+
+from .. import bench, pymaps
+from ..driftscan import Drift
+from ..manifest import Manifest
+
+PROGRAMS = ('im2uv', 'visgen', 'maps2uvfits')
+
+
+@pytest.fixture
+def launched(monkeypatch):
+    """
+    Names of the MAPS programs run, in order.
+
+    """
+    out = []
+
+    def spy(name, wrapped):
+        def run(*args, **kwargs):
+            out.append(name)
+            return wrapped(*args, **kwargs)
+        return run
+
+    for name in PROGRAMS:
+        monkeypatch.setattr(pymaps, name, spy(name, getattr(pymaps, name)))
+    return out
+
+
+def _run(**kwargs):
+    kwargs.setdefault('manifest', 'manifest.jsonl')
+    d = Drift(0.0, 0.0, sky_img='sky.fits', name='d', **kwargs)
+    d.run()
+    return d
+
+
+def test_resume_skips_up_to_date_stages(launched):
+    with bench.stub_env(size=64):
+        open('sky.fits', 'w').close()
+        _run()
+        assert launched == list(PROGRAMS)
+        del launched[:]
+        d = _run()
+        assert launched == []
+        assert d.uvfits == 'd.uvfits'
+        assert 'maps2uvfits() skipped' in str(d)
+
+
+def test_resume_runs_only_missing_stages(launched):
+    with bench.stub_env(size=64):
+        open('sky.fits', 'w').close()
+        _run()
+        os.remove('d.uvfits')
+        del launched[:]
+        _run()
+        # visgen's output is still there; the uv-grid is not needed.
+        assert launched == ['maps2uvfits']
+
+
+def test_changed_output_is_rerun(launched):
+    with bench.stub_env(size=64):
+        open('sky.fits', 'w').close()
+        _run()
+        with open('d.vis', 'ab') as f:
+            f.write(b'\0')
+        os.remove('d.uvfits')
+        del launched[:]
+        _run()
+        assert launched == list(PROGRAMS)
+
+
+def test_changed_input_is_rerun(launched):
+    with bench.stub_env(size=64):
+        open('sky.fits', 'w').close()
+        _run()
+        del launched[:]
+        _run(duration=4.0)
+        assert launched == list(PROGRAMS)
+        del launched[:]
+        _run(duration=4.0)
+        assert launched == []
+
+
+def test_hash_verify_detects_same_size_and_mtime(launched):
+    with bench.stub_env(size=64):
+        open('sky.fits', 'w').close()
+        manifest = Manifest('manifest.jsonl', verify='hash')
+        _run(manifest=manifest)
+        st = os.stat('d.uvfits')
+        with open('d.uvfits', 'r+b') as f:
+            f.write(b'\1')
+        os.utime('d.uvfits', ns=(st.st_atime_ns, st.st_mtime_ns))
+        del launched[:]
+        _run(manifest=Manifest('manifest.jsonl', verify='hash'))
+        assert launched == ['maps2uvfits']
+
+
+def test_partial_record_is_ignored(launched):
+    with bench.stub_env(size=64):
+        open('sky.fits', 'w').close()
+        _run()
+        with open('manifest.jsonl', 'a') as f:
+            f.write('{"name": "d", "stage": "maps2uvfits", "ke')
+        del launched[:]
+        _run()
+        assert launched == []
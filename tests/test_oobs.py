@@ -0,0 +1,58 @@
+"""
+Horizon cull of the oobs list in `driftscan.Drift`.
+
+"""
+from __future__ import print_function, division
+
+from .. import astro, bench
+from ..catalog import Catalog
+from ..driftscan import Drift
+
+POINTING = ('00:00:00', '-26:42:11')
+
+
+def _catalog(filename='oobs.txt'):
+    # One source at the MWA zenith at LST 0h, one at LST 12h.
+    with open(filename, 'w') as f:
+        f.write('0.0 -26.7 1 0 0 0\n12.0 -26.7 1 0 0 0\n')
+    return filename
+
+
+def _culled_ras(drift):
+    catalog = Catalog(drift.oobs)
+    return sorted(catalog.sources['ra'][drift._oobs_rows(catalog)])
+
+
+def test_cull_follows_scan_start_not_target():
+    with bench.stub_env():
+        oobs = _catalog()
+        drifts = [Drift(ra, 0.0, pointing_center=POINTING, oobs=oobs,
+                        oobs_cutoff=180.) for ra in (0.0, 12.0)]
+        # visgen sees the same spec for both drifts.
+        assert drifts[0].spec_body() == drifts[1].spec_body()
+        assert (drifts[0].stage_keys()['visgen'] ==
+                drifts[1].stage_keys()['visgen'])
+        assert _culled_ras(drifts[0]) == _culled_ras(drifts[1]) == [0.0]
+
+
+def test_cull_with_absolute_scan_start():
+    with bench.stub_env():
+        oobs = _catalog()
+        # LST at the MWA is about 12h at 2015-04-01 15:34:35 UTC.
+        start = '2015:091:15:34:35'
+        lst = astro.scan_start_lst(start, 116.670456)
+        assert abs(lst - 12.) < 0.01
+        d = Drift(0.0, 0.0, pointing_center=POINTING, oobs=oobs,
+                  oobs_cutoff=180., scan_start=start)
+        assert _culled_ras(d) == [12.0]
+        gha = Drift(0.0, 0.0, pointing_center=POINTING, oobs=oobs,
+                    oobs_cutoff=180.)
+        assert d.stage_keys()['visgen'] != gha.stage_keys()['visgen']
+
+
+def test_scan_start_lst_of_maps_gha():
+    from .. import settings as s
+    lon = float(s.MAPS.ARRAY_LOC['mwa_128'][1])
+    gha = 'GHA {0:f}'.format(s.MAPS.MAPS_GHA['mwa_128'])
+    lst = astro.scan_start_lst(gha, lon)
+    assert min(lst, 24. - lst) < 1e-3
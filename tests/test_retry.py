@@ -0,0 +1,79 @@
+"""
+Classification of drift failures into retried and permanent ones by the
+`driftscan.batch_drift` workers.
+
+"""
+from __future__ import print_function, division
+
+import errno
+
+import pytest
+
+from .. import driftscan, pymaps
+from ..driftscan import Drift, PERMANENT, TRANSIENT
+
+RETRIES = 2
+
+
+class _FlakyDrift(Drift):
+    """
+    Drift whose runs raise the queued exceptions, then succeed.
+
+    """
+    failures = []
+    runs = 0
+
+    def run(self, mpi=1):
+        _FlakyDrift.runs += 1
+        if _FlakyDrift.failures:
+            raise _FlakyDrift.failures.pop(0)
+        self.uvfits = self.name + '.uvfits'
+
+
+def _attempt(monkeypatch, failures, transient=TRANSIENT,
+             permanent=PERMANENT):
+    monkeypatch.setattr(driftscan, '_WORKER', {})
+    monkeypatch.setattr(_FlakyDrift, 'failures', list(failures))
+    monkeypatch.setattr(_FlakyDrift, 'runs', 0)
+    driftscan._init_worker(None, RETRIES, 0.0, transient, permanent)
+    res = driftscan._attempt((0, _FlakyDrift(0.0, 0.0, name='d')))
+    assert res['attempts'] == _FlakyDrift.runs
+    return res
+
+
+@pytest.mark.parametrize('error', [
+    FileNotFoundError(errno.ENOENT, 'No such file', 'sky.fits'),
+    PermissionError(errno.EACCES, 'Permission denied', 'd.vis'),
+    IsADirectoryError(errno.EISDIR, 'Is a directory', 'd.ospec'),
+    ValueError('bad spec'),
+    driftscan._InputError('No imagae file', 'im2uv', 'd'),
+])
+def test_permanent_failures_are_not_retried(monkeypatch, error):
+    res = _attempt(monkeypatch, [error])
+    assert res['status'] == 'failed'
+    assert res['attempts'] == 1
+    assert res['error'].startswith(type(error).__name__ + ': ')
+
+
+@pytest.mark.parametrize('error', [
+    OSError(errno.EIO, 'Input/output error'),
+    OSError(errno.ENOSPC, 'No space left on device'),
+    pymaps._VisgenError('MPI_ABORT', 'd.viserr'),
+])
+def test_transient_failures_are_retried(monkeypatch, error):
+    res = _attempt(monkeypatch, [error] * RETRIES)
+    assert res['status'] == 'ok'
+    assert res['attempts'] == RETRIES + 1
+    assert res['uvfits'] == 'd.uvfits'
+    res = _attempt(monkeypatch, [error] * (RETRIES + 1))
+    assert res['status'] == 'failed'
+    assert res['attempts'] == RETRIES + 1
+
+
+def test_custom_classification(monkeypatch):
+    res = _attempt(monkeypatch, [ValueError('flaky')],
+                   transient=(ValueError,))
+    assert (res['status'], res['attempts']) == ('ok', 2)
+    res = _attempt(monkeypatch, [OSError(errno.EIO, 'Input/output error')],
+                   permanent=(OSError,))
+    assert (res['status'], res['attempts']) == ('failed', 1)
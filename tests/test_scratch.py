@@ -0,0 +1,59 @@
+"""
+Scratch directories of drifts run in worker processes, with the stub MAPS
+binaries of `bench`.
+
+"""
+from __future__ import print_function, division
+
+import os
+
+from .. import bench, cost
+from ..driftscan import Drift, batch_drift
+from ..scratch import Scratch, _PREFIX
+
+
+def _dirs(base):
+    return [d for d in os.listdir(base) if d.startswith(_PREFIX)]
+
+
+def _drifts(n, **kwargs):
+    open('sky.fits', 'w').close()
+    return [Drift(0.0, 0.01 * i, sky_img='sky.fits', name='d{0:d}'.format(i),
+                  uvgrid_cache='uvgrid', **kwargs) for i in range(n)]
+
+
+def test_shared_scratch_one_directory_per_worker():
+    with bench.stub_env() as workdir:
+        base = os.path.join(workdir, 'shm')
+        scratch = Scratch(base)
+        report = batch_drift(_drifts(6, scratch=scratch), nprocs=2,
+                             progress=None)
+        assert report['failed'] == []
+        # One directory per worker process, however many drifts and
+        # attempts each of them ran.
+        assert 1 <= len(_dirs(base)) <= 2
+        scratch.close()
+        assert _dirs(base) == []
+        assert _dirs(workdir) == []
+
+
+def test_scratch_directory_removed_with_drift():
+    with bench.stub_env() as workdir:
+        base = os.path.join(workdir, 'shm')
+        report = batch_drift(_drifts(4, scratch=base), nprocs=2,
+                             progress=None)
+        assert report['failed'] == []
+        assert _dirs(base) == []
+        assert sorted(f for f in os.listdir('.') if f.endswith('.uvfits')) \
+            == ['d{0:d}.uvfits'.format(i) for i in range(4)]
+
+
+def test_no_size_estimate_without_scratch(monkeypatch):
+    def features(drift):
+        raise AssertionError('cost.features called without scratch')
+
+    with bench.stub_env():
+        monkeypatch.setattr(cost, 'features', features)
+        d = _drifts(1)[0]
+        d.run()
+        assert d.uvfits == 'd0.uvfits'
@@ -0,0 +1,61 @@
+"""
+Per-stage child peak RSS in the telemetry events and the memory fit of
+`cost.CostModel.calibrate`.
+
+"""
+from __future__ import print_function, division
+
+import numpy as np
+
+from .. import aiomaps, bench, cost
+from ..driftscan import Drift
+from ..telemetry import JSONLinesSink
+
+STAGES = ['im2uv', 'visgen', 'maps2uvfits']
+
+
+def _drift(name):
+    open('sky.fits', 'w').close()
+    return Drift(0.0, 0.0, sky_img='sky.fits', name=name,
+                 telemetry='events.jsonl')
+
+
+def _check(events):
+    assert sorted(e['stage'] for e in events) == sorted(STAGES)
+    for e in events:
+        # A Python process (the stub) takes a few MB.
+        assert 2 ** 20 < e['child_rss'] <= e['child_peak_rss']
+
+
+def test_child_rss_of_each_stage():
+    with bench.stub_env():
+        _drift('d').run()
+        _check(JSONLinesSink('events.jsonl').events())
+
+
+def test_child_rss_with_aiomaps():
+    with bench.stub_env():
+        out = aiomaps.batch_drift([_drift('d')])
+        assert not isinstance(out[0], Exception)
+        _check(JSONLinesSink('events.jsonl').events())
+
+
+def test_calibrate_fits_memory_to_child_rss():
+    coef = [5e7, 300.0, 0.0, 12.0]
+    events = []
+    for i in range(8):
+        f = {'nbaseline': 100 * (i + 1), 'ntime': 10 + i, 'nsrc': 0,
+             'npix': 1000 * (i % 3 + 1) ** 2}
+        memory = float(np.dot(coef, cost._terms(f)))
+        for stage in STAGES:
+            events.append({'name': 'd{0:d}'.format(i), 'stage': stage,
+                           'status': 'ok', 'features': f, 'wall': 1.0,
+                           'cpu': 0.0, 'child_cpu': 1.0, 'bytes_written': 1,
+                           'child_rss': memory if stage == 'visgen'
+                           else 1e6})
+    # A drift with a stage served from a cache does not count.
+    events.append(dict(events[-1], name='cached', child_rss=None))
+    del events[-1]['child_rss']
+    model = cost.CostModel.calibrate(events)
+    assert 'memory' in model.calibrated
+    assert np.allclose(model.coef['memory'], coef)
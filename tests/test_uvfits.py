@@ -0,0 +1,107 @@
+"""
+Time keywords of `uvfits.write_uvfits` and the array files of `layout`.
+
+No maps2uvfits output is available to compare with, so the time keywords
+are checked against astropy.
+
+"""
+from __future__ import print_function, division
+
+import warnings
+
+import numpy as np
+import pytest
+from astropy.io import fits
+from astropy.time import Time
+
+from .. import layout, uvfits, visfile
+from .. import settings as s
+
+ARRAYLOC = s.MAPS.ARRAY_LOC['mwa_128']
+
+
+def _gmst_deg(isot):
+    # UT1 is taken as UTC.
+    return Time(isot, scale='ut1').sidereal_time('mean', 'greenwich').deg
+
+
+def test_reference_time_of_gha_start():
+    gha = s.MAPS.MAPS_GHA['mwa_128']
+    rdate, gstia0, jd0, jd = uvfits.reference_time('GHA {0:f}'.format(gha))
+    assert rdate == '2000-01-01'
+    assert jd0 == Time('2000-01-01', scale='utc').jd
+    assert abs(gstia0 - _gmst_deg('2000-01-01')) < 1e-3
+    assert 0 <= jd - jd0 < 1
+    gst = Time(jd, format='jd', scale='ut1').sidereal_time(
+        'mean', 'greenwich').hour
+    assert abs((gst - gha + 12) % 24 - 12) < 1e-4
+
+
+def test_reference_time_of_absolute_start():
+    rdate, gstia0, jd0, jd = uvfits.reference_time('2015:091:15:34:35')
+    assert rdate == '2015-04-01'
+    assert jd0 == Time('2015-04-01', scale='utc').jd
+    assert abs(jd - Time('2015-04-01T15:34:35', scale='utc').jd) < 1e-8
+    assert abs(gstia0 - _gmst_deg('2015-04-01')) < 1e-3
+
+
+def _write_vis(filename, ntime=2, nbaseline=3):
+    header = np.zeros(1, dtype=visfile.HEADER_DTYPE)
+    header['nbaseline'], header['ntime'] = nbaseline, ntime
+    header['nchan'], header['npol'] = 1, 4
+    header['freq'], header['chan_bw'] = 1.5e8, 4e4
+    rec = np.zeros(ntime * nbaseline, dtype=visfile.record_dtype(1, 4))
+    rec['baseline'] = np.tile([258, 259, 515], ntime)
+    rec['time'] = np.repeat(np.arange(ntime) * 8., nbaseline)
+    with open(filename, 'wb') as f:
+        for _ in range(2):
+            f.write(header.tobytes())
+            f.write(rec.tobytes())
+
+
+def _write_array(filename):
+    with open(filename, 'w') as f:
+        f.write('# name east north up\n'
+                'T1 0.0 0.0 0.0\n'
+                'T2 10.0 0.0 0.0\n'
+                'T3 0.0 10.0 0.0\n')
+
+
+def test_write_uvfits_dates_follow_scan_start(tmp_path):
+    vis = str(tmp_path / 'sweep.vis')
+    arrayconf = str(tmp_path / 'array.txt')
+    _write_vis(vis)
+    _write_array(arrayconf)
+    starts = ['2015:091:15:34:35', '2015:091:16:34:35']
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        out = uvfits.write_uvfits(vis, str(tmp_path / 'sweep.uvfits'),
+                                  ARRAYLOC, arrayconf, scan_start=starts)
+    with fits.open(out) as hdul:
+        an = hdul['AIPS AN'].header
+        assert an['RDATE'] == '2015-04-01'
+        assert abs(an['GSTIA0'] - _gmst_deg('2015-04-01')) < 1e-3
+        date = hdul[0].data.par('DATE')
+    assert hdul[0].header['PZERO5'] == Time('2015-04-01').jd
+    expected = Time(['2015-04-01T15:34:35', '2015-04-01T16:34:35'],
+                    scale='utc').jd
+    expected = (expected[:, None] + np.repeat([0., 8.], 3) / 86400.).ravel()
+    # DATE is stored as float32 days from PZERO5.
+    assert np.allclose(date, expected, rtol=0, atol=1e-5)
+
+
+def test_read_array_config(tmp_path):
+    filename = str(tmp_path / 'array.txt')
+    with open(filename, 'w') as f:
+        f.write('# comment\n\nT1 1 2 3\n4 5 6\n')
+    names, enu = layout.read_array_config(filename)
+    assert names == ['T1', 'ANT002']
+    assert enu.tolist() == [[1, 2, 3], [4, 5, 6]]
+
+
+def test_read_array_config_rejects_unknown_lines(tmp_path):
+    filename = str(tmp_path / 'array.txt')
+    with open(filename, 'w') as f:
+        f.write('T1 1 2 3\n128\n')
+    with pytest.raises(ValueError, match='array.txt:2'):
+        layout.read_array_config(filename)
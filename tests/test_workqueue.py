@@ -0,0 +1,77 @@
+"""
+Several `workqueue.work` processes on one queue, one of them killed in the
+middle of a job, with the stub MAPS binaries of `bench`.
+
+"""
+from __future__ import print_function, division
+
+import os
+import time
+import signal
+import multiprocessing
+
+from .. import bench
+from ..driftscan import Drift
+from ..workqueue import WorkQueue, work
+
+NJOB = 6
+NWORKER = 3
+
+# Short lease so that the job of the killed worker is requeued quickly.
+LEASE = 1.0
+
+TIMEOUT = 120.0
+
+
+def _work(filename):
+    work(WorkQueue(filename, lease=LEASE), wait=True, poll=0.2)
+
+
+def _wait(predicate, timeout=TIMEOUT):
+    end = time.time() + timeout
+    while not predicate():
+        assert time.time() < end, 'timed out'
+        time.sleep(0.05)
+
+
+def test_killed_worker_job_is_requeued():
+    ctx = multiprocessing.get_context('fork')
+    with bench.stub_env(sleep=0.5) as workdir:
+        drifts = []
+        for i in range(NJOB):
+            sky = 'sky{0:02d}.fits'.format(i)
+            open(sky, 'w').close()
+            drifts.append(Drift(0.0, 0.01 * i, sky_img=sky))
+        filename = os.path.join(workdir, 'queue.db')
+        queue = WorkQueue(filename, lease=LEASE)
+        queue.put(drifts)
+        procs = [ctx.Process(target=_work, args=(filename,))
+                 for _ in range(NWORKER)]
+        for p in procs:
+            p.start()
+        try:
+            _wait(lambda: queue.status()['running'])
+            with queue._connect() as db:
+                job_id, worker = db.execute(
+                    "SELECT id, worker FROM jobs WHERE state = 'running' "
+                    'ORDER BY id LIMIT 1').fetchone()
+            pid = int(worker.rsplit(':', 1)[1])
+            os.kill(pid, signal.SIGKILL)
+            for p in procs:
+                p.join(TIMEOUT)
+                assert p.exitcode is not None, 'worker hung'
+        finally:
+            for p in procs:
+                if p.is_alive():
+                    p.kill()
+        killed = [p for p in procs if p.pid == pid]
+        assert len(killed) == 1
+        assert killed[0].exitcode == -signal.SIGKILL
+        status = queue.status()
+        assert status['done'] == NJOB
+        assert status['failed'] == status['pending'] == 0
+        assert status['running'] == 0
+        with queue._connect() as db:
+            attempts = dict(db.execute('SELECT id, attempts FROM jobs'))
+        assert attempts.pop(job_id) == 2
+        assert set(attempts.values()) == {1}
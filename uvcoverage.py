@@ -0,0 +1,228 @@
+"""
+uv-coverage preview of drifts without running visgen.
+
+The baselines of an array are taken from its configuration file
+(`settings.MAPS.ARRAY_CONFIG`), rotated into the equatorial frame and
+optionally cached as .npy in a `cache.FileCache`, keyed by the content of
+the file and the latitude of the site. The uvw tracks of a drift are then
+computed for all baselines and time steps at once, and a sweep is reduced
+to uv density grids, which can be compared to spot drifts with (nearly)
+the same coverage before spending visgen runs on them::
+
+    >>> grids, extent = density(drifts)
+    >>> keep = [i for i in range(len(drifts))
+    ...         if i not in redundant(grids)]
+
+The phase centre is the pointing centre of the drift. The local sidereal
+time at the start of a drift is taken from its Scan_start and site as
+visgen does (see `astro.scan_start_lst`), so drifts with the same spec have
+the same tracks whatever their target_ra and target_ha.
+
+"""
+from __future__ import print_function, division
+
+import numpy as np
+
+from . import astro, layout
+from . import settings as s
+from .cache import FileCache, file_digest, make_key
+
+
+C = 299792458.0
+
+# Sidereal hours per solar hour.
+SIDEREAL_RATE = 1.00273790935
+
+_BASELINES = {}
+
+
+def _baseline_vectors(arrayconf, latitude):
+    names, enu = layout.read_array_config(arrayconf)
+    xyz = layout.enu2xyz(enu, latitude)
+    i, j = np.triu_indices(len(xyz), 1)
+    return xyz[j] - xyz[i]
+
+
+def baselines(site='MWA_128', cache=None):
+    """
+    Baseline vectors of an array in the equatorial XYZ frame.
+
+    Parameters
+    ----------
+    site: str, optional
+        Array, a key of `settings.MAPS.ARRAY_CONFIG`.
+    cache: str or `cache.FileCache`, optional
+        Cache directory (or cache object) holding the vectors as .npy.
+        Vectors are always memoized per process.
+
+    Return
+    ------
+    out: (nbaseline, 3) ndarray
+        XYZ of antenna j minus antenna i for i < j [m], in the order of
+        `numpy.triu_indices`.
+
+    """
+    arrayconf = s.MAPS.ARRAY_CONFIG[site.lower()]
+    latitude = float(s.MAPS.ARRAY_LOC[site.lower()][0])
+    key = make_key('baselines', file_digest(arrayconf), latitude)
+    try:
+        return _BASELINES[key]
+    except KeyError:
+        pass
+    if cache is None:
+        bl = _baseline_vectors(arrayconf, latitude)
+    else:
+        if not isinstance(cache, FileCache):
+            cache = FileCache(cache)
+
+        def produce(path):
+            # np.save appends .npy to names without it.
+            with open(path, 'wb') as f:
+                np.save(f, _baseline_vectors(arrayconf, latitude))
+
+        path, _ = cache.fetch(key, '.npy', None, produce, link=False)
+        bl = np.load(path)
+    _BASELINES[key] = bl
+    return bl
+
+
+def hour_angles(drift):
+    """
+    Hour angles of the phase centre of a drift at the middle of each
+    correlator integration [decimal hour].
+
+    """
+    dt = float(drift.corr_int_time)
+    ntime = max(1, int(round(float(drift.scan_duration) / dt)))
+    ha0 = drift._start_lst() - astro.hms2h(drift.fov_center_ra)
+    return ha0 + (np.arange(ntime) + 0.5) * dt / 3600. * SIDEREAL_RATE
+
+
+def uvw_tracks(drift, cache=None):
+    """
+    uvw of every baseline and time step of a drift.
+
+    Parameters
+    ----------
+    drift: `driftscan.Drift`
+        The drift.
+    cache: str or `cache.FileCache`, optional
+        Baseline cache (see `baselines`).
+
+    Return
+    ------
+    out: (ntime, nbaseline, 3) ndarray
+        u, v, w [wavelength] at the centre frequency of the drift.
+
+    """
+    bl = baselines(drift.site, cache) * (drift._center_frequency * 1e6 / C)
+    ha = np.radians(hour_angles(drift) * 15.)[:, None]
+    dec = np.radians(astro.dms2d(drift.fov_center_dec))
+    sin_h, cos_h = np.sin(ha), np.cos(ha)
+    sin_d, cos_d = np.sin(dec), np.cos(dec)
+    x, y, z = bl[:, 0], bl[:, 1], bl[:, 2]
+    u = sin_h * x + cos_h * y
+    v = -sin_d * cos_h * x + sin_d * sin_h * y + cos_d * z
+    w = cos_d * cos_h * x - cos_d * sin_h * y + sin_d * z
+    return np.stack([u, v, w], axis=-1)
+
+
+def _drifts(instance):
+    drifts = getattr(instance, 'drifts', instance)
+    return drifts if isinstance(drifts, list) else list(drifts)
+
+
+def density(instance, size=256, extent=None, cache=None):
+    """
+    uv density grids of drifts.
+
+    Each visibility and its conjugate add one count to the uv cell they
+    fall in; samples beyond `extent` are dropped.
+
+    Parameters
+    ----------
+    instance: `driftscan.Drift`, list of `Drift`, `DriftGrid` or `DriftSweep`
+        Drifts.
+    size: int, optional
+        Cells per side of the grids.
+    extent: float, optional
+        Half-width of the grids [wavelength]. Defaults to the longest
+        projected baseline of all drifts.
+    cache: str or `cache.FileCache`, optional
+        Baseline cache (see `baselines`).
+
+    Return
+    ------
+    out: ((ndrift, size, size) ndarray, float)
+        Counts per drift, v along the first axis of each grid, and the
+        extent.
+
+    """
+    if hasattr(instance, 'corr_int_time'):
+        instance = [instance]
+    # Drifts with the same hour angles, declination, frequency and site have
+    # the same tracks, which are computed and gridded once.
+    tracks = {}
+    keys = []
+    for d in _drifts(instance):
+        key = (d.site.lower(), d._center_frequency, d.fov_center_dec,
+               tuple(hour_angles(d)))
+        if key not in tracks:
+            tracks[key] = uvw_tracks(d, cache)[..., :2].reshape(-1, 2)
+        keys.append(key)
+    if extent is None:
+        extent = max([np.abs(uv).max() if uv.size else 0.
+                      for uv in tracks.values()] + [1.])
+    cell = 2. * extent / size
+    unique = {}
+    for key, uv in tracks.items():
+        iu, iv = (np.floor(np.concatenate([uv, -uv]) / cell)
+                  .astype(np.int64) + size // 2).T
+        inside = (iu >= 0) & (iu < size) & (iv >= 0) & (iv < size)
+        unique[key] = np.bincount(iv[inside] * size + iu[inside],
+                                  minlength=size * size).reshape(size, size)
+    grids = np.zeros((len(keys), size, size), dtype=np.int64)
+    for k, key in enumerate(keys):
+        grids[k] = unique[key]
+    return grids, extent
+
+
+def similarity(grids):
+    """
+    Cosine similarity of the uv density grids of every pair of drifts.
+
+    """
+    flat = np.asarray(grids, dtype=float).reshape(len(grids), -1)
+    norm = np.sqrt((flat ** 2).sum(axis=1))
+    flat /= np.where(norm > 0, norm, 1.)[:, None]
+    return flat.dot(flat.T)
+
+
+def redundant(grids, threshold=0.99):
+    """
+    Drifts whose coverage matches that of an earlier drift.
+
+    Parameters
+    ----------
+    grids: (ndrift, size, size) array-like
+        uv density grids (see `density`).
+    threshold: float, optional
+        Minimum cosine similarity to count as redundant.
+
+    Return
+    ------
+    out: dict
+        Index of each redundant drift -> index of the first kept drift it
+        duplicates.
+
+    """
+    sim = similarity(grids)
+    out = {}
+    kept = []
+    for i in range(len(sim)):
+        match = [k for k in kept if sim[i, k] >= threshold]
+        if match:
+            out[i] = match[0]
+        else:
+            kept.append(i)
+    return out
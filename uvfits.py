@@ -0,0 +1,255 @@
+"""
+In-process UVFITS writer replacing the maps2uvfits subprocess.
+
+Visibilities are streamed from a .vis file (see `visfile`) into a UVFITS
+random-groups file in large buffered chunks, followed by an AIPS AN
+(antenna) table. Array metadata is built once per array configuration and
+location and shared by all files of a batch.
+
+The time keywords follow the Scan_start of the visgen spec (see
+`reference_time`): RDATE is the UTC date of the scan, GSTIA0 the Greenwich
+mean sidereal time at its 0h UTC, and DATE counts days from that 0h.
+
+Experimental: it reads the .vis layout of `visfile`, which has not been
+verified against visgen, and its output has not been compared with that of
+maps2uvfits, so it is not a backend of `pymaps.maps2uvfits` or
+`driftscan.Drift`; drifts always run maps2uvfits.
+
+"""
+from __future__ import print_function, division
+
+from datetime import datetime, timedelta
+
+import numpy as np
+from astropy.io import fits
+from astropy.coordinates import EarthLocation
+import astropy.units as u
+
+from . import astro, layout, visfile
+
+
+_BLOCK = 2880
+_ANTENNA_TABLES = {}
+
+# Julian date of 2000-01-01 0h UTC, the reference date of 'GHA' scans.
+_JD_GHA = 2451544.5
+
+
+def reference_time(scan_start):
+    """
+    Reference date of a scan and the Julian date of its start.
+
+    An absolute Scan_start gives the date and time directly. A 'GHA' start
+    only sets the Greenwich sidereal time at the start (see
+    `astro.scan_start_lst`); the scan is then placed on 2000-01-01, at the
+    first time of that day at which the mean sidereal time reaches it.
+
+    Parameters
+    ----------
+    scan_start: str
+        Scan_start of the visgen spec of the scan.
+
+    Return
+    ------
+    out: (str, float, float, float)
+        RDATE ('yyyy-mm-dd'), GSTIA0 (GMST at 0h UTC of RDATE [degree]),
+        the Julian date of 0h UTC of RDATE and that of the scan start.
+
+    """
+    if scan_start.upper().startswith('GHA'):
+        jd0 = _JD_GHA
+        gst = float(scan_start.split()[1])
+        # GMST advances 24.0657 sidereal hours per solar day.
+        jd = jd0 + ((gst - astro.gmst(jd0)) % 24.) / 24.06570982441908
+    else:
+        jd = astro.scan_start_jd(scan_start)
+        jd0 = np.floor(jd - 0.5) + 0.5
+    rdate = (datetime(2000, 1, 1) + timedelta(days=jd0 - _JD_GHA))\
+        .strftime('%Y-%m-%d')
+    return rdate, float(astro.gmst(jd0)) * 15., float(jd0), float(jd)
+
+
+def antenna_table(arrayloc, arrayconf, freq=0.0, rdate='2000-01-01',
+                  gstia0=0.0):
+    """
+    AIPS AN table of an array. Tables are cached per (arrayloc, arrayconf,
+    freq, rdate, gstia0) and shared by every file written in this process.
+
+    Parameters
+    ----------
+    arrayloc: (str, str, str)
+        Latitude [degree], longitude [degree] and height [m] of the array,
+        as in `settings.MAPS.ARRAY_LOC`.
+    arrayconf: str
+        Array configuration file.
+    freq: float, optional
+        Reference frequency [Hz].
+    rdate, gstia0: str, float, optional
+        Reference date and GMST at its 0h UTC [degree], see
+        `reference_time`.
+
+    """
+    key = (tuple(arrayloc), arrayconf, freq, rdate, gstia0)
+    try:
+        return _ANTENNA_TABLES[key]
+    except KeyError:
+        pass
+    lat, lon, height = [float(x) for x in arrayloc]
+    names, enu = layout.read_array_config(arrayconf)
+    xyz = layout.enu2xyz(enu, lat)
+    nant = len(names)
+    centre = EarthLocation.from_geodetic(lon * u.deg, lat * u.deg,
+                                         height * u.m)
+    cols = [fits.Column('ANNAME', '8A', array=names),
+            fits.Column('STABXYZ', '3D', unit='METERS', array=xyz),
+            fits.Column('NOSTA', '1J', array=np.arange(1, nant + 1)),
+            fits.Column('MNTSTA', '1J', array=np.zeros(nant)),
+            fits.Column('STAXOF', '1E', unit='METERS', array=np.zeros(nant)),
+            fits.Column('POLTYA', '1A', array=['X'] * nant),
+            fits.Column('POLAA', '1E', unit='DEGREES', array=np.zeros(nant)),
+            fits.Column('POLCALA', '1E', array=np.zeros(nant)),
+            fits.Column('POLTYB', '1A', array=['Y'] * nant),
+            fits.Column('POLAB', '1E', unit='DEGREES',
+                        array=np.full(nant, 90.)),
+            fits.Column('POLCALB', '1E', array=np.zeros(nant))]
+    hdu = fits.BinTableHDU.from_columns(cols, name='AIPS AN')
+    hdr = hdu.header
+    hdr['EXTVER'] = 1
+    hdr['ARRAYX'] = centre.x.to_value(u.m)
+    hdr['ARRAYY'] = centre.y.to_value(u.m)
+    hdr['ARRAYZ'] = centre.z.to_value(u.m)
+    hdr['GSTIA0'] = gstia0
+    hdr['DEGPDY'] = 360.985647
+    hdr['FREQ'] = freq
+    hdr['RDATE'] = rdate
+    hdr['POLARX'] = 0.0
+    hdr['POLARY'] = 0.0
+    hdr['UT1UTC'] = 0.0
+    hdr['DATUTC'] = 0.0
+    hdr['TIMSYS'] = 'UTC'
+    hdr['FRAME'] = 'ITRF'
+    hdr['NUMORB'] = 0
+    hdr['NOPCAL'] = 0
+    hdr['POLTYPE'] = 'X-Y LIN'
+    hdr['XYZHAND'] = 'RIGHT'
+    _ANTENNA_TABLES[key] = hdu
+    return hdu
+
+
+def primary_header(header, gcount, object_name='', telescope='',
+                   jd0=_JD_GHA):
+    """
+    Random-groups primary header for visibilities described by a .vis scan
+    header. jd0 is the Julian date of 0h UTC of the reference date, the
+    zero point of DATE.
+
+    """
+    nchan, npol = int(header['nchan']), int(header['npol'])
+    cards = [('SIMPLE', True), ('BITPIX', -32), ('NAXIS', 7),
+             ('NAXIS1', 0), ('NAXIS2', 3), ('NAXIS3', npol),
+             ('NAXIS4', nchan), ('NAXIS5', 1), ('NAXIS6', 1), ('NAXIS7', 1),
+             ('EXTEND', True), ('GROUPS', True), ('PCOUNT', 5),
+             ('GCOUNT', gcount), ('BSCALE', 1.0), ('BZERO', 0.0),
+             ('OBJECT', object_name), ('TELESCOP', telescope),
+             ('INSTRUME', telescope), ('EPOCH', 2000.0), ('BUNIT', 'JY'),
+             ('CTYPE2', 'COMPLEX'), ('CRVAL2', 1.0), ('CDELT2', 1.0),
+             ('CRPIX2', 1.0),
+             ('CTYPE3', 'STOKES'), ('CRVAL3', -5.0), ('CDELT3', -1.0),
+             ('CRPIX3', 1.0),
+             ('CTYPE4', 'FREQ'), ('CRVAL4', float(header['freq'])),
+             ('CDELT4', float(header['chan_bw'])), ('CRPIX4', 1.0),
+             ('CTYPE5', 'IF'), ('CRVAL5', 1.0), ('CDELT5', 1.0),
+             ('CRPIX5', 1.0),
+             ('CTYPE6', 'RA'), ('CRVAL6', float(header['ra'])),
+             ('CDELT6', 1.0), ('CRPIX6', 1.0),
+             ('CTYPE7', 'DEC'), ('CRVAL7', float(header['dec'])),
+             ('CDELT7', 1.0), ('CRPIX7', 1.0),
+             ('PTYPE1', 'UU'), ('PSCAL1', 1.0), ('PZERO1', 0.0),
+             ('PTYPE2', 'VV'), ('PSCAL2', 1.0), ('PZERO2', 0.0),
+             ('PTYPE3', 'WW'), ('PSCAL3', 1.0), ('PZERO3', 0.0),
+             ('PTYPE4', 'BASELINE'), ('PSCAL4', 1.0), ('PZERO4', 0.0),
+             ('PTYPE5', 'DATE'), ('PSCAL5', 1.0), ('PZERO5', jd0)]
+    return fits.Header(cards)
+
+
+def write_uvfits(vis, uvfits=None, arrayloc=None, arrayconf=None,
+                 scan_start=None, object_name='', telescope='',
+                 chunk=2 ** 17):
+    """
+    Convert a visgen .vis file to UVFITS without running maps2uvfits.
+
+    Parameters
+    ----------
+    vis: str
+        visgen visibility file.
+    uvfits: str, optional
+        Output file. (vis - '.vis') + '.uvfits' if None.
+    arrayloc: (str, str, str)
+        Array latitude, longitude and height, as in
+        `settings.MAPS.ARRAY_LOC`.
+    arrayconf: str
+        Array configuration file, as in `settings.MAPS.ARRAY_CONFIG`.
+    scan_start: str or list of str
+        Scan_start of the visgen spec, or of each scan of a multi-scan
+        file. The .vis time stamps count from it; the reference date is
+        that of the first scan (see `reference_time`).
+    object_name, telescope: str, optional
+        OBJECT and TELESCOP keywords.
+    chunk: int, optional
+        Number of visibility records converted and written at a time.
+
+    Return
+    ------
+    out: str
+        Name of the UVFITS file.
+
+    """
+    if uvfits is None:
+        uvfits = vis.rsplit('/', 1)[-1][0:-4] + '.uvfits'
+    vf = visfile.VisFile(vis)
+    if scan_start is None:
+        raise ValueError('scan_start of {0} is required'.format(vis))
+    if isinstance(scan_start, str):
+        scan_start = [scan_start] * len(vf)
+    if len(scan_start) != len(vf):
+        raise ValueError('{0} has {1:d} scans, got {2:d} scan starts'
+                         .format(vis, len(vf), len(scan_start)))
+    rdate, gstia0, jd0, _ = reference_time(scan_start[0])
+    first = vf.header(0)
+    shape = (int(first['nchan']), int(first['npol']))
+    for i in range(len(vf)):
+        h = vf.header(i)
+        if (int(h['nchan']), int(h['npol'])) != shape:
+            raise ValueError('Scans of {0} differ in nchan/npol'.format(vis))
+    gcount = sum(int(vf.header(i)['ntime']) * int(vf.header(i)['nbaseline'])
+                 for i in range(len(vf)))
+    header = primary_header(first, gcount, object_name=object_name,
+                            telescope=telescope, jd0=jd0)
+    nchan, npol = shape
+    width = 5 + 3 * nchan * npol
+    nbytes = 0
+    with open(uvfits, 'wb') as f:
+        f.write(header.tostring().encode('ascii'))
+        for i in range(len(vf)):
+            freq = float(vf.header(i)['freq'])
+            day = reference_time(scan_start[i])[3] - jd0
+            rec = vf.scan(i).reshape(-1)
+            for start in range(0, len(rec), chunk):
+                r = rec[start:start + chunk]
+                group = np.empty((len(r), width), dtype='>f4')
+                group[:, 0] = r['u'] / freq
+                group[:, 1] = r['v'] / freq
+                group[:, 2] = r['w'] / freq
+                group[:, 3] = r['baseline']
+                group[:, 4] = day + r['time'] / 86400.
+                data = group[:, 5:].reshape(len(r), nchan, npol, 3)
+                data[..., 0] = r['vis'].real
+                data[..., 1] = r['vis'].imag
+                data[..., 2] = 1.0
+                f.write(group.tobytes())
+                nbytes += group.nbytes
+        f.write(b'\0' * (-nbytes % _BLOCK))
+    an = antenna_table(arrayloc, arrayconf, float(first['freq']), rdate,
+                       gstia0)
+    fits.append(uvfits, an.data, an.header)
+    return uvfits
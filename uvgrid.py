@@ -0,0 +1,328 @@
+"""
+In-process NumPy replacement of maps_im2uv.
+
+The engine reads a SIN-projected FITS image (memory-mapped), applies the
+normalizer and zero padding, Fourier transforms it with NumPy and writes a
+uv-grid file. `cube2uv` grids a 3-D image cube plane by plane with bounded
+memory.
+
+Experimental: the file layout below (`HEADER_DTYPE`, `GRID_DTYPE`) has not
+been verified against the output of maps_im2uv, so visgen may not read the
+files written here. The engine is therefore not a backend of `pymaps.im2uv`
+or `driftscan.Drift`, which always run maps_im2uv; it can be wired in once
+its output is compared byte for byte with maps_im2uv.
+
+"""
+from __future__ import print_function, division
+
+import threading
+import warnings
+
+import numpy as np
+from astropy.io import fits
+
+from . import astro
+
+
+# Assumed (unverified) layout of the uv-grid file: a fixed little-endian
+# header followed by the (nv, nu) complex64 grid in row-major order with the
+# zero spacing at (nv // 2, nu // 2).
+HEADER_DTYPE = np.dtype([('nu', '<i4'), ('nv', '<i4'),
+                         ('du', '<f8'), ('dv', '<f8'),
+                         ('ra', '<f8'), ('dec', '<f8'),
+                         ('freq', '<f8')])
+GRID_DTYPE = np.dtype('<c8')
+
+
+def _image_plane(data):
+    """
+    Return a 2-D view of the image, dropping degenerate FREQ/STOKES axes.
+
+    """
+    while data.ndim > 2:
+        if data.shape[0] != 1:
+            raise ValueError('Expect a single-plane image, got shape {0}'
+                             .format(data.shape))
+        data = data[0]
+    return data
+
+
+def read_header(header):
+    """
+    Extract the gridding parameters from a FITS header.
+
+    Return
+    ------
+    out: dict
+        Pixel sizes (cdelt1, cdelt2) in degrees, reference position
+        (ra, dec) in degrees and frequency in Hz (0 if not present).
+
+    """
+    freq = 0.0
+    for i in range(3, header.get('NAXIS', 2) + 1):
+        if header.get('CTYPE{0:d}'.format(i), '').startswith('FREQ'):
+            freq = header['CRVAL{0:d}'.format(i)]
+    return {'cdelt1': header['CDELT1'], 'cdelt2': header['CDELT2'],
+            'ra': header.get('CRVAL1', 0.0), 'dec': header.get('CRVAL2', 0.0),
+            'freq': freq}
+
+
+class UVGridEngine(object):
+    """
+    NumPy uv-gridding engine.
+
+    An engine keeps its padded work buffer between calls, so gridding the
+    channels of a batch with the same image size does not reallocate it.
+    The buffer makes an engine unsafe to share between threads; use one
+    engine per thread (see `thread_engine`).
+
+    """
+    def __init__(self):
+        self._buf = None
+
+    def _buffer(self, shape):
+        if self._buf is None or self._buf.shape != shape:
+            self._buf = np.empty(shape, dtype=np.complex128)
+        return self._buf
+
+    def grid(self, image, cdelt1, cdelt2, normalizer=None,
+             padzeropixels=None):
+        """
+        Fourier transform a 2-D image into a centred uv-grid.
+
+        Parameters
+        ----------
+        image: 2-D array-like
+            Image in SIN projection, indexed [dec, ra].
+        cdelt1, cdelt2: float
+            Pixel sizes in degrees.
+        normalizer: float, optional
+            Multiply the pixel value by this value.
+        padzeropixels: int, optional
+            Pad the image with this number of zero pixels on each side.
+
+        Return
+        ------
+        out: (ndarray, float, float)
+            Complex uv-grid and its cell sizes du, dv in wavelengths.
+
+        """
+        ny, nx = image.shape
+        pad = padzeropixels or 0
+        nv, nu = ny + 2 * pad, nx + 2 * pad
+        buf = self._buffer((nv, nu))
+        buf[...] = 0
+        # Flip axes with negative increments (RA) so that l, m increase
+        # with pixel index; both are views.
+        if cdelt1 < 0:
+            image = image[:, ::-1]
+        if cdelt2 < 0:
+            image = image[::-1, :]
+        # Scale to flux per pixel while copying the image into the buffer.
+        scale = abs(np.radians(cdelt1) * np.radians(cdelt2))
+        if normalizer is not None:
+            scale *= normalizer
+        # Place the image centre at index 0, i.e. an ifftshift of the padded
+        # image done while copying. The first nv // 2 - pad rows
+        # (nu // 2 - pad columns) wrap around to the end of the buffer.
+        ry, rx = nv // 2 - pad, nu // 2 - pad
+        for ys, yd in ((slice(0, ry), slice(nv - ry, nv)),
+                       (slice(ry, ny), slice(0, ny - ry))):
+            for xs, xd in ((slice(0, rx), slice(nu - rx, nu)),
+                           (slice(rx, nx), slice(0, nx - rx))):
+                np.multiply(image[ys, xs], scale, out=buf[yd, xd])
+        uv = np.fft.fftshift(np.fft.fft2(buf))
+        du = 1. / (nu * abs(np.radians(cdelt1)))
+        dv = 1. / (nv * abs(np.radians(cdelt2)))
+        return uv, du, dv
+
+    def im2uv(self, fitsfile, vis, normalizer=None, padzeropixels=None):
+        """
+        Grid a FITS image and write the uv-grid file `vis`.
+
+        """
+        with fits.open(fitsfile, memmap=True) as hdul:
+            hdr = read_header(hdul[0].header)
+            image = _image_plane(hdul[0].data)
+            uv, du, dv = self.grid(image, hdr['cdelt1'], hdr['cdelt2'],
+                                   normalizer=normalizer,
+                                   padzeropixels=padzeropixels)
+            del image
+        write_uvgrid(vis, uv, du, dv, hdr['ra'], hdr['dec'], hdr['freq'])
+
+
+def write_uvgrid(vis, uv, du, dv, ra, dec, freq):
+    """
+    Write a uv-grid file.
+
+    """
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header['nv'], header['nu'] = uv.shape
+    header['du'], header['dv'] = du, dv
+    header['ra'], header['dec'] = ra, dec
+    header['freq'] = freq
+    with open(vis, 'wb') as f:
+        header.tofile(f)
+        uv.astype(GRID_DTYPE).tofile(f)
+
+
+def read_uvgrid(vis):
+    """
+    Memory-map a uv-grid file.
+
+    Return
+    ------
+    out: (numpy.void, ndarray)
+        Header record and the (nv, nu) complex grid.
+
+    """
+    header = np.fromfile(vis, dtype=HEADER_DTYPE, count=1)[0]
+    uv = np.memmap(vis, dtype=GRID_DTYPE, mode='r',
+                   offset=HEADER_DTYPE.itemsize,
+                   shape=(int(header['nv']), int(header['nu'])))
+    return header, uv
+
+
+_LOCAL = threading.local()
+
+
+def thread_engine():
+    """
+    The engine of the calling thread. Drifts run in threads by the
+    schedulers and `aiomaps` each get their own work buffer.
+
+    """
+    try:
+        return _LOCAL.engine
+    except AttributeError:
+        _LOCAL.engine = UVGridEngine()
+        return _LOCAL.engine
+
+
+def im2uv(fitsfile, vis=None, normalizer=None, padzeropixels=None):
+    """
+    Convert a FITS image into a visgen uv-grid without running maps_im2uv.
+
+    Parameters are the same as `pymaps.im2uv`. The engine of the calling
+    thread is reused, so its consecutive calls share the work buffer.
+
+    """
+    if vis is None:
+        vis = fitsfile.rsplit('/', 1)[-1][0:-5] + '.dat'
+    thread_engine().im2uv(fitsfile, vis, normalizer=normalizer,
+                          padzeropixels=padzeropixels)
+    return vis
+
+
+_BITPIX = {8: '>u1', 16: '>i2', 32: '>i4', 64: '>i8', -32: '>f4', -64: '>f8'}
+
+
+def iter_planes(cubefile, planes=None):
+    """
+    Iterate over the frequency planes of a FITS image cube.
+
+    Each plane is memory-mapped on its own and released before the next
+    one, so memory use does not depend on the depth of the cube. For cubes
+    with a Stokes axis, the first Stokes plane is used.
+
+    Parameters
+    ----------
+    cubefile: str
+        FITS cube with axes (RA, Dec, FREQ[, STOKES]).
+    planes: iterable of int, optional
+        Indices of the planes to read. All planes if None.
+
+    Yield
+    -----
+    out: (int, ndarray, float, dict)
+        Plane index, 2-D plane (memory-mapped unless BSCALE/BZERO apply),
+        frequency in Hz and the gridding parameters of `read_header`.
+
+    """
+    with fits.open(cubefile, memmap=False, do_not_scale_image_data=True) \
+            as hdul:
+        header = hdul[0].header
+        datloc = hdul.fileinfo(0)['datLoc']
+    nx, ny = header['NAXIS1'], header['NAXIS2']
+    nplane = header.get('NAXIS3', 1)
+    faxis = 3
+    for i in range(3, header['NAXIS'] + 1):
+        if header.get('CTYPE{0:d}'.format(i), '').startswith('FREQ'):
+            faxis = i
+    if faxis != 3:
+        raise ValueError('Expect the frequency on axis 3 of ' + cubefile)
+    crval = header.get('CRVAL3', 0.0)
+    cdelt = header.get('CDELT3', 0.0)
+    crpix = header.get('CRPIX3', 1.0)
+    bscale = header.get('BSCALE', 1.0)
+    bzero = header.get('BZERO', 0.0)
+    dtype = np.dtype(_BITPIX[header['BITPIX']])
+    params = read_header(header)
+    if planes is None:
+        planes = range(nplane)
+    for k in planes:
+        freq = crval + (k + 1 - crpix) * cdelt
+        plane = np.memmap(cubefile, dtype=dtype, mode='r', shape=(ny, nx),
+                          offset=datloc + k * nx * ny * dtype.itemsize)
+        if bscale != 1.0 or bzero != 0.0:
+            plane = plane * bscale + bzero
+        params['freq'] = freq
+        yield k, plane, freq, params
+        del plane
+
+
+def cube2uv(cubefile, prefix=None, planes=None, convert_k2jysr=False,
+            normalizer=None, padzeropixels=None, engine=None):
+    """
+    Stream a FITS image cube into one visgen uv-grid per plane.
+
+    Planes are read, converted and gridded one at a time; no intermediate
+    single-channel FITS file is written and peak memory is set by the plane
+    size, not the cube depth.
+
+    The files have the unverified layout of this module (see the module
+    docstring), so visgen may not read them; a warning is issued.
+
+    Parameters
+    ----------
+    cubefile: str
+        FITS cube with axes (RA, Dec, FREQ[, STOKES]).
+    prefix: str, optional
+        Prefix of the output uv-grid files, named
+        (prefix + '_{plane:04d}.dat'). (cubefile - '.fits') if None.
+    planes: iterable of int, optional
+        Indices of the planes to grid. All planes if None.
+    convert_k2jysr: boolean, optional
+        Convert each plane from K to Jy/sr at its own frequency, using the
+        factors of `astro.jy_per_k`.
+    normalizer: float, optional
+        Additional factor applied to every plane.
+    padzeropixels: int, optional
+        Pad each plane with this number of zero pixels on each side.
+    engine: `UVGridEngine`, optional
+        Engine to grid with. The engine of the calling thread if None; its
+        work buffer is reused across planes.
+
+    Yield
+    -----
+    out: (str, float)
+        Name of the uv-grid file and the frequency of the plane in MHz.
+
+    """
+    warnings.warn('cube2uv writes an unverified uv-grid layout that visgen '
+                  'may not read')
+    if prefix is None:
+        prefix = cubefile.rsplit('/', 1)[-1][0:-5]
+    if engine is None:
+        engine = thread_engine()
+    for k, plane, freq, params in iter_planes(cubefile, planes):
+        scale = 1.0 if normalizer is None else normalizer
+        if convert_k2jysr:
+            scale *= astro.jy_per_k(freq / 1e6)
+        uv, du, dv = engine.grid(plane, params['cdelt1'], params['cdelt2'],
+                                 normalizer=scale,
+                                 padzeropixels=padzeropixels)
+        del plane
+        vis = '{0}_{1:04d}.dat'.format(prefix, k)
+        write_uvgrid(vis, uv, du, dv, params['ra'], params['dec'], freq)
+        yield vis, freq / 1e6
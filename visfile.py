@@ -0,0 +1,211 @@
+"""
+Reader of binary visibility files (*.vis) in an assumed visgen layout.
+
+A .vis file is a sequence of scan blocks, one per scan of the spec file.
+Each block is a fixed little-endian header (`HEADER_DTYPE`) followed by
+``nbaseline * ntime`` fixed-size records (`record_dtype`), ordered by time
+and then by baseline. `VisFile` memory-maps the records of each block as
+NumPy structured arrays without copying them.
+
+Experimental: this layout has not been verified against the visgen writer,
+and its only producer is the stub visgen of `bench`. The drift pipeline
+therefore never reads .vis files: `driftscan.Drift` and `DriftSweep` hand
+the visgen output to maps2uvfits only. `store.VisStore` and
+`uvfits.write_uvfits`, which build on this module, are standalone and
+experimental too, and `scan_blocks` warns each time it parses a file.
+
+"""
+from __future__ import print_function, division
+
+import os
+import warnings
+
+import numpy as np
+
+
+# Assumed (unverified) scan block header.
+HEADER_DTYPE = np.dtype([('nbaseline', '<i4'), ('ntime', '<i4'),
+                         ('nchan', '<i4'), ('npol', '<i4'),
+                         ('freq', '<f8'), ('chan_bw', '<f8'),
+                         ('int_time', '<f8'),
+                         ('ra', '<f8'), ('dec', '<f8')])
+
+
+def record_dtype(nchan=1, npol=4):
+    """
+    Data type of one visibility record.
+
+    u, v, w are in wavelengths at the first channel, baseline is the AIPS
+    baseline number (256 * ant1 + ant2) and time is in seconds from the
+    start of the scan.
+
+    """
+    return np.dtype([('u', '<f8'), ('v', '<f8'), ('w', '<f8'),
+                     ('baseline', '<i4'), ('time', '<f8'),
+                     ('vis', '<c8', (nchan, npol))])
+
+
+def scan_blocks(filename):
+    """
+    Locate the scan blocks of a .vis file.
+
+    Return
+    ------
+    out: list of (int, numpy.void, int)
+        Byte offset, header and size in bytes (header included) of each
+        block.
+
+    """
+    warnings.warn('the .vis layout of visfile is not verified against '
+                  'visgen; {0} may be misread'.format(filename))
+    size = os.path.getsize(filename)
+    blocks = []
+    offset = 0
+    with open(filename, 'rb') as f:
+        while offset < size:
+            f.seek(offset)
+            header = np.fromfile(f, dtype=HEADER_DTYPE, count=1)
+            if len(header) == 0:
+                break
+            header = header[0]
+            nrec = int(header['nbaseline']) * int(header['ntime'])
+            nbytes = HEADER_DTYPE.itemsize + nrec * record_dtype(
+                int(header['nchan']), int(header['npol'])).itemsize
+            if offset + nbytes > size:
+                raise ValueError('Truncated scan block at byte {0:d} of {1}'
+                                 .format(offset, filename))
+            blocks.append((offset, header, nbytes))
+            offset += nbytes
+    return blocks
+
+
+def split_scans(filename, outputs, bufsize=2 ** 24):
+    """
+    Split a multi-scan .vis file into one single-scan .vis file per scan.
+
+    Parameters
+    ----------
+    filename: str
+        Multi-scan .vis file.
+    outputs: list of str
+        Output file names, one per scan block in file order.
+
+    """
+    blocks = scan_blocks(filename)
+    if len(blocks) != len(outputs):
+        raise ValueError('{0} has {1:d} scans, expected {2:d}'
+                         .format(filename, len(blocks), len(outputs)))
+    with open(filename, 'rb') as src:
+        for (offset, header, nbytes), out in zip(blocks, outputs):
+            src.seek(offset)
+            with open(out, 'wb') as dst:
+                while nbytes > 0:
+                    chunk = src.read(min(bufsize, nbytes))
+                    if not chunk:
+                        raise ValueError('Unexpected end of ' + filename)
+                    dst.write(chunk)
+                    nbytes -= len(chunk)
+
+
+def decode_baseline(baseline):
+    """
+    Split AIPS baseline numbers (256 * ant1 + ant2) into (ant1, ant2).
+
+    """
+    return np.divmod(np.asarray(baseline), 256)
+
+
+class VisFile(object):
+    """
+    Memory-mapped reader of a visgen .vis file.
+
+    Records are never read until they are accessed; `scan` returns a
+    read-only memory map, `select` slices it by time and baseline.
+
+    Parameters
+    ----------
+    filename: str
+        Name of the .vis file.
+
+    Examples
+    --------
+    >>> vf = VisFile('drift.vis')
+    >>> rec = vf.select(time=(10., 20.), baseline=[257, 258])
+    >>> rec['vis'][..., 0]      # XX visibilities of two baselines
+
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.blocks = scan_blocks(filename)
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __repr__(self):
+        return 'VisFile({0!r}, scans={1:d})'.format(self.filename, len(self))
+
+    def header(self, scan=0):
+        """
+        Header record of a scan.
+
+        """
+        return self.blocks[scan][1]
+
+    def scan(self, scan=0):
+        """
+        Records of a scan as a (ntime, nbaseline) structured memory map.
+
+        """
+        offset, header, nbytes = self.blocks[scan]
+        ntime, nbl = int(header['ntime']), int(header['nbaseline'])
+        dtype = record_dtype(int(header['nchan']), int(header['npol']))
+        return np.memmap(self.filename, dtype=dtype, mode='r',
+                         offset=offset + HEADER_DTYPE.itemsize,
+                         shape=(ntime, nbl))
+
+    def times(self, scan=0):
+        """
+        Time stamps of a scan [second].
+
+        """
+        return np.array(self.scan(scan)['time'][:, 0])
+
+    def baselines(self, scan=0):
+        """
+        Baseline numbers of a scan, in record order.
+
+        """
+        return np.array(self.scan(scan)['baseline'][0])
+
+    def select(self, scan=0, time=None, baseline=None):
+        """
+        Slice the records of a scan.
+
+        Parameters
+        ----------
+        scan: int, optional
+            Index of the scan block.
+        time: (float, float), optional
+            Keep time stamps t with time[0] <= t < time[1].
+        baseline: int or list of int, optional
+            Keep these baseline numbers.
+
+        Return
+        ------
+        out: ndarray
+            Structured records of shape (ntime, nbaseline). A time-only
+            selection is a view of the memory map; selecting baselines
+            copies the selected records only.
+
+        """
+        rec = self.scan(scan)
+        if time is not None:
+            t = rec['time'][:, 0]
+            start, stop = np.searchsorted(t, time[0]), \
+                np.searchsorted(t, time[1])
+            rec = rec[start:stop]
+        if baseline is not None:
+            bl = rec['baseline'][0] if len(rec) else self.baselines(scan)
+            idx = np.flatnonzero(np.isin(bl, np.atleast_1d(baseline)))
+            rec = rec[:, idx]
+        return rec
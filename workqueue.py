@@ -0,0 +1,372 @@
+"""
+Multi-node work queue for drift sweeps.
+
+The queue is a single SQLite file on a filesystem shared by the workers.
+Each job is a pickled `driftscan.Drift`. A worker claims the oldest pending
+job under a lease, renews the lease with a heartbeat while the drift runs,
+and marks the job done or failed when it finishes. A job whose lease has
+expired, because its worker died or lost the filesystem, is put back to
+pending by the next claim, up to `max_attempts` attempts.
+
+Fill a queue, start workers on any number of hosts, and watch progress::
+
+    >>> q = WorkQueue('sweep.queue')
+    >>> q.put(drifts)
+
+    $ python -m pwmaps.workqueue worker sweep.queue --workdir /data/sweep
+    $ python -m pwmaps.workqueue status sweep.queue
+
+SQLite locking relies on POSIX advisory locks of the shared filesystem;
+use a filesystem where they work across hosts (e.g. NFSv4, Lustre with
+flock enabled).
+
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import time
+import pickle
+import socket
+import sqlite3
+import argparse
+import threading
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    payload BLOB,
+    state TEXT DEFAULT 'pending',
+    attempts INTEGER DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    started REAL,
+    finished REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+'''
+
+STATES = ('pending', 'running', 'done', 'failed')
+
+
+def worker_id():
+    return '{0}:{1:d}'.format(socket.gethostname(), os.getpid())
+
+
+class WorkQueue(object):
+    """
+    SQLite-backed queue of drift jobs with leases.
+
+    Parameters
+    ----------
+    filename: str
+        Queue file. Created if it does not exist.
+    lease: float, optional
+        Lease of a claimed job [second]. Workers renew it every lease / 3
+        seconds while the drift runs; a job whose lease expires is
+        requeued.
+    max_attempts: int, optional
+        Maximum number of times a job is started. A job that has used them
+        up is marked failed.
+
+    """
+    def __init__(self, filename, lease=300.0, max_attempts=3):
+        self.filename = os.path.abspath(filename)
+        self.lease = lease
+        self.max_attempts = max_attempts
+        db = sqlite3.connect(self.filename, timeout=60.0)
+        try:
+            db.executescript(_SCHEMA)
+        finally:
+            db.close()
+
+    def __repr__(self):
+        return 'WorkQueue({0!r})'.format(self.filename)
+
+    def _connect(self):
+        db = sqlite3.connect(self.filename, timeout=60.0,
+                             isolation_level=None)
+        return _Transaction(db)
+
+    def put(self, drifts):
+        """
+        Add drifts (a list of `Drift` or a `DriftGrid`) as pending jobs.
+
+        Return
+        ------
+        out: int
+            Number of jobs added.
+
+        """
+        rows = [(d.name, sqlite3.Binary(pickle.dumps(d, protocol=2)))
+                for d in drifts]
+        with self._connect() as db:
+            db.executemany('INSERT INTO jobs (name, payload) VALUES (?, ?)',
+                           rows)
+        return len(rows)
+
+    def _expire(self, db, now):
+        db.execute("UPDATE jobs SET state = 'failed', worker = NULL, "
+                   "error = 'lease expired' WHERE state = 'running' AND "
+                   "lease_until < ? AND attempts >= ?",
+                   (now, self.max_attempts))
+        db.execute("UPDATE jobs SET state = 'pending', worker = NULL "
+                   "WHERE state = 'running' AND lease_until < ?", (now,))
+
+    def claim(self, worker=None):
+        """
+        Claim the oldest pending job, first requeueing expired leases.
+
+        Return
+        ------
+        out: (int, `Drift`) or None
+            Job id and drift, or None if no job is pending.
+
+        """
+        worker = worker or worker_id()
+        now = time.time()
+        with self._connect() as db:
+            self._expire(db, now)
+            row = db.execute("SELECT id, payload FROM jobs WHERE "
+                             "state = 'pending' ORDER BY id LIMIT 1")\
+                .fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE jobs SET state = 'running', worker = ?, "
+                       "lease_until = ?, started = ?, "
+                       "attempts = attempts + 1 WHERE id = ?",
+                       (worker, now + self.lease, now, row[0]))
+        return row[0], pickle.loads(bytes(row[1]))
+
+    def heartbeat(self, job_id, worker=None):
+        """
+        Renew the lease of a job.
+
+        Return
+        ------
+        out: boolean
+            False if the job is no longer leased to this worker.
+
+        """
+        with self._connect() as db:
+            cur = db.execute("UPDATE jobs SET lease_until = ? WHERE id = ? "
+                             "AND worker = ? AND state = 'running'",
+                             (time.time() + self.lease, job_id,
+                              worker or worker_id()))
+            return cur.rowcount == 1
+
+    def complete(self, job_id, worker=None, error=None, retry=False):
+        """
+        Mark a job done, or failed with an error message. With `retry`, a
+        failed job with attempts left goes back to pending instead.
+
+        """
+        state = 'done' if error is None else 'failed'
+        with self._connect() as db:
+            if retry and error is not None:
+                db.execute("UPDATE jobs SET state = 'pending', worker = NULL,"
+                           " error = ? WHERE id = ? AND worker = ? AND "
+                           "attempts < ?", (error, job_id,
+                                            worker or worker_id(),
+                                            self.max_attempts))
+            db.execute("UPDATE jobs SET state = ?, finished = ?, error = ? "
+                       "WHERE id = ? AND worker = ? AND state = 'running'",
+                       (state, time.time(), error, job_id,
+                        worker or worker_id()))
+
+    def requeue(self, state='failed'):
+        """
+        Put all jobs of a state back to pending with fresh attempts.
+
+        """
+        with self._connect() as db:
+            return db.execute("UPDATE jobs SET state = 'pending', "
+                              "attempts = 0, worker = NULL WHERE state = ?",
+                              (state,)).rowcount
+
+    def status(self):
+        """
+        Progress of the queue.
+
+        Return
+        ------
+        out: dict
+            Number of jobs per state, running workers, throughput over the
+            finished jobs [job/second] and the ETA of the pending and
+            running jobs at that rate [second].
+
+        """
+        with self._connect() as db:
+            counts = dict(db.execute('SELECT state, COUNT(*) FROM jobs '
+                                     'GROUP BY state').fetchall())
+            workers = [r[0] for r in db.execute(
+                "SELECT DISTINCT worker FROM jobs WHERE state = 'running'")]
+            first, last = db.execute('SELECT MIN(started), MAX(finished) '
+                                     "FROM jobs WHERE state = 'done'")\
+                .fetchone()
+        out = dict((s, counts.get(s, 0)) for s in STATES)
+        out['workers'] = workers
+        rate = out['done'] / (last - first) if out['done'] and last > first \
+            else None
+        out['rate'] = rate
+        out['eta'] = (out['pending'] + out['running']) / rate if rate \
+            else None
+        return out
+
+    def failures(self):
+        """
+        (name, attempts, error) of the failed jobs.
+
+        """
+        with self._connect() as db:
+            return db.execute("SELECT name, attempts, error FROM jobs WHERE "
+                              "state = 'failed' ORDER BY id").fetchall()
+
+
+class _Transaction(object):
+    """
+    Connection context running its statements in one IMMEDIATE
+    transaction, so claims of concurrent workers are serialized.
+
+    """
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.db.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+        finally:
+            self.db.close()
+        return False
+
+
+class _Heartbeat(threading.Thread):
+    def __init__(self, queue, job_id, worker):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = queue
+        self.job_id = job_id
+        self.worker = worker
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.queue.lease / 3.):
+            try:
+                if not self.queue.heartbeat(self.job_id, self.worker):
+                    print('# workqueue: lost lease of job {0:d}'
+                          .format(self.job_id))
+                    return
+            except sqlite3.Error as e:
+                print('# workqueue: heartbeat failed: {0}'.format(e))
+
+
+def work(queue, mpi=1, max_jobs=None, wait=False, poll=10.0):
+    """
+    Run jobs from a queue until it is empty.
+
+    Parameters
+    ----------
+    queue: str or `WorkQueue`
+        The queue.
+    mpi: int, optional
+        visgen MPI ranks per drift.
+    max_jobs: int, optional
+        Stop after this many jobs.
+    wait: boolean, optional
+        Keep polling for new jobs while others are still running, instead
+        of exiting when no job is pending.
+    poll: float, optional
+        Polling interval when waiting [second].
+
+    Return
+    ------
+    out: int
+        Number of jobs run.
+
+    """
+    from .driftscan import TRANSIENT, PERMANENT
+    if not isinstance(queue, WorkQueue):
+        queue = WorkQueue(queue)
+    worker = worker_id()
+    n = 0
+    while max_jobs is None or n < max_jobs:
+        job = queue.claim(worker)
+        if job is None:
+            if wait and queue.status()['running']:
+                time.sleep(poll)
+                continue
+            break
+        job_id, drift = job
+        print('# workqueue: {0} runs job {1:d} ({2})'
+              .format(worker, job_id, drift.name))
+        beat = _Heartbeat(queue, job_id, worker)
+        beat.start()
+        try:
+            drift.run(mpi=mpi)
+        except Exception as e:
+            queue.complete(job_id, worker,
+                           '{0}: {1}'.format(type(e).__name__, e),
+                           retry=isinstance(e, TRANSIENT) and
+                           not isinstance(e, PERMANENT))
+        else:
+            queue.complete(job_id, worker)
+        finally:
+            beat.stopped.set()
+            beat.join()
+        n += 1
+    return n
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Multi-node work queue for drift sweeps.')
+    sub = parser.add_subparsers(dest='command')
+    p = sub.add_parser('worker', help='run jobs until the queue is empty')
+    p.add_argument('queue')
+    p.add_argument('--mpi', type=int, default=1)
+    p.add_argument('--lease', type=float, default=300.0,
+                   help='job lease [second]')
+    p.add_argument('--max-jobs', type=int, default=None)
+    p.add_argument('--wait', action='store_true',
+                   help='wait for running jobs that may be requeued')
+    p.add_argument('--workdir', default=None,
+                   help='directory the drift outputs are written to')
+    p = sub.add_parser('status', help='print the progress of a queue')
+    p.add_argument('queue')
+    p = sub.add_parser('requeue', help='put failed jobs back to pending')
+    p.add_argument('queue')
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.error('a command is required')
+    if args.command == 'worker':
+        queue = WorkQueue(args.queue, lease=args.lease)
+        if args.workdir is not None:
+            os.chdir(args.workdir)
+        work(queue, mpi=args.mpi, max_jobs=args.max_jobs, wait=args.wait)
+    elif args.command == 'status':
+        queue = WorkQueue(args.queue)
+        st = queue.status()
+        print('pending {0:d}, running {1:d}, done {2:d}, failed {3:d}'
+              .format(st['pending'], st['running'], st['done'],
+                      st['failed']))
+        if st['rate']:
+            print('{0:.3f} job/s, ETA {1:.0f} s'.format(st['rate'],
+                                                        st['eta']))
+        for w in st['workers']:
+            print('worker ' + w)
+        for name, attempts, error in queue.failures():
+            print('failed {0} after {1:d} attempt(s): {2}'
+                  .format(name, attempts, error))
+    elif args.command == 'requeue':
+        print('requeued {0:d} jobs'.format(WorkQueue(args.queue).requeue()))
+
+
+if __name__ == '__main__':
+    sys.exit(main())